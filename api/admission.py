@@ -0,0 +1,241 @@
+# api/admission.py - Control de admisión de /api/chat: límites por usuario, límite global y cola acotada
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+logger = logging.getLogger("admission")
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() in ("1", "true", "yes")
+# Con gunicorn cada petición en curso o en cola ocupa un hilo: se reservan hilos para el resto de rutas
+_THREADS = int(os.environ.get("GUNICORN_THREADS", "8"))
+ADMISSION_MAX_IN_FLIGHT = int(os.environ.get("ADMISSION_MAX_IN_FLIGHT", str(max(1, _THREADS - 3))))
+ADMISSION_PER_USER_LIMIT = int(os.environ.get("ADMISSION_PER_USER_LIMIT", "2"))
+ADMISSION_QUEUE_SIZE = int(os.environ.get("ADMISSION_QUEUE_SIZE", "2"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", "3"))
+ADMISSION_MAX_RETRY_AFTER = int(os.environ.get("ADMISSION_MAX_RETRY_AFTER", "30"))
+ADMISSION_WINDOW = int(os.environ.get("ADMISSION_WINDOW", "500"))
+
+_REJECTION_MESSAGES = {
+    "user_limit": "Demasiadas conversaciones simultáneas para este usuario.",
+    "queue_full": "El servidor está ocupado. Inténtalo de nuevo en unos segundos.",
+    "queue_timeout": "El servidor está ocupado. Inténtalo de nuevo en unos segundos.",
+}
+
+
+@dataclass
+class Rejection:
+    reason: str
+    retry_after: int
+
+    @property
+    def message(self) -> str:
+        return _REJECTION_MESSAGES.get(self.reason, "Petición rechazada")
+
+    def payload(self) -> Dict[str, Any]:
+        return {"error": self.message, "reason": self.reason, "retry_after": self.retry_after}
+
+
+class AdmissionTicket:
+    """Plaza concedida. Se libera cuando la sueltan todos sus titulares.
+
+    Por defecto el único titular es la respuesta; release() es idempotente por
+    titular para poder llamarlo desde varios cierres.
+    """
+
+    def __init__(self, controller: "AdmissionController", user_id: str):
+        self._controller = controller
+        self.user_id = user_id
+        self.granted_at = time.monotonic()
+        self._holders = {"response"}
+        self._released = False
+        self._lock = threading.Lock()
+
+    def retain(self, holder: str):
+        """Añade un titular (p. ej. una generación que sigue tras cerrar la respuesta)"""
+        with self._lock:
+            if not self._released:
+                self._holders.add(holder)
+
+    def release(self, holder: str = "response"):
+        with self._lock:
+            self._holders.discard(holder)
+            if self._released or self._holders:
+                return
+            self._released = True
+        self._controller._release(self)
+
+
+class _Waiter:
+    def __init__(self, user_id: str, wake: Callable[[], None]):
+        self.user_id = user_id
+        self.wake = wake
+        self.enqueued_at = time.monotonic()
+        self.ticket: Optional[AdmissionTicket] = None
+
+
+class AdmissionController:
+    """Admite peticiones de chat con límite por usuario, límite global y una cola FIFO corta.
+
+    Lo que no cabe se rechaza de inmediato con un Retry-After estimado a partir de
+    la duración media de los streams, en lugar de bloquear hilos indefinidamente.
+    """
+
+    def __init__(self, max_in_flight: int = ADMISSION_MAX_IN_FLIGHT, per_user: int = ADMISSION_PER_USER_LIMIT,
+                 queue_size: int = ADMISSION_QUEUE_SIZE, queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+                 enabled: bool = ADMISSION_ENABLED):
+        self.max_in_flight = max_in_flight
+        self.per_user = per_user
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._per_user: Dict[str, int] = {}
+        self._queue: "deque[_Waiter]" = deque()
+        self._hold_avg = 5.0
+        self._waits = deque(maxlen=ADMISSION_WINDOW)
+        self.stats = {"admitted": 0, "queued": 0, "rejected_user_limit": 0, "rejected_queue_full": 0,
+                      "rejected_queue_timeout": 0}
+
+    # --- Estado interno (siempre bajo self._lock) ---
+
+    def _grant(self, user_id: str) -> AdmissionTicket:
+        self._in_flight += 1
+        self.stats["admitted"] += 1
+        return AdmissionTicket(self, user_id)
+
+    def _retry_after(self, waiting: int) -> int:
+        estimate = self._hold_avg * (waiting + 1) / max(1, self.max_in_flight)
+        return max(1, min(ADMISSION_MAX_RETRY_AFTER, math.ceil(estimate)))
+
+    def _reject(self, reason: str, retry_after: int) -> Rejection:
+        self.stats[f"rejected_{reason}"] += 1
+        return Rejection(reason, retry_after)
+
+    def _try_enter(self, user_id: str, wake: Callable[[], None]):
+        """Devuelve (ticket, None, None), (None, waiter, None) o (None, None, rechazo)"""
+        if self._per_user.get(user_id, 0) >= self.per_user:
+            return None, None, self._reject("user_limit", max(1, math.ceil(self._hold_avg)))
+        if self._in_flight < self.max_in_flight and not self._queue:
+            self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+            self._waits.append(0.0)
+            return self._grant(user_id), None, None
+        if len(self._queue) >= self.queue_size:
+            return None, None, self._reject("queue_full", self._retry_after(len(self._queue)))
+        # Las plazas en cola cuentan para el límite del usuario
+        self._per_user[user_id] = self._per_user.get(user_id, 0) + 1
+        waiter = _Waiter(user_id, wake)
+        self._queue.append(waiter)
+        self.stats["queued"] += 1
+        return None, waiter, None
+
+    def _abandon(self, waiter: _Waiter) -> Optional[Rejection]:
+        """El waiter dejó de esperar: si ya tenía plaza la conserva, si no sale de la cola"""
+        if waiter.ticket is not None:
+            return None
+        try:
+            self._queue.remove(waiter)
+        except ValueError:
+            pass
+        self._decrement_user(waiter.user_id)
+        return self._reject("queue_timeout", self._retry_after(len(self._queue)))
+
+    def _decrement_user(self, user_id: str):
+        count = self._per_user.get(user_id, 0) - 1
+        if count > 0:
+            self._per_user[user_id] = count
+        else:
+            self._per_user.pop(user_id, None)
+
+    def _release(self, ticket: AdmissionTicket):
+        with self._lock:
+            held = time.monotonic() - ticket.granted_at
+            # Media móvil de la duración de los streams (para Retry-After)
+            self._hold_avg = 0.9 * self._hold_avg + 0.1 * held
+            self._in_flight -= 1
+            self._decrement_user(ticket.user_id)
+            while self._queue and self._in_flight < self.max_in_flight:
+                waiter = self._queue.popleft()
+                waiter.ticket = self._grant(waiter.user_id)
+                self._waits.append(time.monotonic() - waiter.enqueued_at)
+                waiter.wake()
+
+    # --- API pública ---
+
+    def acquire(self, user_id: str) -> Tuple[Optional[AdmissionTicket], Optional[Rejection]]:
+        """Plaza para una petición de chat (bloquea como mucho queue_timeout). Devuelve (ticket, rechazo)"""
+        if not self.enabled:
+            return AdmissionTicket(_NULL_CONTROLLER, user_id), None
+        event = threading.Event()
+        with self._lock:
+            ticket, waiter, rejection = self._try_enter(user_id, event.set)
+        if waiter is None:
+            return ticket, rejection
+        event.wait(self.queue_timeout)
+        with self._lock:
+            rejection = self._abandon(waiter)
+        return waiter.ticket, rejection
+
+    async def aacquire(self, user_id: str) -> Tuple[Optional[AdmissionTicket], Optional[Rejection]]:
+        """Variante asíncrona de acquire: la espera en cola no ocupa hilos"""
+        if not self.enabled:
+            return AdmissionTicket(_NULL_CONTROLLER, user_id), None
+        loop = asyncio.get_running_loop()
+        granted = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: granted.done() or granted.set_result(True))
+
+        with self._lock:
+            ticket, waiter, rejection = self._try_enter(user_id, wake)
+        if waiter is None:
+            return ticket, rejection
+        try:
+            await asyncio.wait_for(asyncio.shield(granted), self.queue_timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            # El cliente se fue mientras esperaba: se libera la plaza si llegó a concederse
+            with self._lock:
+                self._abandon(waiter)
+            if waiter.ticket is not None:
+                waiter.ticket.release()
+            raise
+        with self._lock:
+            rejection = self._abandon(waiter)
+        return waiter.ticket, rejection
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            waits = sorted(self._waits)
+            return {
+                **self.stats,
+                "enabled": self.enabled,
+                "in_flight": self._in_flight,
+                "max_in_flight": self.max_in_flight,
+                "queue_depth": len(self._queue),
+                "queue_size": self.queue_size,
+                "active_users": len(self._per_user),
+                "wait_avg": round(sum(waits) / len(waits), 3) if waits else None,
+                "wait_p95": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3) if waits else None,
+                "stream_duration_avg": round(self._hold_avg, 3),
+            }
+
+
+class _NullController:
+    """Controlador sin límites (admisión desactivada)"""
+
+    def _release(self, ticket):
+        pass
+
+
+_NULL_CONTROLLER = _NullController()
+
+# Instancia global del controlador
+admission = AdmissionController()
@@ -0,0 +1,306 @@
+# api/asgi.py - Modo de servicio ASGI (Starlette) con las mismas rutas que api.index
+#
+# Ejecutar con:  uvicorn api.asgi:app --host 0.0.0.0 --port 8080
+# El grafo se consume con astream y las llamadas MCP se esperan de forma nativa,
+# de modo que cada stream SSE inactivo no ocupa un hilo del servidor.
+import asyncio
+import logging
+import traceback
+from contextlib import asynccontextmanager
+
+from langchain_core.messages import AIMessage
+from starlette.applications import Starlette
+from starlette.background import BackgroundTask
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from api import index as backend
+from api.admission import admission
+from api.hedging import hedger
+from api.stream_replay import request_key, stream_runs
+from api.chat_persistence import ChatLog, chat_writer, message_log
+from api.async_runtime import run_in_background
+from api.mcp_client import cleanup_mcp_clients
+from api.rag_processor import process_and_store_document
+from api.streaming import (
+    STREAM_MODE, TOKEN_STREAM_MODES, UPDATE_STREAM_MODES, encode_sse, sse_done, aiter_token_frames, aiter_update_frames
+)
+
+logger = logging.getLogger("asgi")
+
+
+async def _authenticate(request: Request):
+    """Valida el token del request. Devuelve (user, None) o (None, JSONResponse)"""
+    user, error = await asyncio.to_thread(backend.authenticate_token, request.headers.get('Authorization', ''))
+    if error:
+        payload, status = error
+        return None, JSONResponse(payload, status_code=status)
+    return user, None
+
+
+async def _get_agent_graph():
+    """Devuelve el grafo esperando de forma asíncrona a la inicialización compartida"""
+    if backend._APP_GRAPH is not None:
+        return backend._APP_GRAPH
+    try:
+        init_future = asyncio.wrap_future(backend.start_agent_warmup())
+        return await asyncio.wait_for(asyncio.shield(init_future), backend.AGENT_INIT_WAIT_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning("Tiempo de espera agotado aguardando la inicialización del agente")
+        return None
+    except Exception:
+        return None
+
+
+async def health_check(request: Request):
+    if backend.get_agent_readiness() == "idle":
+        backend.start_agent_warmup()
+
+    status_info, status = backend.build_health_status()
+    return JSONResponse(status_info, status_code=status)
+
+
+async def list_chats_handler(request: Request):
+    user, error_response = await _authenticate(request)
+    if error_response:
+        return error_response
+
+    try:
+        chats = await asyncio.to_thread(backend.list_user_chats, user)
+        if chats is not None:
+            return JSONResponse(chats, status_code=200)
+        return JSONResponse({"error": "No se pudieron obtener los chats."}, status_code=500)
+    except Exception:
+        logger.error(f"Error en list_chats_handler: {traceback.format_exc()}")
+        return JSONResponse({"error": "Error interno del servidor al listar chats"}, status_code=500)
+
+
+async def upload_handler(request: Request):
+    user, error_response = await _authenticate(request)
+    if error_response:
+        return error_response
+
+    form = await request.form()
+    file = form.get('file')
+    if file is None or isinstance(file, str):
+        return JSONResponse({"error": "No se encontró ningún archivo"}, status_code=400)
+    if file.filename == '':
+        return JSONResponse({"error": "No se seleccionó ningún archivo"}, status_code=400)
+
+    try:
+        file_content = await file.read()
+        supabase_admin_client = backend.get_supabase_client(admin=True)
+        result = await asyncio.to_thread(process_and_store_document, supabase_admin_client, file_content, user.id)
+
+        if result["success"]:
+            return JSONResponse({"message": result["message"]}, status_code=200)
+        return JSONResponse({"error": result["message"]}, status_code=500)
+    except Exception:
+        logger.error(f"Error en upload_handler: {traceback.format_exc()}")
+        return JSONResponse({"error": "Error interno del servidor al subir el archivo"}, status_code=500)
+
+
+async def chat_handler(request: Request):
+    app_graph = await _get_agent_graph()
+    if app_graph is None:
+        return JSONResponse({"error": "Agente no disponible."}, status_code=503)
+
+    user, error_response = await _authenticate(request)
+    if error_response:
+        return error_response
+
+    # Límite por usuario y global con cola corta; la espera en cola no ocupa hilos
+    ticket, rejection = await admission.aacquire(user.id)
+    if rejection is not None:
+        return JSONResponse(rejection.payload(), status_code=429, headers={'Retry-After': str(rejection.retry_after)})
+    try:
+        response = await _chat_response(request, app_graph, user, ticket)
+    except BaseException:
+        ticket.release()
+        raise
+    # La plaza se libera cuando termina la respuesta; el cierre del stream cubre las desconexiones
+    response.background = BackgroundTask(ticket.release)
+    if isinstance(response, StreamingResponse):
+        response.body_iterator = _release_when_done(response.body_iterator, ticket)
+    return response
+
+
+async def _release_when_done(body_iterator, ticket):
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        ticket.release()
+
+
+def _sse_response(frames) -> StreamingResponse:
+    return StreamingResponse(frames, media_type='text/event-stream',
+                             headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+async def _chat_response(request: Request, app_graph, user, ticket):
+    try:
+        data = await request.json()
+
+        # Reconexión: se reenvía lo que falta de la generación en lugar de ejecutar el grafo otra vez
+        last_event_id = request.headers.get('Last-Event-ID') or data.get('last_event_id')
+        if last_event_id:
+            run, after = stream_runs.resume(last_event_id, user.id)
+            if run is None:
+                return JSONResponse({"error": "La respuesta ya no está disponible para reanudarse."}, status_code=410)
+            return _sse_response(run.aiter_frames(after))
+
+        messages_from_client = data.get('messages', [])
+        thread_id = data.get('thread_id')
+
+        if not messages_from_client:
+            return JSONResponse({"error": "No se proporcionaron mensajes."}, status_code=400)
+
+        last_user_message = messages_from_client[-1]['content']
+
+        # Reintento sin Last-Event-ID de una petición que sigue generándose: se reengancha desde el principio
+        run_key = request_key(user.id, thread_id, last_user_message)
+        run = stream_runs.find_active(run_key)
+        if run is not None:
+            return _sse_response(run.aiter_frames())
+
+        # Chat nuevo: id local y la fila de `chats` se inserta en paralelo con la generación
+        chat_creation = None
+        if not thread_id:
+            thread_id, chat_creation = chat_writer.create_chat(user.id, request.headers.get('Authorization'), last_user_message)
+
+        tool_catalog = await asyncio.to_thread(backend.get_user_tool_catalog, user, request.headers.get('Authorization'))
+        # Los mensajes del turno se guardan en `messages` en segundo plano (cola write-behind)
+        chat_log = ChatLog(str(thread_id), request.headers.get('Authorization'), chat_creation)
+        config = backend.get_graph_config(thread_id, tool_catalog, chat_log)
+        input_messages = backend.build_orchestrator_messages(last_user_message)
+        chat_log.record(input_messages)
+        cached_answer, cache_probe = await asyncio.to_thread(backend.lookup_cached_answer, user, messages_from_client, data, tool_catalog)
+
+        # Solo los chats que ya tenían mensajes pueden necesitar hidratación
+        resume_history = chat_creation is None and len(messages_from_client) > 1
+        request_authorization = request.headers.get('Authorization')
+
+        async def chat_creation_frames():
+            failure = await chat_writer.acreation_failure(str(thread_id), chat_creation)
+            if failure is not None:
+                yield encode_sse(failure)
+
+        async def generate_stream():
+            if cached_answer is not None:
+                yield encode_sse({'content': cached_answer, 'thread_id': str(thread_id), 'cached': True})
+                chat_log.record([AIMessage(content=cached_answer)])
+                try:
+                    await asyncio.to_thread(backend.record_cached_turn, app_graph, config, input_messages, cached_answer)
+                except Exception as e:
+                    logger.error(f"Error registrando turno cacheado: {e}")
+                async for frame in chat_creation_frames():
+                    yield frame
+                yield sse_done()
+                return
+
+            try:
+                # Chat existente tras un reinicio o una expulsión: historial desde `messages`
+                if resume_history:
+                    await asyncio.to_thread(backend.hydrate_thread, app_graph, config, thread_id, request_authorization)
+                if STREAM_MODE == "tokens":
+                    graph_stream = app_graph.astream({"messages": input_messages}, config=config, stream_mode=TOKEN_STREAM_MODES)
+                    async for frame in aiter_token_frames(graph_stream, str(thread_id)):
+                        yield frame
+                else:
+                    graph_stream = app_graph.astream({"messages": input_messages}, config=config, stream_mode=UPDATE_STREAM_MODES)
+                    async for frame in aiter_update_frames(graph_stream, str(thread_id)):
+                        yield frame
+                await asyncio.to_thread(backend.remember_answer, app_graph, config, cache_probe)
+            except Exception as e:
+                logger.error(f"Error en stream: {traceback.format_exc()}")
+                yield encode_sse({'error': f'Error en el backend: {str(e)}'})
+
+            async for frame in chat_creation_frames():
+                yield frame
+            yield sse_done()
+
+        # La generación corre en su propia tarea y conserva su plaza de admisión hasta terminar
+        run = stream_runs.start(run_key, user.id)
+        ticket.retain("generation")
+        run.on_finish(lambda: ticket.release("generation"))
+        stream_runs.aproduce(run, generate_stream())
+        return _sse_response(run.aiter_frames())
+
+    except Exception as e:
+        logger.error(f"Error en chat_handler: {traceback.format_exc()}")
+        return JSONResponse({"error": f"Error en el servidor: {str(e)}"}, status_code=500)
+
+
+async def mcp_status(request: Request):
+    """Obtiene el estado de las conexiones MCP"""
+    user, error_response = await _authenticate(request)
+    if error_response:
+        return error_response
+
+    try:
+        # Los clientes MCP viven en el bucle compartido; se esperan desde allí
+        return JSONResponse(await run_in_background(backend.collect_mcp_status()))
+    except Exception as e:
+        logger.error(f"Error obteniendo estado MCP: {e}")
+        return JSONResponse({"error": "Error obteniendo estado MCP"}, status_code=500)
+
+
+async def list_mcp_tools(request: Request):
+    """Lista todas las herramientas MCP disponibles"""
+    user, error_response = await _authenticate(request)
+    if error_response:
+        return error_response
+
+    if not backend._MCP_INITIALIZED:
+        return JSONResponse({"error": "MCP no inicializado"}, status_code=503)
+
+    try:
+        return JSONResponse(await run_in_background(backend.collect_mcp_tools()))
+    except Exception as e:
+        logger.error(f"Error listando herramientas MCP: {e}")
+        return JSONResponse({"error": "Error obteniendo herramientas MCP"}, status_code=500)
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm-up del agente al arrancar el worker, fuera del camino de las peticiones
+    backend.start_agent_warmup()
+    # Las carreras de cobertura síncronas (herramientas en hilos) usan el bucle del servidor
+    hedger.attach_loop(asyncio.get_running_loop())
+    yield
+    hedger.attach_loop(None)
+    # Mensajes aún en la cola write-behind
+    await asyncio.to_thread(message_log.flush)
+    if backend.memory:
+        try:
+            await asyncio.to_thread(backend.memory.flush)
+        except Exception as e:
+            logger.error(f"Error volcando checkpoints: {e}")
+    if backend._MCP_INITIALIZED:
+        try:
+            await run_in_background(cleanup_mcp_clients())
+            backend._MCP_INITIALIZED = False
+            logger.info("✓ Recursos MCP limpiados")
+        except Exception as e:
+            logger.error(f"Error limpiando recursos MCP: {e}")
+
+
+routes = [
+    Route("/", health_check, methods=["GET"]),
+    Route("/api/chats", list_chats_handler, methods=["GET"]),
+    Route("/api/upload", upload_handler, methods=["POST"]),
+    Route("/api/chat", chat_handler, methods=["POST"]),
+    Route("/api/mcp/status", mcp_status, methods=["GET"]),
+    Route("/api/mcp/tools", list_mcp_tools, methods=["GET"]),
+]
+
+middleware = [
+    Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET", "POST", "OPTIONS"],
+               allow_headers=["Content-Type", "Authorization", "Origin", "Accept"]),
+]
+
+app = Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -0,0 +1,106 @@
+# api/async_runtime.py - Bucle de eventos persistente y puente sync -> async
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Coroutine, Optional
+
+logger = logging.getLogger("async_runtime")
+
+
+class BackgroundEventLoop:
+    """Bucle de eventos de larga duración ejecutándose en un hilo dedicado.
+
+    Existe uno por proceso worker: si el proceso hace fork (gunicorn), el hijo
+    arranca su propio bucle en el primer uso.
+    """
+
+    def __init__(self, name: str = "async-runtime"):
+        self.name = name
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _run_forever(self, loop: asyncio.AbstractEventLoop, ready: threading.Event):
+        asyncio.set_event_loop(loop)
+        ready.set()
+        try:
+            loop.run_forever()
+        finally:
+            loop.close()
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """Devuelve el bucle del proceso actual, arrancándolo si es necesario"""
+        if self._loop is not None and self._pid == os.getpid() and self._loop.is_running():
+            return self._loop
+
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid() or not self._loop.is_running():
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                thread = threading.Thread(target=self._run_forever, args=(loop, ready), name=self.name, daemon=True)
+                thread.start()
+                ready.wait()
+                self._loop, self._thread, self._pid = loop, thread, os.getpid()
+                logger.info(f"Bucle de eventos '{self.name}' iniciado (pid {self._pid})")
+        return self._loop
+
+    def in_loop_thread(self) -> bool:
+        """Indica si el hilo actual es el del bucle de fondo"""
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    def submit(self, coro: Coroutine) -> Future:
+        """Programa una corrutina en el bucle y devuelve un Future concurrente"""
+        return asyncio.run_coroutine_threadsafe(coro, self.get_loop())
+
+    def run(self, coro: Coroutine, timeout: float = None) -> Any:
+        """Ejecuta una corrutina en el bucle y espera su resultado de forma síncrona"""
+        if self.in_loop_thread():
+            coro.close()
+            raise RuntimeError("run_sync no puede llamarse desde el propio bucle de eventos; usa 'await'")
+        future = self.submit(coro)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = 5.0):
+        """Detiene el bucle de fondo"""
+        with self._lock:
+            loop, thread = self._loop, self._thread
+            if loop is None or self._pid != os.getpid():
+                return
+            loop.call_soon_threadsafe(loop.stop)
+            if thread and thread is not threading.current_thread():
+                thread.join(timeout)
+            self._loop, self._thread, self._pid = None, None, None
+
+
+# Instancia global del proceso
+background_loop = BackgroundEventLoop()
+
+
+def get_loop() -> asyncio.AbstractEventLoop:
+    """Bucle de eventos compartido del proceso"""
+    return background_loop.get_loop()
+
+
+def submit(coro: Coroutine) -> Future:
+    """Programa una corrutina en el bucle compartido sin esperar el resultado"""
+    return background_loop.submit(coro)
+
+
+def run_sync(coro: Coroutine, timeout: float = None) -> Any:
+    """Puente sync -> async: ejecuta una corrutina en el bucle compartido y devuelve su resultado"""
+    return background_loop.run(coro, timeout)
+
+
+async def run_in_background(coro: Coroutine) -> Any:
+    """Espera desde otro bucle (p. ej. el del servidor ASGI) una corrutina del bucle compartido.
+
+    Los recursos ligados al bucle compartido (clientes MCP) deben usarse siempre desde él.
+    """
+    return await asyncio.wrap_future(background_loop.submit(coro))
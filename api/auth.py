@@ -0,0 +1,194 @@
+# api/auth.py - Verificación local de tokens JWT de Supabase con caché de claims
+import os
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+import jwt
+
+logger = logging.getLogger("auth")
+
+# Modo de verificación: "local" (firma JWT), "remote" (Supabase Auth) o "auto"
+# (local cuando hay secreto/JWKS disponible, remoto en caso contrario)
+AUTH_VERIFY_MODE = os.environ.get("AUTH_VERIFY_MODE", "auto").lower()
+JWT_AUDIENCE = os.environ.get("SUPABASE_JWT_AUDIENCE", "authenticated")
+TOKEN_CACHE_SIZE = int(os.environ.get("AUTH_TOKEN_CACHE_SIZE", "2048"))
+# Tiempo máximo que un token validado permanece en caché, aunque expire más tarde
+TOKEN_CACHE_MAX_TTL = float(os.environ.get("AUTH_TOKEN_CACHE_MAX_TTL", "300"))
+JWKS_CACHE_TTL = int(os.environ.get("AUTH_JWKS_CACHE_TTL", "600"))
+ALLOWED_ALGORITHMS = {"HS256", "HS384", "HS512", "RS256", "RS384", "RS512", "ES256", "ES384", "EdDSA"}
+
+
+class InvalidTokenError(Exception):
+    """Token ausente, mal formado, expirado o con firma inválida"""
+
+
+class _LocalVerificationUnavailable(Exception):
+    """La verificación local no es posible con la configuración actual"""
+
+
+@dataclass
+class AuthenticatedUser:
+    """Usuario autenticado a partir de los claims del token"""
+    id: str
+    email: Optional[str] = None
+    role: Optional[str] = None
+    claims: Dict[str, Any] = field(default_factory=dict)
+
+
+class VerifiedTokenCache:
+    """Caché LRU de tokens verificados, acotada por la expiración de cada token"""
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE, max_ttl: float = TOKEN_CACHE_MAX_TTL):
+        self.max_size = max_size
+        self.max_ttl = max_ttl
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(token: str) -> str:
+        # No se guarda el token en claro como clave
+        return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+    def get(self, token: str) -> Optional[AuthenticatedUser]:
+        key = self._key(token)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            user, expires_at = entry
+            if expires_at <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return user
+
+    def put(self, token: str, user: AuthenticatedUser, exp: Optional[float]):
+        now = time.time()
+        expires_at = now + self.max_ttl
+        if exp is not None:
+            expires_at = min(expires_at, float(exp))
+        if expires_at <= now:
+            return
+        key = self._key(token)
+        with self._lock:
+            self._entries[key] = (user, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class TokenVerifier:
+    """Verifica tokens de Supabase localmente (HS* con secreto, RS*/ES* con JWKS)
+    y recurre a Supabase Auth cuando la verificación local no es posible."""
+
+    def __init__(self, remote_client_factory: Callable[[], Any] = None, mode: str = AUTH_VERIFY_MODE):
+        self.mode = mode
+        self.remote_client_factory = remote_client_factory
+        self.jwt_secret = os.environ.get("SUPABASE_JWT_SECRET")
+        supabase_url = os.environ.get("SUPABASE_URL")
+        self.jwks_url = os.environ.get("SUPABASE_JWKS_URL") or (
+            f"{supabase_url.rstrip('/')}/auth/v1/.well-known/jwks.json" if supabase_url else None
+        )
+        self._jwks_client: Optional[jwt.PyJWKClient] = None
+        self._jwks_lock = threading.Lock()
+        self.cache = VerifiedTokenCache()
+
+    def verify(self, token: str) -> AuthenticatedUser:
+        """Devuelve el usuario del token o lanza InvalidTokenError"""
+        if not token:
+            raise InvalidTokenError("Token de autorización ausente")
+
+        user = self.cache.get(token)
+        if user is not None:
+            return user
+
+        try:
+            if self.mode == "remote":
+                user, exp = self._verify_remote(token)
+            else:
+                try:
+                    user, exp = self._verify_local(token)
+                except _LocalVerificationUnavailable as e:
+                    if self.mode == "local":
+                        raise
+                    logger.debug(f"Verificación local no disponible ({e}); validando con Supabase Auth")
+                    user, exp = self._verify_remote(token)
+        except _LocalVerificationUnavailable as e:
+            # Sin forma de verificar el token se responde como token inválido, nunca con un 500
+            raise InvalidTokenError(str(e))
+
+        self.cache.put(token, user, exp)
+        return user
+
+    def _get_jwks_client(self) -> jwt.PyJWKClient:
+        with self._jwks_lock:
+            if self._jwks_client is None:
+                self._jwks_client = jwt.PyJWKClient(self.jwks_url, cache_keys=True, lifespan=JWKS_CACHE_TTL)
+            return self._jwks_client
+
+    def _verify_local(self, token: str):
+        try:
+            header = jwt.get_unverified_header(token)
+        except jwt.PyJWTError as e:
+            raise InvalidTokenError(f"Token mal formado: {e}")
+
+        algorithm = header.get("alg", "")
+        if algorithm not in ALLOWED_ALGORITHMS:
+            raise InvalidTokenError(f"Algoritmo de firma no permitido: {algorithm}")
+        if algorithm.startswith("HS"):
+            if not self.jwt_secret:
+                raise _LocalVerificationUnavailable("SUPABASE_JWT_SECRET no configurado")
+            key = self.jwt_secret
+        else:
+            if not self.jwks_url:
+                raise _LocalVerificationUnavailable("URL de JWKS no configurada")
+            try:
+                key = self._get_jwks_client().get_signing_key_from_jwt(token).key
+            except jwt.PyJWKClientError as e:
+                raise _LocalVerificationUnavailable(f"No se pudo obtener la clave JWKS: {e}")
+
+        try:
+            claims = jwt.decode(token, key, algorithms=[algorithm], audience=JWT_AUDIENCE,
+                                options={"require": ["exp", "sub"]})
+        except jwt.PyJWTError as e:
+            raise InvalidTokenError(f"Token inválido o expirado: {e}")
+
+        user = AuthenticatedUser(
+            id=claims["sub"],
+            email=claims.get("email"),
+            role=claims.get("role"),
+            claims=claims,
+        )
+        return user, claims.get("exp")
+
+    def _verify_remote(self, token: str):
+        if self.remote_client_factory is None:
+            raise _LocalVerificationUnavailable("Validación remota no configurada")
+
+        user_response = self.remote_client_factory().auth.get_user(token)
+        if not user_response or not user_response.user:
+            raise InvalidTokenError("Token inválido o expirado")
+
+        try:
+            exp = jwt.decode(token, options={"verify_signature": False}).get("exp")
+        except jwt.PyJWTError:
+            exp = None
+
+        remote_user = user_response.user
+        user = AuthenticatedUser(id=remote_user.id, email=remote_user.email, role=remote_user.role)
+        return user, exp
@@ -0,0 +1,174 @@
+# api/blob_store.py - Almacén direccionado por contenido para salidas grandes de herramientas
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage, ToolMessage
+
+logger = logging.getLogger("blob_store")
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
+# Contenidos de ToolMessage por encima de este tamaño se guardan fuera del estado del grafo
+BLOB_INLINE_MAX_CHARS = int(os.environ.get("BLOB_INLINE_MAX_CHARS", "2000"))
+BLOB_PREVIEW_CHARS = int(os.environ.get("BLOB_PREVIEW_CHARS", "200"))
+BLOB_MEMORY_MAX_BYTES = int(os.environ.get("BLOB_MEMORY_MAX_BYTES", str(32 * 1024 * 1024)))
+BLOB_STORE_DIR = os.environ.get("BLOB_STORE_DIR", os.path.join(tempfile.gettempdir(), "agentes_blobs"))
+# Los blobs en disco sin acceder durante este tiempo se eliminan al arrancar
+BLOB_DISK_TTL = float(os.environ.get("BLOB_DISK_TTL", str(7 * 24 * 3600)))
+
+# Clave en additional_kwargs del ToolMessage con la referencia al blob
+BLOB_REF_KEY = "blob_ref"
+
+
+class ContentBlobStore:
+    """Blobs de texto indexados por sha256: caché LRU en memoria y copia comprimida en disco.
+
+    La escritura en disco es inmediata para que los checkpoints volcados o
+    restaurados tras un reinicio sigan pudiendo resolver sus referencias.
+    """
+
+    def __init__(self, directory: Optional[str] = BLOB_STORE_DIR, max_memory_bytes: int = BLOB_MEMORY_MAX_BYTES):
+        self.directory = directory
+        self.max_memory_bytes = max_memory_bytes
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._memory_bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"puts": 0, "memory_hits": 0, "disk_hits": 0, "misses": 0}
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+                self._prune_disk()
+            except OSError as e:
+                logger.error(f"No se pudo preparar el directorio de blobs {directory}: {e}")
+                self.directory = None
+
+    @staticmethod
+    def digest(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.directory, digest[:2], digest + (".zst" if ZSTD_AVAILABLE else ".txt"))
+
+    def _remember(self, digest: str, text: str):
+        with self._lock:
+            if digest in self._memory:
+                self._memory.move_to_end(digest)
+                return
+            self._memory[digest] = text
+            self._memory_bytes += len(text)
+            while self._memory_bytes > self.max_memory_bytes and len(self._memory) > 1:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def put(self, text: str) -> str:
+        """Guarda el texto y devuelve su digest (idempotente)"""
+        digest = self.digest(text)
+        self.stats["puts"] += 1
+        self._remember(digest, text)
+        if self.directory:
+            path = self._path(digest)
+            if not os.path.exists(path):
+                try:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    data = text.encode("utf-8")
+                    if ZSTD_AVAILABLE:
+                        data = zstandard.ZstdCompressor(level=3).compress(data)
+                    # Escritura atómica: varios workers pueden guardar el mismo blob
+                    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp_path, "wb") as f:
+                        f.write(data)
+                    os.replace(tmp_path, path)
+                except OSError as e:
+                    logger.error(f"Error guardando blob {digest[:12]} en disco: {e}")
+        return digest
+
+    def get(self, digest: str) -> Optional[str]:
+        """Texto del blob o None si no está ni en memoria ni en disco"""
+        with self._lock:
+            text = self._memory.get(digest)
+            if text is not None:
+                self._memory.move_to_end(digest)
+                self.stats["memory_hits"] += 1
+                return text
+
+        if self.directory:
+            path = self._path(digest)
+            try:
+                with open(path, "rb") as f:
+                    data = f.read()
+                os.utime(path)
+                if ZSTD_AVAILABLE:
+                    data = zstandard.ZstdDecompressor().decompress(data)
+                text = data.decode("utf-8")
+                self.stats["disk_hits"] += 1
+                self._remember(digest, text)
+                return text
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error leyendo blob {digest[:12]}: {e}")
+
+        self.stats["misses"] += 1
+        return None
+
+    def _prune_disk(self):
+        cutoff = time.time() - BLOB_DISK_TTL
+        removed = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        removed += 1
+                except OSError:
+                    pass
+        if removed:
+            logger.info(f"Eliminados {removed} blobs caducados de {self.directory}")
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "memory_blobs": len(self._memory), "memory_bytes": self._memory_bytes}
+
+
+# Instancia global del almacén
+blob_store = ContentBlobStore()
+
+
+def offload_tool_messages(messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+    """Sustituye el contenido grande de los ToolMessage por una referencia al almacén"""
+    result = []
+    for message in messages:
+        content = message.content
+        if (isinstance(message, ToolMessage) and isinstance(content, str)
+                and len(content) > BLOB_INLINE_MAX_CHARS and BLOB_REF_KEY not in message.additional_kwargs):
+            digest = blob_store.put(content)
+            message = message.model_copy(update={
+                "content": f"{content[:BLOB_PREVIEW_CHARS]}\n[... contenido completo en blob {digest[:12]} ...]",
+                "additional_kwargs": {**message.additional_kwargs, BLOB_REF_KEY: digest},
+            })
+        result.append(message)
+    return result
+
+
+def resolve_message(message: BaseMessage) -> BaseMessage:
+    """Devuelve el mensaje con su contenido completo si guarda una referencia a un blob"""
+    digest = message.additional_kwargs.get(BLOB_REF_KEY) if isinstance(message, ToolMessage) else None
+    if not digest:
+        return message
+    text = blob_store.get(digest)
+    if text is None:
+        # Sin el blob se envía la vista previa guardada en el estado
+        logger.warning(f"Blob {digest[:12]} no encontrado; se usa la vista previa")
+        return message
+    return message.model_copy(update={"content": text})
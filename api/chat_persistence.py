@@ -0,0 +1,322 @@
+# api/chat_persistence.py - Escritura de chats y mensajes en Supabase fuera del camino crítico del stream
+import os
+import time
+import uuid
+import random
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage
+
+from api.streaming import extract_text
+from api.supabase_pool import get_user_supabase_client
+
+logger = logging.getLogger("chat_persistence")
+
+CHAT_WRITER_WORKERS = int(os.environ.get("CHAT_WRITER_WORKERS", "4"))
+# Espera máxima al final del stream para confirmar que la fila del chat existe
+CHAT_CREATE_TIMEOUT = float(os.environ.get("CHAT_CREATE_TIMEOUT", "10"))
+CHAT_TITLE_MAX_CHARS = 50
+
+MESSAGE_PERSISTENCE_ENABLED = os.environ.get("MESSAGE_PERSISTENCE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Un hilo se vuelca al acumular este número de mensajes o cuando el más antiguo supera el intervalo
+MESSAGE_BATCH_SIZE = int(os.environ.get("MESSAGE_BATCH_SIZE", "20"))
+MESSAGE_FLUSH_INTERVAL = float(os.environ.get("MESSAGE_FLUSH_INTERVAL", "1.0"))
+MESSAGE_MAX_RETRIES = int(os.environ.get("MESSAGE_MAX_RETRIES", "5"))
+MESSAGE_RETRY_BASE_DELAY = float(os.environ.get("MESSAGE_RETRY_BASE_DELAY", "0.5"))
+MESSAGE_RETRY_MAX_DELAY = float(os.environ.get("MESSAGE_RETRY_MAX_DELAY", "30"))
+# Cota de mensajes pendientes en memoria (si la base de datos no responde)
+MESSAGE_QUEUE_MAX = int(os.environ.get("MESSAGE_QUEUE_MAX", "10000"))
+MESSAGE_SHUTDOWN_TIMEOUT = float(os.environ.get("MESSAGE_SHUTDOWN_TIMEOUT", "10"))
+
+
+def new_thread_id() -> str:
+    """Id de hilo generado localmente; se usa también como id de la fila en `chats`"""
+    return str(uuid.uuid4())
+
+
+def chat_title(message: str) -> str:
+    return (message[:CHAT_TITLE_MAX_CHARS] + '...') if len(message) > CHAT_TITLE_MAX_CHARS else message
+
+
+class ChatWriter:
+    """Crea las filas de `chats` en segundo plano.
+
+    El id del hilo se genera en el servidor, de modo que el grafo y el stream
+    arrancan sin esperar a la base de datos; el resultado del insert se comunica
+    dentro del propio stream.
+    """
+
+    def __init__(self, workers: int = CHAT_WRITER_WORKERS):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-writer")
+        self._lock = threading.Lock()
+        self.stats = {"chats_created": 0, "chats_failed": 0}
+
+    def _insert_chat(self, thread_id: str, user_id: str, authorization: str, title: str) -> str:
+        # Cliente con la sesión del usuario (RLS) sobre el pool de conexiones compartido
+        supabase_client = get_user_supabase_client(authorization)
+        response_db = supabase_client.from_('chats').insert({'id': thread_id, 'user_id': user_id, 'title': title}).execute()
+        if not response_db.data:
+            raise RuntimeError("La base de datos no devolvió la fila del chat")
+        return response_db.data[0]['id']
+
+    def _count(self, future: Future):
+        with self._lock:
+            self.stats["chats_failed" if future.exception() else "chats_created"] += 1
+
+    def create_chat(self, user_id: str, authorization: str, last_user_message: str) -> Tuple[str, Future]:
+        """(id del hilo, Future del insert). El id es válido de inmediato"""
+        thread_id = new_thread_id()
+        future = self._executor.submit(self._insert_chat, thread_id, user_id, authorization, chat_title(last_user_message))
+        future.add_done_callback(self._count)
+        return thread_id, future
+
+    def _failure_event(self, thread_id: str, error: Exception) -> Dict[str, Any]:
+        logger.error(f"No se pudo crear el chat {thread_id}: {error}")
+        return {'event': 'chat_persist_failed', 'thread_id': thread_id,
+                'message': "No se pudo guardar el chat en la base de datos."}
+
+    def creation_failure(self, thread_id: str, future: Optional[Future],
+                         timeout: float = CHAT_CREATE_TIMEOUT) -> Optional[Dict[str, Any]]:
+        """Evento SSE a enviar si el insert falló (espera como mucho `timeout`); None si fue bien"""
+        if future is None:
+            return None
+        try:
+            future.result(timeout)
+        except FutureTimeoutError:
+            return self._failure_event(thread_id, TimeoutError("el insert no terminó a tiempo"))
+        except Exception as e:
+            return self._failure_event(thread_id, e)
+        return None
+
+    async def acreation_failure(self, thread_id: str, future: Optional[Future],
+                                timeout: float = CHAT_CREATE_TIMEOUT) -> Optional[Dict[str, Any]]:
+        """Variante asíncrona de creation_failure"""
+        if future is None:
+            return None
+        try:
+            await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            return self._failure_event(thread_id, TimeoutError("el insert no terminó a tiempo"))
+        except Exception as e:
+            return self._failure_event(thread_id, e)
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return dict(self.stats)
+
+
+def message_role(message: BaseMessage) -> Optional[str]:
+    """Rol en la tabla `messages`; None si el mensaje no se persiste"""
+    if isinstance(message, HumanMessage):
+        return "user"
+    if isinstance(message, ToolMessage):
+        return "tool"
+    # Solo la respuesta final del turno: el texto de los pasos que piden herramientas lo
+    # acumula ChatLog y se guarda junto a ella, como una sola burbuja (igual que en el stream)
+    if isinstance(message, AIMessage) and not message.tool_calls and extract_text(message.content):
+        return "assistant"
+    return None
+
+
+class _ThreadBuffer:
+    """Mensajes pendientes de un hilo y el estado de sus reintentos"""
+
+    def __init__(self, authorization: str, creation: Optional[Future]):
+        self.rows: List[Dict[str, Any]] = []
+        self.authorization = authorization
+        self.creation = creation
+        self.first_queued_at = 0.0
+        self.attempts = 0
+        self.retry_at = 0.0
+        self.flushing = False
+
+
+class MessageLog:
+    """Cola write-behind de mensajes hacia la tabla `messages`.
+
+    Registrar un mensaje solo lo añade a memoria; un hilo de fondo agrupa los
+    mensajes por conversación y los inserta en bloque por tamaño o por tiempo,
+    con reintentos y backoff exponencial. Cada fila lleva un id y un created_at
+    generados aquí, de modo que un reintento no duplica filas ni altera el orden.
+    """
+
+    def __init__(self, batch_size: int = MESSAGE_BATCH_SIZE, flush_interval: float = MESSAGE_FLUSH_INTERVAL,
+                 enabled: bool = MESSAGE_PERSISTENCE_ENABLED):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._buffers: Dict[str, _ThreadBuffer] = {}
+        self._queued = 0
+        self._draining = False
+        self._last_ts = 0.0
+        self._cond = threading.Condition()
+        self._flusher: Optional[threading.Thread] = None
+        self.stats = {"queued": 0, "persisted": 0, "batches": 0, "retries": 0, "dropped": 0}
+
+    def _timestamp(self) -> str:
+        # Estrictamente creciente: los mensajes de un mismo lote conservan su orden al leerlos
+        now = max(time.time(), self._last_ts + 1e-6)
+        self._last_ts = now
+        return datetime.fromtimestamp(now, timezone.utc).isoformat()
+
+    def record(self, chat_id: str, authorization: str, messages: Sequence[BaseMessage],
+               creation: Optional[Future] = None):
+        """Encola los mensajes persistibles de un hilo; no bloquea"""
+        if not self.enabled or not chat_id:
+            return
+        with self._cond:
+            rows = [{"id": str(uuid.uuid4()), "chat_id": chat_id, "role": role,
+                     "content": extract_text(message.content), "created_at": self._timestamp()}
+                    for message in messages if (role := message_role(message))]
+            if not rows:
+                return
+            if self._queued + len(rows) > MESSAGE_QUEUE_MAX:
+                self.stats["dropped"] += len(rows)
+                logger.error(f"Cola de mensajes llena: se descartan {len(rows)} mensajes del chat {chat_id}")
+                return
+            buffer = self._buffers.get(chat_id)
+            if buffer is None:
+                buffer = self._buffers[chat_id] = _ThreadBuffer(authorization, creation)
+            # El token más reciente del usuario sirve para los reintentos pendientes
+            buffer.authorization = authorization or buffer.authorization
+            buffer.creation = creation or buffer.creation
+            if not buffer.rows:
+                buffer.first_queued_at = time.monotonic()
+            buffer.rows.extend(rows)
+            self._queued += len(rows)
+            self.stats["queued"] += len(rows)
+            self._ensure_flusher()
+            if len(buffer.rows) >= self.batch_size:
+                self._cond.notify()
+
+    def _ensure_flusher(self):
+        if self._flusher is None or not self._flusher.is_alive():
+            self._flusher = threading.Thread(target=self._run, name="message-log", daemon=True)
+            self._flusher.start()
+
+    def _drop(self, chat_id: str, buffer: _ThreadBuffer, count: int, reason: str):
+        del buffer.rows[:count]
+        self._queued -= count
+        self.stats["dropped"] += count
+        logger.error(f"Se descartan {count} mensajes del chat {chat_id}: {reason}")
+
+    def _next_batch(self) -> Optional[Tuple[str, _ThreadBuffer, List[Dict[str, Any]]]]:
+        """Siguiente lote listo para volcarse (bajo self._cond)"""
+        now = time.monotonic()
+        for chat_id, buffer in list(self._buffers.items()):
+            if not buffer.rows:
+                if not buffer.flushing:
+                    del self._buffers[chat_id]
+                continue
+            # La fila de `chats` de un hilo nuevo tiene que existir antes que sus mensajes
+            if buffer.flushing or now < buffer.retry_at or (buffer.creation and not buffer.creation.done()):
+                continue
+            if buffer.creation and buffer.creation.exception():
+                self._drop(chat_id, buffer, len(buffer.rows), "no se pudo crear el chat")
+                continue
+            if (self._draining or len(buffer.rows) >= self.batch_size
+                    or now - buffer.first_queued_at >= self.flush_interval):
+                buffer.flushing = True
+                return chat_id, buffer, buffer.rows[:self.batch_size]
+        return None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                batch = self._next_batch()
+                if batch is None:
+                    self._cond.wait(self.flush_interval / 2)
+                    continue
+            self._flush(*batch)
+
+    def _insert(self, authorization: str, rows: List[Dict[str, Any]]):
+        supabase_client = get_user_supabase_client(authorization)
+        # Upsert por id: un lote reintentado tras un timeout no duplica las filas ya escritas
+        supabase_client.from_('messages').upsert(rows, on_conflict='id', ignore_duplicates=True).execute()
+
+    def _flush(self, chat_id: str, buffer: _ThreadBuffer, rows: List[Dict[str, Any]]):
+        try:
+            self._insert(buffer.authorization, rows)
+            error = None
+        except Exception as e:
+            error = e
+        with self._cond:
+            buffer.flushing = False
+            if error is None:
+                del buffer.rows[:len(rows)]
+                self._queued -= len(rows)
+                buffer.attempts = 0
+                if buffer.rows:
+                    buffer.first_queued_at = time.monotonic()
+                self.stats["persisted"] += len(rows)
+                self.stats["batches"] += 1
+            else:
+                buffer.attempts += 1
+                if buffer.attempts > MESSAGE_MAX_RETRIES:
+                    buffer.attempts = 0
+                    self._drop(chat_id, buffer, len(rows), f"agotados los reintentos ({error})")
+                else:
+                    self.stats["retries"] += 1
+                    delay = min(MESSAGE_RETRY_MAX_DELAY, MESSAGE_RETRY_BASE_DELAY * 2 ** (buffer.attempts - 1))
+                    buffer.retry_at = time.monotonic() + delay * random.uniform(0.8, 1.2)
+                    logger.warning(f"Error guardando mensajes del chat {chat_id} (intento {buffer.attempts}): {error}")
+            self._cond.notify_all()
+
+    def flush(self, timeout: float = MESSAGE_SHUTDOWN_TIMEOUT) -> bool:
+        """Vuelca todo lo pendiente sin esperar a los umbrales (cierre). True si la cola quedó vacía"""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._draining = True
+            try:
+                if self._queued:
+                    self._ensure_flusher()
+                    self._cond.notify_all()
+                while self._queued and time.monotonic() < deadline:
+                    self._cond.wait(min(0.1, max(0.0, deadline - time.monotonic())))
+                if self._queued:
+                    logger.error(f"Quedan {self._queued} mensajes sin guardar al cerrar")
+                return not self._queued
+            finally:
+                self._draining = False
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {**self.stats, "enabled": self.enabled, "pending": self._queued, "threads": len(self._buffers)}
+
+
+class ChatLog:
+    """Persistencia de los mensajes de un hilo para una petición (viaja en la config del grafo)"""
+
+    def __init__(self, chat_id: str, authorization: str, creation: Optional[Future] = None,
+                 log: Optional[MessageLog] = None):
+        self.chat_id = chat_id
+        self.authorization = authorization
+        self.creation = creation
+        self._log = log or message_log
+        # Texto de los pasos intermedios del agente en el turno en curso
+        self._turn_text: List[str] = []
+
+    def record(self, messages: Sequence[BaseMessage]):
+        persisted = []
+        for message in messages:
+            if isinstance(message, AIMessage) and message.tool_calls:
+                self._turn_text.append(extract_text(message.content))
+                continue
+            if isinstance(message, AIMessage) and self._turn_text:
+                # Fin del turno: el texto intermedio y la respuesta final forman una sola fila
+                message = AIMessage(content="".join(self._turn_text) + extract_text(message.content))
+                self._turn_text = []
+            persisted.append(message)
+        if persisted:
+            self._log.record(self.chat_id, self.authorization, persisted, self.creation)
+
+
+# Instancias globales
+chat_writer = ChatWriter()
+message_log = MessageLog()
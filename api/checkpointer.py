@@ -0,0 +1,333 @@
+# api/checkpointer.py - Checkpointer con memoria acotada, expulsión LRU y volcado a SQLite
+import os
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterator, Optional, Sequence, Set, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger("checkpointer")
+
+try:
+    import ormsgpack
+    import zstandard
+    SPILL_AVAILABLE = True
+except ImportError:
+    SPILL_AVAILABLE = False
+    logger.warning("ormsgpack/zstandard no disponibles - los hilos expulsados no se volcarán a disco")
+
+# Presupuesto de memoria para hilos "calientes"; al superarlo se expulsan los menos recientes
+CHECKPOINT_MAX_BYTES = int(os.environ.get("CHECKPOINT_MAX_BYTES", str(64 * 1024 * 1024)))
+CHECKPOINT_MAX_THREADS = int(os.environ.get("CHECKPOINT_MAX_THREADS", "500"))
+# Checkpoints que se conservan por hilo (0 = sin límite); el grafo solo necesita el último
+CHECKPOINT_HISTORY_LIMIT = int(os.environ.get("CHECKPOINT_HISTORY_LIMIT", "10"))
+CHECKPOINT_SPILL_PATH = os.environ.get(
+    "CHECKPOINT_SPILL_PATH", os.path.join(tempfile.gettempdir(), "agentes_checkpoints.sqlite3"))
+CHECKPOINT_ZSTD_LEVEL = int(os.environ.get("CHECKPOINT_ZSTD_LEVEL", "3"))
+
+
+class _ThreadIndex:
+    """Claves y tamaño en memoria de un hilo, para expulsarlo sin recorrer todo el almacén"""
+
+    __slots__ = ("nbytes", "write_keys", "blob_keys", "versions")
+
+    def __init__(self):
+        self.nbytes = 0
+        self.write_keys: Set[tuple] = set()
+        self.blob_keys: Set[tuple] = set()
+        # (checkpoint_ns, checkpoint_id) -> channel_versions, para saber qué blobs siguen en uso
+        self.versions: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+
+class SpillStore:
+    """Almacén SQLite de hilos expulsados, codificados con msgpack + zstd"""
+
+    def __init__(self, path: str = CHECKPOINT_SPILL_PATH, level: int = CHECKPOINT_ZSTD_LEVEL):
+        self.path = path
+        self.level = level
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una conexión por proceso: no se reutiliza la heredada de un fork
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS threads ("
+                "thread_id TEXT PRIMARY KEY, data BLOB NOT NULL, updated_at REAL NOT NULL)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def thread_ids(self) -> Set[str]:
+        with self._lock:
+            return {row[0] for row in self._connection().execute("SELECT thread_id FROM threads")}
+
+    def save(self, thread_id: str, payload: Dict[str, Any]) -> int:
+        data = zstandard.ZstdCompressor(level=self.level).compress(ormsgpack.packb(payload))
+        with self._lock:
+            self._connection().execute(
+                "INSERT OR REPLACE INTO threads (thread_id, data, updated_at) VALUES (?, ?, ?)",
+                (thread_id, data, time.time()))
+        return len(data)
+
+    def load(self, thread_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection().execute(
+                "SELECT data FROM threads WHERE thread_id = ?", (thread_id,)).fetchone()
+        if row is None:
+            return None
+        return ormsgpack.unpackb(zstandard.ZstdDecompressor().decompress(row[0]))
+
+    def delete(self, thread_id: str):
+        with self._lock:
+            self._connection().execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
+
+
+class BoundedCheckpointSaver(MemorySaver):
+    """MemorySaver con presupuesto de bytes/hilos.
+
+    Los hilos menos usados se vuelcan a SQLite y se rehidratan al volver a
+    accederse; el historial de cada hilo se recorta a CHECKPOINT_HISTORY_LIMIT.
+    """
+
+    def __init__(self, max_bytes: int = CHECKPOINT_MAX_BYTES, max_threads: int = CHECKPOINT_MAX_THREADS,
+                 history_limit: int = CHECKPOINT_HISTORY_LIMIT, spill_path: Optional[str] = CHECKPOINT_SPILL_PATH,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.max_bytes = max_bytes
+        self.max_threads = max_threads
+        self.history_limit = history_limit
+        self.spill = SpillStore(spill_path) if SPILL_AVAILABLE and spill_path else None
+        self._index: "OrderedDict[str, _ThreadIndex]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._spilled: Set[str] = set()
+        self.stats_counters = {"evictions": 0, "rehydrations": 0, "dropped": 0}
+        if self.spill is not None:
+            try:
+                self._spilled = self.spill.thread_ids()
+                logger.info(f"Checkpointer con volcado en {self.spill.path} ({len(self._spilled)} hilos en disco)")
+            except Exception as e:
+                logger.error(f"No se pudo abrir el almacén de checkpoints {spill_path}: {e}")
+                self.spill = None
+
+    # --- Contabilidad y expulsión ---
+
+    def _touch(self, thread_id: str) -> _ThreadIndex:
+        """Marca el hilo como usado recientemente, rehidratándolo si estaba en disco"""
+        index = self._index.get(thread_id)
+        if index is None:
+            index = _ThreadIndex()
+            self._index[thread_id] = index
+            if thread_id in self._spilled:
+                self._rehydrate(thread_id, index)
+        self._index.move_to_end(thread_id)
+        return index
+
+    def _total_bytes(self) -> int:
+        return sum(index.nbytes for index in self._index.values())
+
+    def _enforce_budget(self):
+        # Nunca se expulsa el hilo más reciente (el que se está usando)
+        while len(self._index) > 1 and (
+                len(self._index) > self.max_threads or self._total_bytes() > self.max_bytes):
+            thread_id = next(iter(self._index))
+            self._evict(thread_id)
+
+    def _export(self, thread_id: str, index: _ThreadIndex) -> Dict[str, Any]:
+        """Representación serializable de todo lo que hay en memoria para un hilo"""
+        checkpoints = [
+            [ns, checkpoint_id, checkpoint[0], checkpoint[1], metadata[0], metadata[1], parent]
+            for ns, by_id in self.storage.get(thread_id, {}).items()
+            for checkpoint_id, (checkpoint, metadata, parent) in by_id.items()
+        ]
+        writes = [
+            [key[1], key[2], inner[1], task_id, channel, value[0], value[1], task_path]
+            for key in index.write_keys if key in self.writes
+            for inner, (task_id, channel, value, task_path) in self.writes[key].items()
+        ]
+        blobs = [[key[1], key[2], key[3], self.blobs[key][0], self.blobs[key][1]]
+                 for key in index.blob_keys if key in self.blobs]
+        versions = [[ns, checkpoint_id, channel_versions]
+                    for (ns, checkpoint_id), channel_versions in index.versions.items()]
+        return {"checkpoints": checkpoints, "writes": writes, "blobs": blobs, "versions": versions}
+
+    def _drop_from_memory(self, thread_id: str, index: _ThreadIndex):
+        self.storage.pop(thread_id, None)
+        for key in index.write_keys:
+            self.writes.pop(key, None)
+        for key in index.blob_keys:
+            self.blobs.pop(key, None)
+        self._index.pop(thread_id, None)
+
+    def _evict(self, thread_id: str):
+        index = self._index[thread_id]
+        if not any(self.storage.get(thread_id, {}).values()):
+            # Hilo consultado pero sin checkpoints: no hay nada que volcar
+            self._drop_from_memory(thread_id, index)
+            return
+        if self.spill is not None:
+            try:
+                size = self.spill.save(thread_id, self._export(thread_id, index))
+                self._spilled.add(thread_id)
+                self.stats_counters["evictions"] += 1
+                logger.debug(f"Hilo {thread_id} volcado a disco ({index.nbytes} -> {size} bytes)")
+            except Exception as e:
+                logger.error(f"Error volcando el hilo {thread_id} a disco: {e}")
+                self.stats_counters["dropped"] += 1
+        else:
+            self.stats_counters["dropped"] += 1
+        self._drop_from_memory(thread_id, index)
+
+    def _rehydrate(self, thread_id: str, index: _ThreadIndex):
+        try:
+            payload = self.spill.load(thread_id) if self.spill is not None else None
+        except Exception as e:
+            logger.error(f"Error rehidratando el hilo {thread_id}: {e}")
+            payload = None
+        if payload is None:
+            self._spilled.discard(thread_id)
+            return
+
+        for ns, checkpoint_id, c_type, c_bytes, m_type, m_bytes, parent in payload["checkpoints"]:
+            self.storage[thread_id][ns][checkpoint_id] = ((c_type, c_bytes), (m_type, m_bytes), parent)
+            index.nbytes += len(c_bytes) + len(m_bytes)
+        for ns, checkpoint_id, idx, task_id, channel, v_type, v_bytes, task_path in payload["writes"]:
+            key = (thread_id, ns, checkpoint_id)
+            self.writes[key][(task_id, idx)] = (task_id, channel, (v_type, v_bytes), task_path)
+            index.write_keys.add(key)
+            index.nbytes += len(v_bytes)
+        for ns, channel, version, b_type, b_bytes in payload["blobs"]:
+            key = (thread_id, ns, channel, version)
+            self.blobs[key] = (b_type, b_bytes)
+            index.blob_keys.add(key)
+            index.nbytes += len(b_bytes)
+        for ns, checkpoint_id, channel_versions in payload["versions"]:
+            index.versions[(ns, checkpoint_id)] = channel_versions
+        self.stats_counters["rehydrations"] += 1
+        logger.debug(f"Hilo {thread_id} rehidratado desde disco ({index.nbytes} bytes)")
+
+    def _prune_history(self, thread_id: str, checkpoint_ns: str, index: _ThreadIndex):
+        """Descarta los checkpoints más antiguos del hilo y los blobs que ya nadie referencia"""
+        by_id = self.storage[thread_id][checkpoint_ns]
+        if not self.history_limit or len(by_id) <= self.history_limit:
+            return
+        for checkpoint_id in sorted(by_id)[:-self.history_limit]:
+            checkpoint, metadata, _ = by_id.pop(checkpoint_id)
+            index.nbytes -= len(checkpoint[1]) + len(metadata[1])
+            index.versions.pop((checkpoint_ns, checkpoint_id), None)
+            key = (thread_id, checkpoint_ns, checkpoint_id)
+            if key in index.write_keys:
+                index.nbytes -= self._writes_size(key)
+                self.writes.pop(key, None)
+                index.write_keys.discard(key)
+
+        referenced = {(thread_id, ns, channel, version)
+                      for (ns, _), channel_versions in index.versions.items()
+                      for channel, version in channel_versions.items()}
+        for key in [k for k in index.blob_keys if k[1] == checkpoint_ns and k not in referenced]:
+            blob = self.blobs.pop(key, None)
+            if blob is not None:
+                index.nbytes -= len(blob[1])
+            index.blob_keys.discard(key)
+
+    def _writes_size(self, key: tuple) -> int:
+        return sum(len(value[1]) for _, _, value, _ in self.writes.get(key, {}).values())
+
+    # --- API de BaseCheckpointSaver ---
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            result = super().get_tuple(config)
+            self._enforce_budget()
+            return result
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            # Se materializa bajo el lock para no exponer el almacén a expulsiones concurrentes
+            items = [*super().list(config, filter=filter, before=before, limit=limit)]
+            self._enforce_budget()
+        yield from items
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"]["checkpoint_ns"]
+        with self._lock:
+            index = self._touch(thread_id)
+            result = super().put(config, checkpoint, metadata, new_versions)
+
+            saved_checkpoint, saved_metadata, _ = self.storage[thread_id][checkpoint_ns][checkpoint["id"]]
+            index.nbytes += len(saved_checkpoint[1]) + len(saved_metadata[1])
+            for channel, version in new_versions.items():
+                key = (thread_id, checkpoint_ns, channel, version)
+                if key not in index.blob_keys:
+                    index.blob_keys.add(key)
+                    index.nbytes += len(self.blobs[key][1])
+            index.versions[(checkpoint_ns, checkpoint["id"])] = dict(checkpoint["channel_versions"])
+
+            self._prune_history(thread_id, checkpoint_ns, index)
+            self._enforce_budget()
+            return result
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        key = (thread_id, config["configurable"].get("checkpoint_ns", ""), config["configurable"]["checkpoint_id"])
+        with self._lock:
+            index = self._touch(thread_id)
+            before = self._writes_size(key)
+            super().put_writes(config, writes, task_id, task_path)
+            index.write_keys.add(key)
+            index.nbytes += self._writes_size(key) - before
+            self._enforce_budget()
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            index = self._index.get(thread_id)
+            if index is not None:
+                self._drop_from_memory(thread_id, index)
+            self.storage.pop(thread_id, None)
+            if thread_id in self._spilled:
+                self._spilled.discard(thread_id)
+                if self.spill is not None:
+                    self.spill.delete(thread_id)
+
+    # --- Utilidades ---
+
+    def flush(self):
+        """Vuelca a disco todos los hilos en memoria sin expulsarlos (p. ej. al apagar)"""
+        if self.spill is None:
+            return
+        with self._lock:
+            for thread_id, index in self._index.items():
+                try:
+                    self.spill.save(thread_id, self._export(thread_id, index))
+                    self._spilled.add(thread_id)
+                except Exception as e:
+                    logger.error(f"Error volcando el hilo {thread_id} a disco: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Estado del checkpointer para el endpoint de salud"""
+        with self._lock:
+            return {
+                "hot_threads": len(self._index),
+                "hot_bytes": self._total_bytes(),
+                "max_bytes": self.max_bytes,
+                "max_threads": self.max_threads,
+                "spilled_threads": len(self._spilled),
+                "spill_path": self.spill.path if self.spill is not None else None,
+                **self.stats_counters,
+            }
@@ -0,0 +1,182 @@
+# api/context_manager.py - Recorte del historial por presupuesto de tokens con resumen incremental
+import os
+import json
+import logging
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+from api.blob_store import resolve_message
+from api.models import get_chat_model
+from api.streaming import extract_text
+from api.summarizer import SUMMARY_MODEL, count_tokens, split_by_tokens
+
+logger = logging.getLogger("context_manager")
+
+# Presupuesto de tokens del prompt del orquestador (sistema + resumen + historial)
+CONTEXT_TOKEN_BUDGET = int(os.environ.get("CONTEXT_TOKEN_BUDGET", "16000"))
+# Al superar el presupuesto se pliega historial hasta quedar en esta fracción (evita plegar en cada turno)
+CONTEXT_TARGET_RATIO = float(os.environ.get("CONTEXT_TARGET_RATIO", "0.75"))
+# Salidas de herramientas de turnos anteriores por encima de este tamaño se recortan en el prompt
+CONTEXT_TOOL_MESSAGE_TOKENS = int(os.environ.get("CONTEXT_TOOL_MESSAGE_TOKENS", "1500"))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get("CONTEXT_SUMMARY_MAX_TOKENS", "800"))
+# Tokens máximos de historial plegado que se envían al modelo de resumen
+CONTEXT_FOLD_INPUT_TOKENS = int(os.environ.get("CONTEXT_FOLD_INPUT_TOKENS", "12000"))
+
+# Coste fijo aproximado por mensaje (rol y delimitadores del formato de chat)
+_MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def message_tokens(message: BaseMessage) -> int:
+    """Tokens aproximados que ocupa un mensaje en el prompt"""
+    tokens = _MESSAGE_OVERHEAD_TOKENS + count_tokens(extract_text(message.content))
+    if isinstance(message, AIMessage) and message.tool_calls:
+        tokens += count_tokens(json.dumps([{"name": c["name"], "args": c["args"]} for c in message.tool_calls],
+                                          ensure_ascii=False))
+    return tokens
+
+
+def _latest_system_message(messages: Sequence[BaseMessage]) -> Optional[SystemMessage]:
+    # Cada turno añade el prompt del orquestador; solo el último se envía al modelo
+    return next((m for m in reversed(messages) if isinstance(m, SystemMessage)), None)
+
+
+def _clip_tool_message(message: ToolMessage, max_tokens: int) -> ToolMessage:
+    text = extract_text(message.content)
+    if count_tokens(text) <= max_tokens:
+        return message
+    head = split_by_tokens(text, max_tokens, max_tokens)[0]
+    return ToolMessage(content=f"{head}\n[... salida recortada de un turno anterior ...]",
+                       tool_call_id=message.tool_call_id, name=message.name)
+
+
+def _conversation(messages: Sequence[BaseMessage], start: int) -> List[Tuple[int, BaseMessage]]:
+    """Mensajes no plegados (sin prompts de sistema) con su posición en el estado.
+
+    Las salidas de herramientas guardadas fuera de línea se resuelven aquí.
+    """
+    return [(i, resolve_message(m)) for i, m in enumerate(messages)
+            if i >= start and not isinstance(m, SystemMessage)]
+
+
+def _current_turn_start(conversation: List[Tuple[int, BaseMessage]]) -> int:
+    """Posición (en el estado) del último mensaje humano: inicio del turno en curso"""
+    for i, message in reversed(conversation):
+        if isinstance(message, HumanMessage):
+            return i
+    return conversation[0][0] if conversation else 0
+
+
+def _summary_message(summary: str) -> SystemMessage:
+    return SystemMessage(content=f"Resumen de la conversación anterior:\n{summary}")
+
+
+def build_prompt_messages(state: Dict[str, Any]) -> List[BaseMessage]:
+    """Mensajes que se envían al orquestador: sistema, resumen y turnos no plegados.
+
+    Las salidas voluminosas de herramientas de turnos anteriores se recortan;
+    las del turno en curso se envían completas.
+    """
+    messages = state["messages"]
+    summary = state.get("summary") or ""
+    conversation = _conversation(messages, state.get("summarized_count") or 0)
+    turn_start = _current_turn_start(conversation)
+
+    prompt: List[BaseMessage] = []
+    system = _latest_system_message(messages)
+    if system is not None:
+        prompt.append(system)
+    if summary:
+        prompt.append(_summary_message(summary))
+    for i, message in conversation:
+        if isinstance(message, ToolMessage) and i < turn_start:
+            message = _clip_tool_message(message, CONTEXT_TOOL_MESSAGE_TOKENS)
+        prompt.append(message)
+    return prompt
+
+
+def plan_fold(state: Dict[str, Any]) -> Optional[Tuple[List[BaseMessage], int]]:
+    """Decide qué turnos antiguos plegar en el resumen.
+
+    Devuelve (mensajes a plegar, nuevo summarized_count) o None si el prompt
+    cabe en CONTEXT_TOKEN_BUDGET. Solo se corta en inicios de turno para no
+    separar llamadas a herramientas de sus resultados, y nunca se pliega el
+    turno en curso.
+    """
+    prompt = build_prompt_messages(state)
+    total = sum(message_tokens(m) for m in prompt)
+    if total <= CONTEXT_TOKEN_BUDGET:
+        return None
+
+    messages = state["messages"]
+    conversation = _conversation(messages, state.get("summarized_count") or 0)
+    turn_start = _current_turn_start(conversation)
+    target = int(CONTEXT_TOKEN_BUDGET * CONTEXT_TARGET_RATIO)
+
+    # Tokens de cada mensaje tal como aparece en el prompt (sin sistema ni resumen)
+    prompt_tokens = {i: message_tokens(m) for (i, _), m in zip(conversation, prompt[len(prompt) - len(conversation):])}
+    boundaries = [i for i, m in conversation if isinstance(m, HumanMessage) and i <= turn_start]
+
+    to_fold: List[BaseMessage] = []
+    new_count = None
+    for boundary in boundaries[1:]:
+        folded = [(i, m) for i, m in conversation if (new_count or 0) <= i < boundary]
+        to_fold.extend(m for _, m in folded)
+        total -= sum(prompt_tokens[i] for i, _ in folded)
+        new_count = boundary
+        if total <= target:
+            break
+
+    if new_count is None:
+        logger.warning(f"El turno en curso ocupa {total} tokens y no puede plegarse (presupuesto {CONTEXT_TOKEN_BUDGET})")
+        return None
+    return to_fold, new_count
+
+
+def _render(messages: Sequence[BaseMessage]) -> str:
+    roles = {"human": "Usuario", "ai": "Asistente", "tool": "Herramienta"}
+    lines = []
+    for message in messages:
+        text = extract_text(message.content)
+        if isinstance(message, AIMessage) and message.tool_calls:
+            text += " [llamadas: " + ", ".join(c["name"] for c in message.tool_calls) + "]"
+        if isinstance(message, ToolMessage):
+            text = split_by_tokens(text, CONTEXT_TOOL_MESSAGE_TOKENS, CONTEXT_TOOL_MESSAGE_TOKENS)[0] if text else text
+        lines.append(f"{roles.get(message.type, message.type)}: {text}")
+    rendered = "\n".join(lines)
+    return split_by_tokens(rendered, CONTEXT_FOLD_INPUT_TOKENS, CONTEXT_FOLD_INPUT_TOKENS)[0] if rendered else rendered
+
+
+def _fold_prompt(summary: str, messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+    previous = summary or "(sin resumen previo)"
+    return [HumanMessage(content=(
+        f"Resumen actual de la conversación:\n---\n{previous}\n---\n\n"
+        f"Turnos anteriores que deben incorporarse al resumen:\n---\n{_render(messages)}\n---\n\n"
+        "Actualiza el resumen de forma concisa, conservando datos, decisiones, preferencias del usuario "
+        "y resultados de herramientas que puedan ser necesarios más adelante:"))]
+
+
+def _summary_model():
+    return get_chat_model("openai", SUMMARY_MODEL, streaming=False).bind(max_tokens=CONTEXT_SUMMARY_MAX_TOKENS)
+
+
+def manage_context(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Nodo del grafo: pliega turnos antiguos en el resumen si el prompt excede el presupuesto"""
+    plan = plan_fold(state)
+    if plan is None:
+        return {}
+    to_fold, new_count = plan
+    logger.info(f"Plegando {len(to_fold)} mensajes antiguos en el resumen del hilo")
+    summary = _summary_model().invoke(_fold_prompt(state.get("summary") or "", to_fold)).content
+    return {"summary": extract_text(summary), "summarized_count": new_count}
+
+
+async def amanage_context(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Variante asíncrona de manage_context"""
+    plan = plan_fold(state)
+    if plan is None:
+        return {}
+    to_fold, new_count = plan
+    logger.info(f"Plegando {len(to_fold)} mensajes antiguos en el resumen del hilo")
+    summary = (await _summary_model().ainvoke(_fold_prompt(state.get("summary") or "", to_fold))).content
+    return {"summary": extract_text(summary), "summarized_count": new_count}
@@ -0,0 +1,17 @@
+# api/gunicorn_conf.py - Configuración de gunicorn con warm-up del agente en cada worker
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get("GUNICORN_WORKERS", "1"))
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+timeout = 0
+
+# La app se importa una vez en el master; cada worker hereda los módulos ya cargados
+preload_app = True
+
+
+def post_fork(server, worker):
+    """Inicia la inicialización del agente en cuanto arranca el worker"""
+    from api.index import start_agent_warmup
+    start_agent_warmup()
+    server.log.info(f"Warm-up del agente iniciado en el worker {worker.pid}")
@@ -0,0 +1,325 @@
+# api/hedging.py - Peticiones con cobertura (hedging) entre proveedores de LLM
+import os
+import time
+import queue
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, message_chunk_to_message
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, LLMResult
+from langchain_core.runnables.config import (
+    ensure_config, get_async_callback_manager_for_config, get_callback_manager_for_config
+)
+
+from api.async_runtime import get_loop
+from api.models import get_chat_model
+from api.streaming import extract_text
+
+logger = logging.getLogger("hedging")
+
+# Opt-in: sin activar, cada llamada va solo al proveedor principal
+HEDGING_ENABLED = os.environ.get("HEDGING_ENABLED", "false").lower() in ("1", "true", "yes")
+# Proveedor secundario por modelo principal: "openai:gpt-4o=google:gemini-1.5-pro,..."
+_DEFAULT_HEDGE_PAIRS = "openai:gpt-4o=google:gemini-1.5-pro,openai:gpt-4o-mini=google:gemini-1.5-flash"
+HEDGE_PAIRS = dict(
+    pair.split("=", 1) for pair in os.environ.get("HEDGE_PAIRS", _DEFAULT_HEDGE_PAIRS).split(",") if "=" in pair
+)
+# El retardo antes de cubrir es el percentil del primer token del principal, acotado
+HEDGE_DELAY_PERCENTILE = float(os.environ.get("HEDGE_DELAY_PERCENTILE", "0.95"))
+HEDGE_INITIAL_DELAY = float(os.environ.get("HEDGE_INITIAL_DELAY", "2.0"))
+HEDGE_MIN_DELAY = float(os.environ.get("HEDGE_MIN_DELAY", "0.3"))
+HEDGE_MAX_DELAY = float(os.environ.get("HEDGE_MAX_DELAY", "8.0"))
+HEDGE_MIN_SAMPLES = int(os.environ.get("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = int(os.environ.get("HEDGE_WINDOW", "500"))
+# Tiempo máximo que se espera al perdedor para medir la latencia ahorrada; después se cancela
+HEDGE_LOSER_OBSERVE_TIMEOUT = float(os.environ.get("HEDGE_LOSER_OBSERVE_TIMEOUT", "10"))
+
+# Sin callbacks: los eventos de streaming los emite el hedger solo para el ganador
+_ISOLATED = {"callbacks": []}
+
+
+def _parse_spec(spec: str) -> Tuple[str, str]:
+    provider, _, model_name = spec.partition(":")
+    return (provider, model_name) if model_name else ("openai", provider)
+
+
+class _HedgeStats:
+    def __init__(self):
+        self.first_token = deque(maxlen=HEDGE_WINDOW)
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.secondary_wins = 0
+        self.failovers = 0
+        self.saved_total = 0.0
+        self.saved_samples = 0
+
+    def delay(self) -> float:
+        if len(self.first_token) < HEDGE_MIN_SAMPLES:
+            return HEDGE_INITIAL_DELAY
+        ordered = sorted(self.first_token)
+        value = ordered[min(len(ordered) - 1, int(HEDGE_DELAY_PERCENTILE * len(ordered)))]
+        return min(HEDGE_MAX_DELAY, max(HEDGE_MIN_DELAY, value))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "primary_wins": self.primary_wins,
+            "secondary_wins": self.secondary_wins,
+            "secondary_win_rate": round(self.secondary_wins / self.hedged, 3) if self.hedged else None,
+            "failovers": self.failovers,
+            "latency_saved_total": round(self.saved_total, 3),
+            "latency_saved_avg": round(self.saved_total / self.saved_samples, 3) if self.saved_samples else None,
+            "hedge_delay": round(self.delay(), 3),
+        }
+
+
+class _Race:
+    """Estado compartido de una carrera entre principal (0) y secundario (1)"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.lock = threading.Lock()
+        self.winner: Optional[int] = None
+        self.first_at: Dict[int, float] = {}
+        self.stopped = {0: False, 1: False}
+
+
+class LLMHedger:
+    """Cubre la llamada al proveedor principal con una al secundario si tarda en responder.
+
+    Si el principal no produce su primer chunk antes del percentil configurado
+    de su latencia histórica, se lanza la misma petición al secundario; gana el
+    primero que emite un chunk y el otro se cancela. Solo los chunks del ganador
+    se reenvían a los callbacks (streaming de tokens del grafo).
+    """
+
+    def __init__(self, enabled: bool = HEDGING_ENABLED, pairs: Dict[str, str] = HEDGE_PAIRS):
+        self.enabled = enabled
+        self.pairs = {key.strip(): _parse_spec(value.strip()) for key, value in pairs.items()}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, _HedgeStats] = {}
+        self._unavailable: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _stats_for(self, key: str) -> _HedgeStats:
+        with self._lock:
+            return self._stats.setdefault(key, _HedgeStats())
+
+    def partner_for(self, provider: str, model_name: str):
+        """Modelo secundario para (proveedor, modelo), o None si no hay cobertura posible"""
+        if not self.enabled:
+            return None
+        spec = self.pairs.get(f"{provider}:{model_name}")
+        if spec is None or spec in self._unavailable:
+            return None
+        try:
+            return get_chat_model(*spec)
+        except ValueError as e:
+            # Falta la clave del proveedor secundario: no se vuelve a intentar
+            logger.warning(f"Cobertura desactivada para {provider}:{model_name}: {e}")
+            self._unavailable.add(spec)
+            return None
+
+    def _observe_first(self, race: _Race, stats: _HedgeStats, index: int, at: float) -> bool:
+        """Registra el primer chunk de un lado. Devuelve True si ese lado gana la carrera"""
+        with race.lock:
+            race.first_at[index] = at - race.started
+            won = race.winner is None
+            if won:
+                race.winner = index
+                race.stopped[1 - index] = True
+        with self._lock:
+            if index == 0:
+                stats.first_token.append(race.first_at[0])
+            if not won and index == 0 and race.winner == 1:
+                # El principal acabó respondiendo: se mide cuánto se ahorró
+                stats.saved_total += race.first_at[0] - race.first_at[1]
+                stats.saved_samples += 1
+        return won
+
+    def _record_result(self, stats: _HedgeStats, race: _Race, hedged: bool, failover: bool):
+        with self._lock:
+            stats.requests += 1
+            if hedged:
+                stats.hedged += 1
+                if race.winner == 0:
+                    stats.primary_wins += 1
+                elif race.winner == 1:
+                    stats.secondary_wins += 1
+            if failover:
+                stats.failovers += 1
+
+    @staticmethod
+    def _final_message(chunks: List[Any]) -> AIMessage:
+        if not chunks:
+            return AIMessage(content="")
+        merged = chunks[0]
+        for chunk in chunks[1:]:
+            merged = merged + chunk
+        return message_chunk_to_message(merged)
+
+    def attach_loop(self, loop: Optional[asyncio.AbstractEventLoop]):
+        """Bucle en el que corren las carreras de invoke (el del servidor ASGI, si lo hay).
+
+        Los clientes asíncronos de los modelos quedan ligados al bucle en el que se
+        usan; así las carreras síncronas y las asíncronas comparten bucle.
+        """
+        self._loop = loop
+
+    def _race_loop(self) -> asyncio.AbstractEventLoop:
+        loop = self._loop
+        return loop if loop is not None and loop.is_running() else get_loop()
+
+    async def _race(self, primary, secondary, messages: Sequence[BaseMessage], key: str,
+                    emit: Callable[[Any], Awaitable[None]]) -> AIMessage:
+        """Carrera entre principal y secundario; `emit` recibe solo los chunks del ganador"""
+        stats = self._stats_for(key)
+        race = _Race(time.perf_counter())
+        events: "asyncio.Queue[Tuple[int, str, Any]]" = asyncio.Queue()
+        tasks: Dict[int, asyncio.Task] = {}
+
+        async def pump(index: int, llm):
+            stream = llm.astream(messages, config=_ISOLATED)
+            try:
+                async for chunk in stream:
+                    if index not in race.first_at and not self._observe_first(race, stats, index, time.perf_counter()):
+                        return
+                    if race.stopped[index]:
+                        return
+                    await events.put((index, "chunk", chunk))
+                await events.put((index, "end", None))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await events.put((index, "error", e))
+            finally:
+                # Cerrar el stream cierra la respuesta HTTP del perdedor
+                await stream.aclose()
+
+        def launch(index: int, llm):
+            tasks[index] = asyncio.create_task(pump(index, llm))
+
+        def settle_loser():
+            # Se espera al perdedor solo hasta su primer chunk (para medir el ahorro), con tope
+            loser = tasks.get(1 - race.winner) if race.winner is not None else None
+            if loser is not None and not loser.done():
+                asyncio.get_running_loop().call_later(HEDGE_LOSER_OBSERVE_TIMEOUT, loser.cancel)
+
+        launch(0, primary)
+        deadline = race.started + stats.delay()
+        hedged, failover, chunks, failed = False, False, [], set()
+        try:
+            while True:
+                # Con ganador (o ya cubierto) no hay plazo: solo se espera al stream en curso
+                waiting_hedge = not hedged and race.winner is None
+                timeout = max(0.0, deadline - time.perf_counter()) if waiting_hedge else None
+                try:
+                    index, kind, payload = await asyncio.wait_for(events.get(), timeout)
+                except asyncio.TimeoutError:
+                    if race.winner is None:
+                        logger.info(f"Sin primer token de {key} en {stats.delay():.2f}s; lanzando petición de cobertura")
+                        hedged = True
+                        launch(1, secondary)
+                    continue
+                if race.winner is not None and index != race.winner:
+                    continue
+                if kind == "chunk":
+                    if len(chunks) == 0:
+                        settle_loser()
+                    chunks.append(payload)
+                    await emit(payload)
+                elif kind == "end":
+                    break
+                else:
+                    failed.add(index)
+                    # Un fallo antes del primer token pasa al otro proveedor; después no hay alternativa
+                    if race.winner is None and 1 - index not in failed:
+                        failover = True
+                        if not hedged:
+                            hedged = True
+                            launch(1, secondary)
+                        continue
+                    self._record_result(stats, race, hedged, failover)
+                    raise payload
+        except asyncio.CancelledError:
+            for task in tasks.values():
+                task.cancel()
+            raise
+
+        self._record_result(stats, race, hedged, failover)
+        return self._final_message(chunks)
+
+    def invoke(self, primary, secondary, messages: Sequence[BaseMessage], key: str,
+               config: Optional[Dict[str, Any]] = None) -> AIMessage:
+        """Invoca `primary` con cobertura de `secondary` (si es None, llamada normal).
+
+        La carrera corre en el bucle de eventos compartido para poder cancelar al
+        perdedor aunque esté bloqueado esperando al proveedor. `config` se combina
+        con la del grafo (p. ej. {"callbacks": []} para no emitir tokens).
+        """
+        if secondary is None:
+            return primary.invoke(messages, config=config)
+
+        run_manager = get_callback_manager_for_config(ensure_config(config)).on_chat_model_start(
+            {"name": "HedgedChatModel"}, [list(messages)], name=key)[0]
+        events: "queue.Queue[Tuple[str, Any]]" = queue.Queue()
+
+        async def emit(chunk):
+            events.put(("chunk", chunk))
+
+        loop = self._race_loop()
+        try:
+            in_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            raise RuntimeError("hedger.invoke no puede llamarse desde el bucle de las carreras; usa 'await hedger.ainvoke'")
+        future = asyncio.run_coroutine_threadsafe(self._race(primary, secondary, messages, key, emit), loop)
+        future.add_done_callback(lambda _: events.put(("done", None)))
+        try:
+            # Los tokens del ganador se reenvían desde este hilo (callbacks del grafo síncrono)
+            while True:
+                kind, payload = events.get()
+                if kind == "done":
+                    break
+                run_manager.on_llm_new_token(extract_text(payload.content), chunk=ChatGenerationChunk(message=payload))
+            message = future.result()
+        except BaseException as e:
+            future.cancel()
+            run_manager.on_llm_error(e)
+            raise
+        run_manager.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+        return message
+
+    async def ainvoke(self, primary, secondary, messages: Sequence[BaseMessage], key: str,
+                      config: Optional[Dict[str, Any]] = None) -> AIMessage:
+        """Variante asíncrona de invoke"""
+        if secondary is None:
+            return await primary.ainvoke(messages, config=config)
+
+        run_manager = (await get_async_callback_manager_for_config(ensure_config(config)).on_chat_model_start(
+            {"name": "HedgedChatModel"}, [list(messages)], name=key))[0]
+
+        async def emit(chunk):
+            await run_manager.on_llm_new_token(extract_text(chunk.content), chunk=ChatGenerationChunk(message=chunk))
+
+        try:
+            message = await self._race(primary, secondary, messages, key, emit)
+        except BaseException as e:
+            await run_manager.on_llm_error(e)
+            raise
+        await run_manager.on_llm_end(LLMResult(generations=[[ChatGeneration(message=message)]]))
+        return message
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"enabled": self.enabled, "models": {key: stats.snapshot() for key, stats in self._stats.items()}}
+
+
+# Instancia global del hedger
+hedger = LLMHedger()
@@ -4,32 +4,58 @@ import operator
 import logging
 import traceback
 import json
+import hashlib
 import asyncio
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
 from datetime import datetime, timezone
 from flask import Flask, request, Response, stream_with_context, jsonify
 from flask_cors import CORS
 from dotenv import load_dotenv
-from supabase.client import create_client, Client
+from supabase.client import Client
 
 # Importaciones MCP y herramientas mejoradas
 from api.mcp_client import initialize_mcp_clients, get_mcp_tools_for_langchain, cleanup_mcp_clients
 from api.tools import tool_registry
+from api.async_runtime import run_sync
+from api.auth import TokenVerifier, InvalidTokenError
+from api.models import get_chat_model, get_model_cache_stats
+from api.summarizer import summarize_tool_output
+from api.blob_store import blob_store, offload_tool_messages
+from api.context_manager import build_prompt_messages, manage_context, amanage_context
+from api.semantic_cache import SEMANTIC_CACHE_ENABLED, response_cache
+from api.tool_selector import ToolSelector, tool_set_fingerprint
+from api.model_router import model_router
+from api.hedging import hedger
+from api.admission import admission
+from api.stream_replay import request_key, stream_runs
+from api.chat_persistence import ChatLog, chat_writer, message_log
+from api.thread_hydration import thread_hydrator
+from api.tool_catalog import catalog_fingerprint, compile_tool_catalog
+from api.user_catalogs import ToolCatalog, UserSession, user_catalogs
+from api.supabase_pool import create_supabase_client, get_supabase_client, get_user_supabase_client
+from api.tool_executor import execute_tool_calls, aexecute_tool_calls
+from api.streaming import (
+    STREAM_MODE, TOKEN_STREAM_MODES, UPDATE_STREAM_MODES, encode_sse, sse_done, get_progress_writer,
+    iter_token_frames, iter_update_frames
+)
 
-# CORREGIDO: Importaciones simplificadas y seguras
+# Checkpointer con memoria acotada y volcado a disco
 try:
-    from langgraph.checkpoint import MemorySaver
+    from api.checkpointer import BoundedCheckpointSaver
     CHECKPOINTER_AVAILABLE = True
-    logging.info("MemorySaver disponible")
+    logging.info("BoundedCheckpointSaver disponible")
 except ImportError:
     CHECKPOINTER_AVAILABLE = False
     logging.warning("No hay checkpointer disponible")
 
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
-from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.messages import (
     HumanMessage, SystemMessage, BaseMessage, ToolMessage, AIMessage
 )
 from langchain.tools import StructuredTool
+from langchain_core.runnables import RunnableLambda
 from pydantic import BaseModel, Field
 from typing import TypedDict, Annotated, Sequence
 from langgraph.graph import StateGraph, END
@@ -64,55 +90,94 @@ logging.basicConfig(level=logging.INFO)
 # Variables globales para MCP y sistema
 memory = None
 _APP_GRAPH = None
-_IS_INITIALIZING = False
 _MCP_INITIALIZED = False
-
-# CORREGIDO: Configurar checkpointer simplificado
+# Huella del conjunto de herramientas del grafo (ámbito de la caché semántica)
+_AGENT_TOOL_SCOPE = ""
+_TOOL_SELECTOR = None
+_TOOL_CATALOG_REPORT = None
+# Herramientas sin datos de usuario (locales y MCP), compartidas por todos los catálogos por usuario
+_SHARED_TOOLS = []
+
+# Inicialización del agente compartida entre peticiones concurrentes
+_INIT_LOCK = threading.Lock()
+_INIT_FUTURE = None
+_INIT_PID = None
+AGENT_INIT_WAIT_TIMEOUT = float(os.environ.get("AGENT_INIT_WAIT_TIMEOUT", "60"))
+
+# Grafos compilados por huella del catálogo (herramientas + configuración de agentes)
+GRAPH_CACHE_SIZE = int(os.environ.get("GRAPH_CACHE_SIZE", "4"))
+# Cada cuánto se comprueba si cambió la tabla `agents` (0 desactiva la recarga en caliente)
+AGENT_REFRESH_INTERVAL = float(os.environ.get("AGENT_REFRESH_INTERVAL", "30"))
+_GRAPH_CACHE = OrderedDict()
+_GRAPH_FINGERPRINT = None
+_AGENTS_VERSION = None
+_GRAPH_SWAP_LOCK = threading.Lock()
+_REFRESH_LOCK = threading.Lock()
+_REFRESHER_PID = None
+
+# Checkpointer acotado: hilos calientes en memoria, el resto en SQLite
 def setup_memory():
     if CHECKPOINTER_AVAILABLE:
         try:
-            memory = MemorySaver()
-            logging.info("Usando MemorySaver para persistencia de conversaciones")
+            memory = BoundedCheckpointSaver()
+            logging.info("Usando BoundedCheckpointSaver para persistencia de conversaciones")
             return memory
         except Exception as e:
-            logging.error(f"Error configurando MemorySaver: {e}")
+            logging.error(f"Error configurando BoundedCheckpointSaver: {e}")
     
     logging.warning("Sin memoria persistente - conversaciones no se guardarán entre reinicializaciones")
     return None
 
-def create_supabase_client(admin=False) -> Client:
-    url = os.environ.get("SUPABASE_URL")
-    anon_key = os.environ.get("SUPABASE_ANON_KEY")
-    service_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    
-    key = service_key if admin else anon_key
-    if not url or not key: 
-        raise ValueError(f"Variables de Supabase no configuradas. URL: {url}, Key: {'***' if key else None}")
-    return create_client(url, key)
-
-def get_chat_model(provider: str, model_name: str, temperature: float = 0.0):
-    provider = provider.lower()
-    api_key_name = f"{provider.upper()}_API_KEY"
-    api_key = os.environ.get(api_key_name)
-    if not api_key: 
-        raise ValueError(f"Variable de entorno {api_key_name} no encontrada.")
-    
-    if provider == "openai":
-        return ChatOpenAI(model=model_name, temperature=temperature, api_key=api_key, streaming=True)
-    elif provider == "google":
-        return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=api_key, convert_system_message_to_human=True, streaming=True)
-    else:
-        logging.warning(f"Proveedor '{provider}' no soportado. Usando OpenAI gpt-4o-mini como fallback.")
-        return ChatOpenAI(model="gpt-4o-mini", temperature=temperature, api_key=os.environ.get("OPENAI_API_KEY"), streaming=True)
+# Verificación de tokens local con caché; Supabase Auth como respaldo
+token_verifier = TokenVerifier(remote_client_factory=get_supabase_client)
 
 def summarize_if_needed(original_query: str, tool_output: str) -> str:
-    MAX_CHARS = 32000
-    if len(tool_output) > MAX_CHARS:
-        logging.warning("Salida de herramienta demasiado larga. Resumiendo...")
-        summarizer_model = get_chat_model("openai", "gpt-4o-mini")
-        prompt = f'Pregunta Original: "{original_query}"\n\nResultado de Herramienta:\n---\n{tool_output[:MAX_CHARS]}\n---\n\nResume concisamente la información relevante para responder la pregunta:'
-        return summarizer_model.invoke([HumanMessage(content=prompt)]).content
-    return tool_output
+    """Resume salidas largas de herramientas (map-reduce por tokens, con caché)"""
+    return summarize_tool_output(original_query, tool_output)
+
+def build_document_search_tool(client_provider) -> StructuredTool:
+    """search_my_documents con el cliente que devuelva `client_provider` en cada llamada"""
+    return StructuredTool.from_function(
+        func=lambda q: tool_registry.execute_tool("search_my_documents", query=q, supabase_user_client=client_provider()),
+        name="search_my_documents",
+        description="Busca en los documentos personales del usuario para encontrar información relevante.",
+        metadata={"registry_tool": "search_my_documents", "user_scoped": True}
+    )
+
+def load_specialist_agent_tools(supabase_user_client: Client) -> list:
+    """Una herramienta por cada agente especializado visible para el cliente"""
+    specialist_tools = []
+    try:
+        response = supabase_user_client.from_("agents").select("name, description, model_provider, model_name, system_prompt").neq("name", "Asistente Orquestador").execute()
+        if response.data:
+            for agent_config in response.data:
+                if agent_config['model_provider'].lower() not in ['openai', 'google']:
+                    logging.warning(f"Saltando agente {agent_config['name']} con proveedor no soportado: {agent_config['model_provider']}")
+                    continue
+                    
+                class ToolSchema(BaseModel):
+                    task: str = Field(description=f"La tarea o pregunta detallada para el agente '{agent_config['name']}'.")
+                
+                def run_specialist_agent(task: str, cfg=agent_config):
+                    provider, model_name = cfg['model_provider'].lower(), cfg['model_name']
+                    model = get_chat_model(provider, model_name)
+                    messages = [SystemMessage(content=cfg.get('system_prompt')), HumanMessage(content=task)]
+                    # Con HEDGING_ENABLED, un proveedor lento se cubre con el secundario configurado
+                    return hedger.invoke(model, hedger.partner_for(provider, model_name), messages,
+                                         f"{provider}:{model_name}").content
+                
+                tool_name = agent_config['name'].lower().replace(' ', '_').replace('-', '_')
+                specialist_tool = StructuredTool.from_function(
+                    func=run_specialist_agent, 
+                    name=tool_name, 
+                    description=f"Agente especializado: {agent_config['description']}", 
+                    args_schema=ToolSchema,
+                    metadata={"agent_config": dict(agent_config), "user_scoped": True}
+                )
+                specialist_tools.append(specialist_tool)
+    except Exception as e:
+        logging.error(f"Error al obtener agentes de Supabase: {e}")
+    return specialist_tools
 
 async def get_all_available_tools(supabase_user_client: Client) -> list:
     """Obtiene todas las herramientas disponibles incluyendo MCP"""
@@ -123,20 +188,18 @@ async def get_all_available_tools(supabase_user_client: Client) -> list:
     search_tool = StructuredTool.from_function(
         func=lambda q: tool_registry.execute_tool("internet_search", query=q),
         name="internet_search", 
-        description="Busca en internet para obtener información actualizada."
+        description="Busca en internet para obtener información actualizada.",
+        metadata={"registry_tool": "internet_search"}
     )
     
     url_analyzer_tool = StructuredTool.from_function(
         func=lambda url: tool_registry.execute_tool("analyze_url_content", url=url),
         name="analyze_url_content", 
-        description="Extrae texto de una imagen o PDF desde una URL."
+        description="Extrae texto de una imagen o PDF desde una URL.",
+        metadata={"registry_tool": "analyze_url_content"}
     )
     
-    rag_tool = StructuredTool.from_function(
-        func=lambda q: tool_registry.execute_tool("search_my_documents", query=q, supabase_user_client=supabase_user_client),
-        name="search_my_documents",
-        description="Busca en los documentos personales del usuario para encontrar información relevante."
-    )
+    rag_tool = build_document_search_tool(lambda: supabase_user_client)
     
     all_tools.extend([search_tool, url_analyzer_tool, rag_tool])
     
@@ -150,157 +213,464 @@ async def get_all_available_tools(supabase_user_client: Client) -> list:
             logging.error(f"Error obteniendo herramientas MCP: {e}")
     
     # Agentes especializados de Supabase
-    try:
-        response = supabase_user_client.from_("agents").select("name, description, model_provider, model_name, system_prompt").neq("name", "Asistente Orquestador").execute()
-        if response.data:
-            for agent_config in response.data:
-                if agent_config['model_provider'].lower() not in ['openai', 'google']:
-                    logging.warning(f"Saltando agente {agent_config['name']} con proveedor no soportado: {agent_config['model_provider']}")
-                    continue
-                    
-                class ToolSchema(BaseModel):
-                    task: str = Field(description=f"La tarea o pregunta detallada para el agente '{agent_config['name']}'.")
-                
-                def run_specialist_agent(task: str, cfg=agent_config):
-                    model = get_chat_model(cfg['model_provider'], cfg['model_name'])
-                    messages = [SystemMessage(content=cfg.get('system_prompt')), HumanMessage(content=task)]
-                    return model.invoke(messages).content
-                
-                tool_name = agent_config['name'].lower().replace(' ', '_').replace('-', '_')
-                specialist_tool = StructuredTool.from_function(
-                    func=run_specialist_agent, 
-                    name=tool_name, 
-                    description=f"Agente especializado: {agent_config['description']}", 
-                    args_schema=ToolSchema
-                )
-                all_tools.append(specialist_tool)
-    except Exception as e:
-        logging.error(f"Error al obtener agentes de Supabase: {e}")
+    all_tools.extend(load_specialist_agent_tools(supabase_user_client))
     
     logging.info(f"Cargadas {len(all_tools)} herramientas totales")
     return all_tools
 
-def get_or_create_agent_graph():
-    global _APP_GRAPH, _IS_INITIALIZING
-    if _APP_GRAPH is not None: 
-        return _APP_GRAPH
-    if _IS_INITIALIZING: 
-        return None
-    
-    _IS_INITIALIZING = True
+def _load_agent_tools() -> list:
+    """Catálogo completo de herramientas, obtenido en el bucle de eventos compartido"""
+    return run_sync(get_all_available_tools(get_supabase_client(admin=False)))
+
+def _build_agent_graph(all_tools: list) -> dict:
+    """Construye y compila el grafo del agente para un catálogo. Lanza excepción si falla"""
+    global memory
     logging.info("Iniciando la creación del grafo del agente...")
     
-    try:
-        supabase_client = create_supabase_client(admin=False)
+    # Catálogo por defecto; cada petición puede traer el suyo en config["configurable"]["tool_catalog"]
+    default_catalog = compile_agent_catalog(all_tools)
+
+    class AgentState(TypedDict):
+        messages: Annotated[Sequence[BaseMessage], operator.add]
+        # Resumen incremental de los turnos plegados y cuántos mensajes cubre
+        summary: str
+        summarized_count: int
+
+    def latest_query(state) -> str:
+        return next((msg.content for msg in reversed(state['messages']) if isinstance(msg, HumanMessage)), "")
+
+    def resolve_catalog(config) -> ToolCatalog:
+        return (config or {}).get("configurable", {}).get("tool_catalog") or default_catalog
+
+    def persist(config, messages):
+        # Cola write-behind: no añade latencia al paso del grafo
+        chat_log = (config or {}).get("configurable", {}).get("chat_log")
+        if chat_log is not None:
+            chat_log.record(messages)
+        return messages
+
+    def call_model(state, config):
+        catalog, query, prompt = resolve_catalog(config), latest_query(state), build_prompt_messages(state)
+        # Turnos sencillos al modelo rápido; herramientas y contexto largo al completo
+        decision = model_router.classify(state, prompt, query, catalog.tool_map)
+        return {"messages": persist(config, [model_router.invoke(catalog.selector, query, prompt, decision)])}
+
+    async def acall_model(state, config):
+        catalog, query, prompt = resolve_catalog(config), latest_query(state), build_prompt_messages(state)
+        decision = model_router.classify(state, prompt, query, catalog.tool_map)
+        return {"messages": persist(config, [await model_router.ainvoke(catalog.selector, query, prompt, decision)])}
+
+    def call_tool_executor(state, config):
+        last_message = state['messages'][-1]
+        original_query = latest_query(state)
         
-        # Obtener herramientas en un bucle de eventos asyncio
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        all_tools = loop.run_until_complete(get_all_available_tools(supabase_client))
-        loop.close()
-        
-        orchestrator_llm = get_chat_model("openai", "gpt-4o")
-        llm_with_tools = orchestrator_llm.bind_tools(all_tools)
-
-        class AgentState(TypedDict):
-            messages: Annotated[Sequence[BaseMessage], operator.add]
-
-        def call_model(state):
-            return {"messages": [llm_with_tools.invoke(state['messages'])]}
-
-        def call_tool_executor(state):
-            last_message = state['messages'][-1]
-            tool_calls = last_message.tool_calls
-            original_query = next((msg.content for msg in reversed(state['messages']) if isinstance(msg, HumanMessage)), "")
-            tool_outputs = []
-            tool_map = {tool.name: tool for tool in all_tools}
-            
-            for call in tool_calls:
-                tool_name = call.get("name")
-                if tool_name in tool_map:
-                    try:
-                        output = tool_map[tool_name].invoke(call.get("args"))
-                        summarized_output = summarize_if_needed(original_query, str(output))
-                        tool_outputs.append(ToolMessage(content=summarized_output, tool_call_id=call.get("id")))
-                    except Exception as e:
-                        tool_outputs.append(ToolMessage(content=f"Error al ejecutar '{tool_name}': {e}", tool_call_id=call.get("id")))
-                else:
-                    tool_outputs.append(ToolMessage(content=f"Error: Herramienta '{tool_name}' no encontrada.", tool_call_id=call.get("id")))
-            
-            return {"messages": tool_outputs}
-
-        workflow = StateGraph(AgentState)
-        workflow.add_node("agent", call_model)
-        workflow.add_node("action", call_tool_executor)
-        workflow.set_entry_point("agent")
-        workflow.add_conditional_edges("agent", lambda state: "action" if state['messages'][-1].tool_calls else END)
-        workflow.add_edge("action", "agent")
+        # Las llamadas de un mismo paso se ejecutan en paralelo, conservando el orden
+        tool_outputs = execute_tool_calls(
+            last_message.tool_calls,
+            resolve_catalog(config).tool_map,
+            postprocess=lambda output: summarize_if_needed(original_query, output),
+            # Inicio/fin de cada herramienta como eventos de progreso en el stream SSE
+            on_event=get_progress_writer()
+        )
+        # Las salidas grandes se guardan fuera del estado; el checkpoint solo lleva la referencia
+        return {"messages": offload_tool_messages(persist(config, tool_outputs))}
+
+    async def acall_tool_executor(state, config):
+        last_message = state['messages'][-1]
+        original_query = latest_query(state)
         
-        # CORREGIDO: Compilar con o sin checkpointer
-        global memory
+        tool_outputs = await aexecute_tool_calls(
+            last_message.tool_calls,
+            resolve_catalog(config).tool_map,
+            postprocess=lambda output: summarize_if_needed(original_query, output),
+            # Inicio/fin de cada herramienta como eventos de progreso en el stream SSE
+            on_event=get_progress_writer()
+        )
+        # Las salidas grandes se guardan fuera del estado; el checkpoint solo lleva la referencia
+        return {"messages": offload_tool_messages(persist(config, tool_outputs))}
+
+    workflow = StateGraph(AgentState)
+    # Cada nodo tiene variante síncrona (Flask) y asíncrona (ASGI)
+    # "context" mantiene el prompt dentro del presupuesto de tokens antes de cada llamada al modelo
+    workflow.add_node("context", RunnableLambda(manage_context, afunc=amanage_context))
+    workflow.add_node("agent", RunnableLambda(call_model, afunc=acall_model))
+    workflow.add_node("action", RunnableLambda(call_tool_executor, afunc=acall_tool_executor))
+    workflow.set_entry_point("context")
+    workflow.add_edge("context", "agent")
+    workflow.add_conditional_edges("agent", lambda state: "action" if state['messages'][-1].tool_calls else END)
+    workflow.add_edge("action", "context")
+    
+    # CORREGIDO: Compilar con o sin checkpointer (se reutiliza si el grafo se reconstruye)
+    if memory is None:
         memory = setup_memory()
-        if memory:
-            _APP_GRAPH = workflow.compile(checkpointer=memory)
-            logging.info("Grafo del agente compilado con memoria persistente.")
-        else:
-            _APP_GRAPH = workflow.compile()
-            logging.info("Grafo del agente compilado sin memoria persistente.")
-        
-        return _APP_GRAPH
-        
+    if memory:
+        app_graph = workflow.compile(checkpointer=memory)
+        logging.info("Grafo del agente compilado con memoria persistente.")
+    else:
+        app_graph = workflow.compile()
+        logging.info("Grafo del agente compilado sin memoria persistente.")
+    
+    return {
+        "graph": app_graph,
+        "catalog": default_catalog,
+        "shared_tools": [t for t in all_tools if not (t.metadata or {}).get("user_scoped")],
+    }
+
+def compile_agent_catalog(tools: list, session: UserSession = None) -> ToolCatalog:
+    """Deduplica y compacta las herramientas y prepara su selector por mensaje"""
+    # Sin duplicados locales/MCP y con descripciones y schemas compactos
+    compiled = compile_tool_catalog(tools)
+    # Solo se enlazan las herramientas relevantes para cada mensaje (más las fijas)
+    selector = ToolSelector(model_router.model_for("strong"), compiled.tools, specs=compiled.specs)
+    return ToolCatalog(tools=compiled.tools, selector=selector, report=compiled.report, session=session,
+                       scope=tool_set_fingerprint([t.name for t in compiled.tools]))
+
+def build_user_tool_catalog(session: UserSession) -> ToolCatalog:
+    """Catálogo de un usuario: herramientas compartidas más las que acceden a sus datos (RLS)"""
+    user_tools = [build_document_search_tool(session.client)]
+    user_tools.extend(load_specialist_agent_tools(session.client()))
+    # Las herramientas compartidas son inmutables y sus embeddings ya están en caché
+    return compile_agent_catalog(_SHARED_TOOLS + user_tools, session=session)
+
+def get_user_tool_catalog(user, authorization: str) -> ToolCatalog:
+    """Catálogo cacheado del usuario; se construye solo tras expirar o invalidarse"""
+    return user_catalogs.get_or_build(user.id, authorization, build_user_tool_catalog)
+
+def _get_or_compile_graph(all_tools: list):
+    """Devuelve (huella, entrada) reutilizando el grafo compilado si el catálogo no cambió"""
+    fingerprint = catalog_fingerprint(all_tools)
+    entry = _GRAPH_CACHE.get(fingerprint)
+    if entry is not None:
+        _GRAPH_CACHE.move_to_end(fingerprint)
+        logging.info(f"Reutilizando grafo compilado {fingerprint}")
+        return fingerprint, entry
+    entry = _build_agent_graph(all_tools)
+    _GRAPH_CACHE[fingerprint] = entry
+    while len(_GRAPH_CACHE) > GRAPH_CACHE_SIZE:
+        _GRAPH_CACHE.popitem(last=False)
+    return fingerprint, entry
+
+def _install_agent_graph(fingerprint: str, entry: dict):
+    """Sustituye atómicamente el grafo activo; las peticiones en curso conservan el anterior"""
+    global _APP_GRAPH, _GRAPH_FINGERPRINT, _AGENT_TOOL_SCOPE, _TOOL_SELECTOR, _TOOL_CATALOG_REPORT, _SHARED_TOOLS
+    catalog = entry["catalog"]
+    with _GRAPH_SWAP_LOCK:
+        _AGENT_TOOL_SCOPE, _TOOL_SELECTOR, _TOOL_CATALOG_REPORT = catalog.scope, catalog.selector, catalog.report
+        _SHARED_TOOLS = entry["shared_tools"]
+        _GRAPH_FINGERPRINT = fingerprint
+        # Se asigna al final: quien lea _APP_GRAPH ya ve un grafo completo
+        _APP_GRAPH = entry["graph"]
+    # Los catálogos por usuario se reconstruyen sobre las nuevas herramientas compartidas
+    user_catalogs.invalidate()
+
+def get_agents_version() -> str:
+    """Versión barata de la tabla `agents`: número de filas y updated_at más reciente.
+
+    Se consulta con el cliente de servicio para ver también los agentes privados
+    de cada usuario. Los NULL van al final: si no, una sola fila sin updated_at fijaría
+    la versión. Si la tabla no tiene updated_at se usa un hash de las configuraciones.
+    """
+    supabase_client = get_supabase_client(admin=True)
+    try:
+        response = supabase_client.from_("agents").select("updated_at", count="exact").order("updated_at", desc=True, nullsfirst=False).limit(1).execute()
+        latest = response.data[0].get("updated_at") if response.data else ""
+        return f"{response.count}:{latest}"
+    except Exception:
+        response = supabase_client.from_("agents").select("name, description, model_provider, model_name, system_prompt").execute()
+        return hashlib.sha256(json.dumps(response.data, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def refresh_agent_graph(force: bool = False) -> bool:
+    """Reconstruye el grafo fuera del camino de las peticiones si cambiaron los agentes.
+
+    Devuelve True si se instaló un grafo nuevo.
+    """
+    global _AGENTS_VERSION
+    with _REFRESH_LOCK:
+        version = get_agents_version()
+        if not force and version == _AGENTS_VERSION:
+            return False
+        fingerprint, entry = _get_or_compile_graph(_load_agent_tools())
+        _AGENTS_VERSION = version
+        if fingerprint == _GRAPH_FINGERPRINT:
+            # El catálogo global no cambió, pero sí pueden haberlo hecho los agentes de algún usuario
+            user_catalogs.invalidate()
+            return False
+        _install_agent_graph(fingerprint, entry)
+        logging.info(f"Grafo del agente actualizado en caliente ({fingerprint})")
+        return True
+
+def _graph_refresher_loop(pid: int):
+    while os.getpid() == pid:
+        time.sleep(AGENT_REFRESH_INTERVAL)
+        try:
+            refresh_agent_graph()
+        except Exception as e:
+            logging.error(f"Error refrescando el grafo del agente: {e}")
+
+def start_graph_refresher():
+    """Arranca (una vez por proceso) el hilo que vigila cambios en la tabla `agents`"""
+    global _REFRESHER_PID
+    if AGENT_REFRESH_INTERVAL <= 0:
+        return
+    with _REFRESH_LOCK:
+        if _REFRESHER_PID == os.getpid():
+            return
+        _REFRESHER_PID = os.getpid()
+    threading.Thread(target=_graph_refresher_loop, args=(os.getpid(),),
+                     name="agent-graph-refresher", daemon=True).start()
+
+def _run_agent_initialization(future: Future):
+    """Inicialización completa del agente (MCP + grafo); resuelve el future compartido"""
+    global _AGENTS_VERSION
+    # Marca el future como en ejecución para que ningún llamador pueda cancelarlo
+    future.set_running_or_notify_cancel()
+    try:
+        # MCP primero para que sus herramientas formen parte del grafo
+        ensure_mcp_initialized()
+        # Con el mismo lock que el refresco: nunca se compila el mismo grafo dos veces a la vez
+        with _REFRESH_LOCK:
+            try:
+                # Antes de leer los agentes, para que un cambio intermedio se detecte en el siguiente sondeo
+                _AGENTS_VERSION = get_agents_version()
+            except Exception as e:
+                logging.warning(f"No se pudo obtener la versión de la tabla agents: {e}")
+            fingerprint, entry = _get_or_compile_graph(_load_agent_tools())
+            _install_agent_graph(fingerprint, entry)
+        start_graph_refresher()
+        future.set_result(entry["graph"])
     except Exception as e:
         logging.error(f"ERROR FATAL DURANTE LA INICIALIZACIÓN: {e}", exc_info=True)
-        _APP_GRAPH = None
+        future.set_exception(e)
+
+def start_agent_warmup() -> Future:
+    """Lanza la inicialización en segundo plano si no está lista ni en curso.
+
+    Todos los llamadores concurrentes reciben el mismo future; tras un fallo,
+    la siguiente llamada reintenta.
+    """
+    global _INIT_FUTURE, _INIT_PID
+    with _INIT_LOCK:
+        # Un future heredado de otro proceso (fork) nunca se resolvería aquí
+        if _INIT_PID != os.getpid():
+            _INIT_FUTURE, _INIT_PID = None, os.getpid()
+        
+        if _INIT_FUTURE is None or (_INIT_FUTURE.done() and _INIT_FUTURE.exception() is not None):
+            _INIT_FUTURE = Future()
+            threading.Thread(target=_run_agent_initialization, args=(_INIT_FUTURE,),
+                             name="agent-warmup", daemon=True).start()
+        return _INIT_FUTURE
+
+def get_agent_readiness() -> str:
+    """Estado de inicialización sin bloquear: idle, initializing, ready o failed"""
+    if _APP_GRAPH is not None:
+        return "ready"
+    future = _INIT_FUTURE if _INIT_PID == os.getpid() else None
+    if future is None:
+        return "idle"
+    if not future.done():
+        return "initializing"
+    return "failed"
+
+def get_or_create_agent_graph(timeout: float = None):
+    """Devuelve el grafo, esperando a la inicialización en curso (acotada por timeout)"""
+    if _APP_GRAPH is not None: 
+        return _APP_GRAPH
+    
+    future = start_agent_warmup()
+    try:
+        return future.result(AGENT_INIT_WAIT_TIMEOUT if timeout is None else timeout)
+    except TimeoutError:
+        logging.warning("Tiempo de espera agotado aguardando la inicialización del agente")
+        return None
+    except Exception:
         return None
-    finally:
-        _IS_INITIALIZING = False
 
-def get_user_from_token(request):
-    jwt = request.headers.get('Authorization', '').replace('Bearer ', '')
+def authenticate_token(authorization: str):
+    """Valida el header Authorization. Devuelve (user, None) o (None, (payload, status))"""
+    jwt = (authorization or '').replace('Bearer ', '')
     if not jwt:
-        return None, (jsonify({"error": "Token de autorización ausente"}), 401)
+        return None, ({"error": "Token de autorización ausente"}, 401)
     
     try:
-        supabase_client = create_supabase_client()
-        user_response = supabase_client.auth.get_user(jwt)
-        if not user_response.user:
-            return None, (jsonify({"error": "Token inválido o expirado"}), 401)
-        return user_response.user, None
+        return token_verifier.verify(jwt), None
+    except InvalidTokenError as e:
+        logging.info(f"Token rechazado: {e}")
+        return None, ({"error": "Token inválido o expirado"}, 401)
     except Exception as e:
         logging.error(f"Error al validar token: {e}")
-        return None, (jsonify({"error": "Error interno al validar el token"}), 500)
+        return None, ({"error": "Error interno al validar el token"}, 500)
 
-@app.route("/")
-def health_check():
+def get_user_from_token(request):
+    user, error = authenticate_token(request.headers.get('Authorization', ''))
+    if error:
+        payload, status = error
+        return None, (jsonify(payload), status)
+    return user, None
+
+def ensure_mcp_initialized() -> bool:
+    """Inicializa los clientes MCP si aún no lo están"""
     global _MCP_INITIALIZED
-    
-    if _APP_GRAPH is None and not _IS_INITIALIZING:
-        get_or_create_agent_graph()
-    
-    # Inicializar MCP si no está inicializado
     if not _MCP_INITIALIZED:
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            _MCP_INITIALIZED = loop.run_until_complete(initialize_mcp_clients())
-            loop.close()
+            _MCP_INITIALIZED = run_sync(initialize_mcp_clients())
         except Exception as e:
             logging.error(f"Error inicializando MCP: {e}")
             _MCP_INITIALIZED = False
-    
+    return _MCP_INITIALIZED
+
+def build_health_status():
+    """Construye el estado de salud del backend. Devuelve (payload, status)"""
+    readiness = get_agent_readiness()
     status_info = {
         "status": "ok" if _APP_GRAPH else "error",
         "message": "AI Playground Agent Backend está inicializado." if _APP_GRAPH else "La inicialización del agente falló.",
+        "readiness": readiness,
         "memory": "Disponible" if memory else "No disponible",
-        "mcp": "Inicializado" if _MCP_INITIALIZED else "No disponible"
+        "checkpointer": memory.stats() if memory else None,
+        "blob_store": blob_store.get_stats(),
+        "semantic_cache": response_cache.get_stats(),
+        "tool_selection": _TOOL_SELECTOR.get_stats() if _TOOL_SELECTOR else None,
+        "tool_catalog": _TOOL_CATALOG_REPORT,
+        "user_catalogs": user_catalogs.get_stats(),
+        "model_routing": model_router.get_stats(),
+        "hedging": hedger.get_stats(),
+        "admission": admission.get_stats(),
+        "stream_replay": stream_runs.get_stats(),
+        "chat_persistence": chat_writer.get_stats(),
+        "message_log": message_log.get_stats(),
+        "thread_hydration": thread_hydrator.get_stats(),
+        "graph_fingerprint": _GRAPH_FINGERPRINT,
+        "mcp": "Inicializado" if _MCP_INITIALIZED else "No disponible",
+        "model_cache": get_model_cache_stats()
     }
     
     if _APP_GRAPH:
-        return jsonify(status_info)
-    elif _IS_INITIALIZING:
-        return jsonify({**status_info, "status": "initializing", "message": "La inicialización del agente está en curso."}), 503
+        return status_info, 200
+    elif readiness in ("idle", "initializing"):
+        return {**status_info, "status": "initializing", "message": "La inicialización del agente está en curso."}, 503
     else:
-        return jsonify(status_info), 500
+        return status_info, 500
+
+async def collect_mcp_status() -> dict:
+    """Recoge el estado de las conexiones MCP (se ejecuta en el bucle compartido)"""
+    from api.mcp_client import mcp_manager
+    
+    status = {
+        "initialized": _MCP_INITIALIZED,
+        "connected_servers": list(mcp_manager.connected_servers.keys()),
+        "server_count": len(mcp_manager.connected_servers)
+    }
+    
+    if _MCP_INITIALIZED:
+        # Obtener herramientas disponibles
+        tools = await mcp_manager.get_available_tools()
+        resources = await mcp_manager.get_resources()
+        
+        status.update({
+            "available_tools": len(tools),
+            "available_resources": len(resources),
+            "tools": [{"name": t["name"], "server": t["server"], "description": t["description"]} for t in tools[:10]],  # Primeras 10
+            "resources": [{"uri": r["uri"], "server": r["server"]} for r in resources[:10]]  # Primeros 10
+        })
+    
+    return status
+
+async def collect_mcp_tools() -> dict:
+    """Lista las herramientas MCP disponibles (se ejecuta en el bucle compartido)"""
+    from api.mcp_client import mcp_manager
+    
+    tools = await mcp_manager.get_available_tools()
+    return {
+        "tools": tools,
+        "count": len(tools)
+    }
+
+def list_user_chats(user) -> list:
+    """Obtiene los chats del usuario; None si la consulta no devuelve datos"""
+    supabase_client = get_supabase_client()
+    response = supabase_client.from_('chats').select('id, title, created_at').eq('user_id', user.id).order('created_at', desc=True).execute()
+    return response.data
+
+def get_graph_config(thread_id, tool_catalog: ToolCatalog = None, chat_log: ChatLog = None) -> dict:
+    """Configuración de ejecución del grafo para un hilo de conversación y un catálogo de usuario"""
+    configurable = {"tool_catalog": tool_catalog, "chat_log": chat_log}
+    if memory:
+        configurable["thread_id"] = str(thread_id)
+    return {"configurable": configurable}
+
+def hydrate_thread(app_graph, config: dict, thread_id, authorization: str) -> int:
+    """Repone el historial reciente de un hilo existente que el checkpointer ya no tiene"""
+    return thread_hydrator.hydrate(app_graph, memory, config, str(thread_id), authorization)
+
+def lookup_cached_answer(user, messages_from_client: list, data: dict, tool_catalog: ToolCatalog = None):
+    """Consulta la caché semántica. Devuelve (respuesta o None, probe o None).
+
+    Solo aplica a la primera pregunta de un chat (sin historial que cambie su sentido)
+    y puede desactivarse por petición con {"cache": false}.
+    """
+    if not SEMANTIC_CACHE_ENABLED or not data.get('cache', True) or len(messages_from_client) != 1:
+        return None, None
+    scope = tool_catalog.scope if tool_catalog else _AGENT_TOOL_SCOPE
+    entry, probe = response_cache.lookup(messages_from_client[-1]['content'], scope, user.id)
+    return (entry.answer if entry else None), probe
+
+def record_cached_turn(app_graph, config: dict, input_messages: list, answer: str):
+    """Registra en el hilo un turno servido desde caché para que los seguimientos tengan contexto"""
+    if memory:
+        app_graph.update_state(config, {"messages": input_messages + [AIMessage(content=answer)]}, as_node="agent")
+
+def remember_answer(app_graph, config: dict, probe):
+    """Guarda en la caché semántica la respuesta final del turno recién completado"""
+    if probe is None or not memory:
+        return
+    messages = app_graph.get_state(config).values.get("messages", [])
+    turn_start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=None)
+    if turn_start is None:
+        return
+    turn = messages[turn_start + 1:]
+    answer = turn[-1] if turn else None
+    if not isinstance(answer, AIMessage) or answer.tool_calls or not answer.content:
+        return
+    # Respuestas con errores de herramientas no se reutilizan
+    if any(isinstance(m, ToolMessage) and str(m.content).startswith("Error") for m in turn):
+        return
+    tools = [call["name"] for m in turn if isinstance(m, AIMessage) for call in m.tool_calls]
+    response_cache.store(probe, answer.content, tools)
+
+def build_orchestrator_messages(last_user_message: str) -> list:
+    """Construye los mensajes de entrada del orquestador para un turno"""
+    current_date = datetime.now(timezone.utc).strftime('%d de %B de %Y')
+    system_prompt = f"""Hoy es {current_date}. Eres un orquestador experto con acceso a herramientas locales y MCP. 
+
+Tu principal objetivo es determinar la intención del usuario y seleccionar la herramienta más adecuada:
+
+HERRAMIENTAS DISPONIBLES:
+- internet_search: Para búsquedas en internet
+- analyze_url_content: Para analizar contenido de URLs
+- search_my_documents: Para buscar en documentos del usuario
+- Herramientas MCP: Herramientas externas conectadas via MCP
+- Agentes especializados: Para tareas específicas
+
+INSTRUCCIONES:
+1. Si es un saludo o pregunta general, responde directamente
+2. Para información actualizada, usa internet_search
+3. Para analizar URLs o imágenes, usa analyze_url_content
+4. Para documentos del usuario, usa search_my_documents
+5. Para tareas específicas, considera los agentes especializados
+6. Cuando uses herramientas MCP, explica brevemente qué estás haciendo
+
+Siempre sintetiza la información en una respuesta clara y concisa."""
+    
+    return [SystemMessage(content=system_prompt), HumanMessage(content=last_user_message)]
+
+@app.route("/")
+def health_check():
+    # Solo informa del estado; si nadie lanzó el warm-up, se inicia en segundo plano
+    if get_agent_readiness() == "idle":
+        start_agent_warmup()
+    
+    status_info, status = build_health_status()
+    return jsonify(status_info), status
 
 # [El resto de las rutas permanecen igual...]
 @app.route('/api/chats', methods=['GET', 'OPTIONS'])
@@ -313,11 +683,10 @@ def list_chats_handler():
         return error_response
     
     try:
-        supabase_client = create_supabase_client()
-        response = supabase_client.from_('chats').select('id, title, created_at').eq('user_id', user.id).order('created_at', desc=True).execute()
+        chats = list_user_chats(user)
         
-        if response.data is not None:
-            return jsonify(response.data), 200
+        if chats is not None:
+            return jsonify(chats), 200
         else:
             return jsonify({"error": "No se pudieron obtener los chats."}), 500
 
@@ -342,7 +711,7 @@ def upload_handler():
     
     try:
         file_content = file.read()
-        supabase_admin_client = create_supabase_client(admin=True)
+        supabase_admin_client = get_supabase_client(admin=True)
         result = process_and_store_document(supabase_admin_client, file_content, user.id)
         
         if result["success"]:
@@ -367,8 +736,37 @@ def chat_handler():
     if error_response:
         return error_response
     
+    # Límite por usuario y global con cola corta: lo que no cabe recibe 429 de inmediato
+    ticket, rejection = admission.acquire(user.id)
+    if rejection is not None:
+        return Response(json.dumps(rejection.payload()), status=429, mimetype='application/json',
+                        headers={'Retry-After': str(rejection.retry_after)})
+    try:
+        response = _chat_response(app_graph, user, ticket)
+    except BaseException:
+        ticket.release()
+        raise
+    # La plaza se libera al cerrar la respuesta: fin del stream o desconexión del cliente
+    response.call_on_close(ticket.release)
+    return response
+
+def _sse_response(frames) -> Response:
+    # Sin buffering en proxies para que los tokens lleguen al cliente de inmediato
+    return Response(stream_with_context(frames), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _chat_response(app_graph, user, ticket) -> Response:
     try:
         data = request.get_json()
+        
+        # Reconexión: se reenvía lo que falta de la generación en lugar de ejecutar el grafo otra vez
+        last_event_id = request.headers.get('Last-Event-ID') or data.get('last_event_id')
+        if last_event_id:
+            run, after = stream_runs.resume(last_event_id, user.id)
+            if run is None:
+                return Response(json.dumps({"error": "La respuesta ya no está disponible para reanudarse."}), status=410, mimetype='application/json')
+            return _sse_response(run.iter_frames(after))
+        
         messages_from_client = data.get('messages', [])
         thread_id = data.get('thread_id')
         
@@ -376,63 +774,74 @@ def chat_handler():
             return Response(json.dumps({"error": "No se proporcionaron mensajes."}), status=400, mimetype='application/json')
 
         last_user_message = messages_from_client[-1]['content']
-
+        
+        # Reintento sin Last-Event-ID de una petición que sigue generándose: se reengancha desde el principio
+        run_key = request_key(user.id, thread_id, last_user_message)
+        run = stream_runs.find_active(run_key)
+        if run is not None:
+            return _sse_response(run.iter_frames())
+
+        # Chat nuevo: id local y la fila de `chats` se inserta en paralelo con la generación
+        chat_creation = None
         if not thread_id:
-            jwt = request.headers.get('Authorization')
-            supabase_client = create_supabase_client()
-            supabase_client.auth.set_session(access_token=jwt.replace('Bearer ', ''), refresh_token="dummy")
-
-            title = (last_user_message[:50] + '...') if len(last_user_message) > 50 else last_user_message
-            response_db = supabase_client.from_('chats').insert({'user_id': user.id, 'title': title}).execute()
-            if not response_db.data:
-                return Response(json.dumps({"error": "No se pudo crear el chat en la base de datos."}), status=500, mimetype='application/json')
-            thread_id = response_db.data[0]['id']
-
-        # CORREGIDO: Configuración simplificada
-        config = {"configurable": {"thread_id": str(thread_id)}} if memory else {}
+            thread_id, chat_creation = chat_writer.create_chat(user.id, request.headers.get('Authorization'), last_user_message)
+
+        tool_catalog = get_user_tool_catalog(user, request.headers.get('Authorization'))
+        # Los mensajes del turno se guardan en `messages` en segundo plano (cola write-behind)
+        chat_log = ChatLog(str(thread_id), request.headers.get('Authorization'), chat_creation)
+        config = get_graph_config(thread_id, tool_catalog, chat_log)
         
-        current_date = datetime.now(timezone.utc).strftime('%d de %B de %Y')
-        system_prompt = f"""Hoy es {current_date}. Eres un orquestador experto con acceso a herramientas locales y MCP. 
+        input_messages = build_orchestrator_messages(last_user_message)
+        chat_log.record(input_messages)
+        cached_answer, cache_probe = lookup_cached_answer(user, messages_from_client, data, tool_catalog)
 
-Tu principal objetivo es determinar la intención del usuario y seleccionar la herramienta más adecuada:
+        # Solo los chats que ya tenían mensajes pueden necesitar hidratación
+        resume_history = chat_creation is None and len(messages_from_client) > 1
+        request_authorization = request.headers.get('Authorization')
 
-HERRAMIENTAS DISPONIBLES:
-- internet_search: Para búsquedas en internet
-- analyze_url_content: Para analizar contenido de URLs
-- search_my_documents: Para buscar en documentos del usuario
-- Herramientas MCP: Herramientas externas conectadas via MCP
-- Agentes especializados: Para tareas específicas
-
-INSTRUCCIONES:
-1. Si es un saludo o pregunta general, responde directamente
-2. Para información actualizada, usa internet_search
-3. Para analizar URLs o imágenes, usa analyze_url_content
-4. Para documentos del usuario, usa search_my_documents
-5. Para tareas específicas, considera los agentes especializados
-6. Cuando uses herramientas MCP, explica brevemente qué estás haciendo
-
-Siempre sintetiza la información en una respuesta clara y concisa."""
-        
-        input_message = HumanMessage(content=last_user_message)
-        input_messages = [SystemMessage(content=system_prompt), input_message]
+        def chat_creation_frames():
+            failure = chat_writer.creation_failure(str(thread_id), chat_creation)
+            if failure is not None:
+                yield encode_sse(failure)
 
         def generate_stream():
+            if cached_answer is not None:
+                yield encode_sse({'content': cached_answer, 'thread_id': str(thread_id), 'cached': True})
+                chat_log.record([AIMessage(content=cached_answer)])
+                try:
+                    record_cached_turn(app_graph, config, input_messages, cached_answer)
+                except Exception as e:
+                    logging.error(f"Error registrando turno cacheado: {e}")
+                yield from chat_creation_frames()
+                yield sse_done()
+                return
+
             try:
-                for chunk in app_graph.stream({"messages": input_messages}, config=config):
-                    if 'agent' in chunk:
-                        agent_messages = chunk['agent'].get('messages', [])
-                        if agent_messages:
-                            ai_message = agent_messages[-1]
-                            if ai_message.content and not ai_message.tool_calls:
-                                yield f"data: {json.dumps({'content': ai_message.content, 'thread_id': str(thread_id)})}\n\n"
+                # Chat existente tras un reinicio o una expulsión: historial desde `messages`
+                if resume_history:
+                    hydrate_thread(app_graph, config, thread_id, request_authorization)
+                if STREAM_MODE == "tokens":
+                    # Reenvía los tokens del orquestador conforme llegan
+                    graph_stream = app_graph.stream({"messages": input_messages}, config=config, stream_mode=TOKEN_STREAM_MODES)
+                    yield from iter_token_frames(graph_stream, str(thread_id))
+                else:
+                    graph_stream = app_graph.stream({"messages": input_messages}, config=config, stream_mode=UPDATE_STREAM_MODES)
+                    yield from iter_update_frames(graph_stream, str(thread_id))
+                remember_answer(app_graph, config, cache_probe)
                                     
             except Exception as e:
                 logging.error(f"Error en stream: {traceback.format_exc()}")
-                yield f"data: {json.dumps({'error': f'Error en el backend: {str(e)}'})}\n\n"
+                yield encode_sse({'error': f'Error en el backend: {str(e)}'})
             
-            yield f"data: [DONE]\n\n"
+            yield from chat_creation_frames()
+            yield sse_done()
             
-        return Response(stream_with_context(generate_stream()), mimetype='text/event-stream')
+        # La generación corre desacoplada de la conexión y conserva su plaza de admisión hasta terminar
+        run = stream_runs.start(run_key, user.id)
+        ticket.retain("generation")
+        run.on_finish(lambda: ticket.release("generation"))
+        stream_runs.produce(run, generate_stream())
+        return _sse_response(run.iter_frames())
         
     except Exception as e:
         logging.error(f"Error en chat_handler: {traceback.format_exc()}")
@@ -446,31 +855,8 @@ def mcp_status():
     if error_response:
         return error_response
     
-    global _MCP_INITIALIZED
-    from api.mcp_client import mcp_manager
-    
     try:
-        status = {
-            "initialized": _MCP_INITIALIZED,
-            "connected_servers": list(mcp_manager.connected_servers.keys()),
-            "server_count": len(mcp_manager.connected_servers)
-        }
-        
-        if _MCP_INITIALIZED:
-            # Obtener herramientas disponibles
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            tools = loop.run_until_complete(mcp_manager.get_available_tools())
-            resources = loop.run_until_complete(mcp_manager.get_resources())
-            loop.close()
-            
-            status.update({
-                "available_tools": len(tools),
-                "available_resources": len(resources),
-                "tools": [{"name": t["name"], "server": t["server"], "description": t["description"]} for t in tools[:10]],  # Primeras 10
-                "resources": [{"uri": r["uri"], "server": r["server"]} for r in resources[:10]]  # Primeros 10
-            })
-        
+        status = run_sync(collect_mcp_status())
         return jsonify(status)
         
     except Exception as e:
@@ -489,17 +875,7 @@ def list_mcp_tools():
         return jsonify({"error": "MCP no inicializado"}), 503
     
     try:
-        from api.mcp_client import mcp_manager
-        
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        tools = loop.run_until_complete(mcp_manager.get_available_tools())
-        loop.close()
-        
-        return jsonify({
-            "tools": tools,
-            "count": len(tools)
-        })
+        return jsonify(run_sync(collect_mcp_tools()))
         
     except Exception as e:
         logging.error(f"Error listando herramientas MCP: {e}")
@@ -511,12 +887,17 @@ import atexit
 def cleanup_on_exit():
     """Limpia recursos al cerrar la aplicación"""
     global _MCP_INITIALIZED
+    if message_log.flush():
+        logging.info("✓ Mensajes pendientes guardados")
+    if memory:
+        try:
+            memory.flush()
+            logging.info("✓ Checkpoints volcados a disco")
+        except Exception as e:
+            logging.error(f"Error volcando checkpoints: {e}")
     if _MCP_INITIALIZED:
         try:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            loop.run_until_complete(cleanup_mcp_clients())
-            loop.close()
+            run_sync(cleanup_mcp_clients())
             logging.info("✓ Recursos MCP limpiados")
         except Exception as e:
             logging.error(f"Error limpiando recursos MCP: {e}")
@@ -524,5 +905,6 @@ def cleanup_on_exit():
 atexit.register(cleanup_on_exit)
 
 if __name__ == "__main__":
+    start_agent_warmup()
     port = int(os.environ.get("PORT", 8080))
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file
@@ -7,6 +7,7 @@ import os
 from typing import Dict, List, Any, Optional
 from langchain.tools import StructuredTool
 from pydantic import BaseModel, Field
+from api.async_runtime import run_sync
 
 logger = logging.getLogger("mcp_client")
 
@@ -19,6 +20,9 @@ class BasicMCPClient:
         self.process = None
         self.tools_cache = []
         self.resources_cache = []
+        # Serializa petición/respuesta sobre stdio; válido porque todas las llamadas
+        # se ejecutan en el bucle de eventos compartido del proceso
+        self._request_lock = asyncio.Lock()
     
     async def connect(self) -> bool:
         """Conecta al servidor MCP"""
@@ -76,16 +80,17 @@ class BasicMCPClient:
         }
         
         try:
-            # Enviar petición
-            request_json = json.dumps(request) + "\n"
-            self.process.stdin.write(request_json)
-            self.process.stdin.flush()
-            
-            # Leer respuesta (con timeout)
-            response_line = await asyncio.wait_for(
-                self._read_line_async(), 
-                timeout=10.0
-            )
+            async with self._request_lock:
+                # Enviar petición
+                request_json = json.dumps(request) + "\n"
+                self.process.stdin.write(request_json)
+                self.process.stdin.flush()
+                
+                # Leer respuesta (con timeout)
+                response_line = await asyncio.wait_for(
+                    self._read_line_async(), 
+                    timeout=10.0
+                )
             
             if response_line:
                 response = json.loads(response_line.strip())
@@ -100,7 +105,7 @@ class BasicMCPClient:
     
     async def _read_line_async(self) -> str:
         """Lee línea del proceso de forma asíncrona"""
-        loop = asyncio.get_event_loop()
+        loop = asyncio.get_running_loop()
         return await loop.run_in_executor(None, self.process.stdout.readline)
     
     async def list_tools(self) -> List[Dict[str, Any]]:
@@ -215,7 +220,8 @@ class MCPClientManager:
                         "original_name": tool["name"],
                         "server": server_name,
                         "description": tool.get("description", ""),
-                        "input_schema": tool.get("inputSchema", {})
+                        "input_schema": tool.get("inputSchema", {}),
+                        "registry_tool": (tool.get("_meta") or {}).get("registry_tool")
                     }
                     all_tools.append(tool_info)
             except Exception as e:
@@ -300,7 +306,7 @@ class MCPToolWrapper:
                 # Crear función de ejecución con closure correcto
                 def make_tool_function(ti):
                     def execute_tool_sync(**kwargs):
-                        return asyncio.run(
+                        return run_sync(
                             self.mcp_manager.call_tool(
                                 ti["server"], 
                                 ti["original_name"], 
@@ -316,7 +322,8 @@ class MCPToolWrapper:
                     func=tool_function,
                     name=tool_info["name"],
                     description=tool_info["description"],
-                    args_schema=DynamicToolInput
+                    args_schema=DynamicToolInput,
+                    metadata={"mcp_server": tool_info["server"], "registry_tool": tool_info.get("registry_tool")}
                 )
                 
                 langchain_tools.append(langchain_tool)
@@ -5,7 +5,7 @@ import os
 import json
 import sys
 from typing import Any, Dict, List, Optional, Union
-from supabase.client import create_client
+from api.supabase_pool import supabase_pool
 from api.tools import tool_registry
 
 # Configurar logging
@@ -22,8 +22,12 @@ class MCPServer:
         self.resources = {}
         self.prompts = {}
     
-    def tool(self, name: str = None, description: str = None):
-        """Decorador para registrar herramientas"""
+    def tool(self, name: str = None, description: str = None, registry_tool: str = None):
+        """Decorador para registrar herramientas.
+
+        `registry_tool` indica la herramienta de ToolRegistry que envuelve, para que
+        el cliente pueda deduplicarla frente a la versión en proceso.
+        """
         def decorator(func):
             tool_name = name or func.__name__
             tool_description = description or func.__doc__ or "Sin descripción"
@@ -32,7 +36,8 @@ class MCPServer:
                 "name": tool_name,
                 "description": tool_description,
                 "function": func,
-                "schema": self._generate_schema(func)
+                "schema": self._generate_schema(func),
+                "registry_tool": registry_tool
             }
             return func
         return decorator
@@ -129,11 +134,14 @@ class MCPServer:
         """Lista herramientas disponibles"""
         tools_list = []
         for tool_name, tool_info in self.tools.items():
-            tools_list.append({
+            tool_entry = {
                 "name": tool_name,
                 "description": tool_info["description"],
                 "inputSchema": tool_info["schema"]
-            })
+            }
+            if tool_info.get("registry_tool"):
+                tool_entry["_meta"] = {"registry_tool": tool_info["registry_tool"]}
+            tools_list.append(tool_entry)
         
         return {"tools": tools_list}
     
@@ -229,30 +237,24 @@ class MCPServer:
 app = MCPServer("ai-playground-platform", "1.0.0")
 
 def get_supabase_client():
-    """Crea cliente de Supabase"""
-    url = os.environ.get("SUPABASE_URL")
-    key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    
-    if not url or not key:
-        raise ValueError("Variables de Supabase no configuradas")
-    
-    return create_client(url, key)
+    """Cliente de Supabase (service role) reutilizado entre herramientas y recursos"""
+    return supabase_pool.get_client(admin=True)
 
 # ========== HERRAMIENTAS BÁSICAS ==========
 
-@app.tool("search_internet", "Busca información en internet usando Jina AI")
+@app.tool("search_internet", "Busca información en internet usando Jina AI", registry_tool="internet_search")
 async def search_internet(query: str) -> str:
     """Busca información en internet"""
     logger.info(f"Búsqueda en internet: {query}")
     return tool_registry.execute_tool("internet_search", query=query)
 
-@app.tool("analyze_url", "Analiza el contenido de una URL usando OCR")
+@app.tool("analyze_url", "Analiza el contenido de una URL usando OCR", registry_tool="analyze_url_content")
 async def analyze_url(url: str) -> str:
     """Analiza el contenido de una URL"""
     logger.info(f"Analizando URL: {url}")
     return tool_registry.execute_tool("analyze_url_content", url=url)
 
-@app.tool("search_documents", "Busca en los documentos personales del usuario")
+@app.tool("search_documents", "Busca en los documentos personales del usuario", registry_tool="search_my_documents")
 async def search_documents(query: str, user_id: str = None) -> str:
     """Busca en documentos personales"""
     logger.info(f"Búsqueda en documentos: {query}")
@@ -270,31 +272,31 @@ async def search_documents(query: str, user_id: str = None) -> str:
 
 # ========== HERRAMIENTAS MATEMÁTICAS AVANZADAS ==========
 
-@app.tool("monte_carlo_simulation", "Simulaciones Monte Carlo para análisis financiero")
+@app.tool("monte_carlo_simulation", "Simulaciones Monte Carlo para análisis financiero", registry_tool="monte_carlo_simulation")
 async def monte_carlo_mcp(scenario: str, **kwargs) -> str:
     """Simulaciones Monte Carlo"""
     logger.info(f"MCP: Simulación Monte Carlo {scenario}")
     return tool_registry.execute_tool("monte_carlo_simulation", scenario=scenario, **kwargs)
 
-@app.tool("regression_analysis", "Análisis de regresión lineal y polinómica")
+@app.tool("regression_analysis", "Análisis de regresión lineal y polinómica", registry_tool="regression_analysis")
 async def regression_mcp(x_data: list, y_data: list, polynomial_degree: int = 1) -> str:
     """Análisis de regresión"""
     logger.info(f"MCP: Análisis de regresión grado {polynomial_degree}")
     return tool_registry.execute_tool("regression_analysis", x_data=x_data, y_data=y_data, polynomial_degree=polynomial_degree)
 
-@app.tool("financial_projections", "Proyecciones financieras usando diferentes métodos")
+@app.tool("financial_projections", "Proyecciones financieras usando diferentes métodos", registry_tool="financial_projections")
 async def projections_mcp(data: list, periods_ahead: int = 12, method: str = "linear") -> str:
     """Proyecciones financieras"""
     logger.info(f"MCP: Proyecciones {method} para {periods_ahead} períodos")
     return tool_registry.execute_tool("financial_projections", data=data, periods_ahead=periods_ahead, method=method)
 
-@app.tool("portfolio_optimization", "Optimización de portafolios de inversión")
+@app.tool("portfolio_optimization", "Optimización de portafolios de inversión", registry_tool="portfolio_optimization")
 async def portfolio_mcp(expected_returns: list, cov_matrix: list, risk_tolerance: float = 1.0) -> str:
     """Optimización de portafolios"""
     logger.info(f"MCP: Optimización de portafolio con {len(expected_returns)} activos")
     return tool_registry.execute_tool("portfolio_optimization", expected_returns=expected_returns, cov_matrix=cov_matrix, risk_tolerance=risk_tolerance)
 
-@app.tool("statistical_analysis", "Análisis estadístico completo")
+@app.tool("statistical_analysis", "Análisis estadístico completo", registry_tool="statistical_analysis")
 async def statistics_mcp(data: list, confidence_level: float = 0.95) -> str:
     """Análisis estadístico"""
     logger.info(f"MCP: Análisis estadístico de {len(data)} observaciones")
@@ -0,0 +1,256 @@
+# api/model_router.py - Enrutado del orquestador entre un modelo rápido y uno completo según el turno
+import os
+import re
+import asyncio
+import time
+import logging
+import threading
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, LLMResult
+from langchain_core.runnables.config import (
+    ensure_config, get_async_callback_manager_for_config, get_callback_manager_for_config
+)
+
+from api.context_manager import message_tokens
+from api.hedging import hedger
+from api.models import get_chat_model
+from api.streaming import extract_text
+from api.summarizer import count_tokens
+
+logger = logging.getLogger("model_router")
+
+MODEL_ROUTING_ENABLED = os.environ.get("MODEL_ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
+# Modelos en formato "proveedor:modelo"
+ROUTER_FAST_MODEL = os.environ.get("ROUTER_FAST_MODEL", "openai:gpt-4o-mini")
+ROUTER_STRONG_MODEL = os.environ.get("ROUTER_STRONG_MODEL", "openai:gpt-4o")
+# Mensajes más largos que esto se consideran complejos
+ROUTER_SIMPLE_MAX_CHARS = int(os.environ.get("ROUTER_SIMPLE_MAX_CHARS", "280"))
+# Con un prompt mayor que esto (historial largo) se usa el modelo completo
+ROUTER_CONTEXT_MAX_TOKENS = int(os.environ.get("ROUTER_CONTEXT_MAX_TOKENS", "6000"))
+# Si el modelo rápido decide llamar herramientas, se repite el paso con el modelo completo
+ROUTER_ESCALATE_ON_TOOLS = os.environ.get("ROUTER_ESCALATE_ON_TOOLS", "true").lower() in ("1", "true", "yes")
+ROUTER_LATENCY_WINDOW = int(os.environ.get("ROUTER_LATENCY_WINDOW", "500"))
+
+# Indicios de que el mensaje necesita herramientas (búsquedas, URLs, documentos, cálculos)
+_DEFAULT_TOOL_HINTS = (
+    r"https?://|www\.|\.pdf\b|\.png\b|\.jpe?g\b",
+    r"\b(busca\w*|investiga\w*|encuentra\w*|search|look up|google)\b",
+    r"\b(hoy|actual\w*|últim\w*|ultim\w*|reciente\w*|noticia\w*|precio\w*|cotizaci\w*|clima|news|latest|today)\b",
+    r"\b(documento\w*|archivo\w*|pdf|mis notas|document\w*|file\w*)\b",
+    r"\b(analiza\w*|calcula\w*|simula\w*|proyecci\w*|regresi\w*|estad[ií]stic\w*|portafolio|cartera|monte carlo)\b",
+    r"\b(agente|agent|especialista)\b",
+    r"\d+\s*[-+*/^%]\s*\d+",
+)
+ROUTER_TOOL_HINTS = [re.compile(p, re.IGNORECASE) for p in
+                     (os.environ["ROUTER_TOOL_HINTS"].split("||") if os.environ.get("ROUTER_TOOL_HINTS")
+                      else _DEFAULT_TOOL_HINTS)]
+
+FAST_ROUTE = "fast"
+STRONG_ROUTE = "strong"
+
+# Sin callbacks: la respuesta que aún puede descartarse no llega al stream de tokens
+_UNSTREAMED = {"callbacks": []}
+
+
+def parse_model_spec(spec: str) -> Tuple[str, str]:
+    """'proveedor:modelo' -> (proveedor, modelo); sin proveedor se asume OpenAI"""
+    provider, _, model_name = spec.partition(":")
+    return (provider, model_name) if model_name else ("openai", provider)
+
+
+def _released_chunk(response: AIMessage) -> ChatGenerationChunk:
+    # Mismo id que la respuesta: LangGraph no la repite al cerrar el nodo
+    if response.id is None:
+        response.id = str(uuid.uuid4())
+    return ChatGenerationChunk(message=AIMessageChunk(content=response.content, id=response.id))
+
+
+def _release(response: AIMessage, prompt: Sequence[BaseMessage], key: str):
+    """Reenvía a los callbacks del grafo una respuesta generada sin ellos"""
+    run_manager = get_callback_manager_for_config(ensure_config()).on_chat_model_start(
+        {"name": "ModelRouter"}, [list(prompt)], name=key)[0]
+    run_manager.on_llm_new_token(extract_text(response.content), chunk=_released_chunk(response))
+    run_manager.on_llm_end(LLMResult(generations=[[ChatGeneration(message=response)]]))
+
+
+async def _arelease(response: AIMessage, prompt: Sequence[BaseMessage], key: str):
+    """Variante asíncrona de _release"""
+    run_manager = (await get_async_callback_manager_for_config(ensure_config()).on_chat_model_start(
+        {"name": "ModelRouter"}, [list(prompt)], name=key))[0]
+    await run_manager.on_llm_new_token(extract_text(response.content), chunk=_released_chunk(response))
+    await run_manager.on_llm_end(LLMResult(generations=[[ChatGeneration(message=response)]]))
+
+
+@dataclass
+class RouteDecision:
+    route: str
+    reason: str
+
+
+def _current_turn(messages: Sequence[BaseMessage]) -> List[BaseMessage]:
+    start = max((i for i, m in enumerate(messages) if isinstance(m, HumanMessage)), default=0)
+    return list(messages[start:])
+
+
+def _mentions_tool(query: str, tool_names: Iterable[str]) -> bool:
+    lowered = query.lower()
+    for name in tool_names:
+        # Nombres de agentes especializados ("analista_financiero") escritos con espacios
+        if name.lower() in lowered or name.lower().replace("_", " ") in lowered:
+            return True
+    return False
+
+
+class _RouteStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.latencies = deque(maxlen=ROUTER_LATENCY_WINDOW)
+
+    def snapshot(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 3) if ordered else None
+
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "latency_avg": round(sum(ordered) / len(ordered), 3) if ordered else None,
+            "latency_p50": percentile(0.5),
+            "latency_p95": percentile(0.95),
+        }
+
+
+class ModelRouter:
+    """Elige el modelo del orquestador para cada paso del grafo.
+
+    Heurísticas baratas (longitud, indicios de herramientas, estado del hilo)
+    mandan los turnos conversacionales al modelo rápido; el resto, y cualquier
+    turno en el que el modelo rápido pida herramientas, va al modelo completo.
+    """
+
+    def __init__(self, fast_model: str = ROUTER_FAST_MODEL, strong_model: str = ROUTER_STRONG_MODEL,
+                 enabled: bool = MODEL_ROUTING_ENABLED):
+        self.fast_spec = parse_model_spec(fast_model)
+        self.strong_spec = parse_model_spec(strong_model)
+        self.enabled = enabled and self.fast_spec != self.strong_spec
+        self._lock = threading.Lock()
+        self._routes = {FAST_ROUTE: _RouteStats(), STRONG_ROUTE: _RouteStats()}
+        self._reasons: Dict[str, int] = {}
+
+    def _spec(self, route: str) -> Tuple[str, str]:
+        return self.fast_spec if route == FAST_ROUTE else self.strong_spec
+
+    def model_for(self, route: str):
+        return get_chat_model(*self._spec(route))
+
+    def _bind(self, selector, query: str, route: str):
+        """(modelo principal, modelo de cobertura o None) con las herramientas seleccionadas enlazadas"""
+        primary = selector.bind_for(query, self.model_for(route))
+        partner = hedger.partner_for(*self._spec(route))
+        return primary, (selector.bind_for(query, partner) if partner is not None else None)
+
+    def classify(self, state: Dict[str, Any], prompt: Sequence[BaseMessage], query: str,
+                 tool_names: Iterable[str] = ()) -> RouteDecision:
+        """Clasifica el paso actual; solo usa datos ya disponibles en el estado"""
+        if not self.enabled:
+            return RouteDecision(STRONG_ROUTE, "disabled")
+        # Sintetizar resultados de herramientas del turno en curso
+        if any(isinstance(m, ToolMessage) for m in _current_turn(state["messages"])):
+            return RouteDecision(STRONG_ROUTE, "tool_results")
+        if len(query) > ROUTER_SIMPLE_MAX_CHARS:
+            return RouteDecision(STRONG_ROUTE, "long_message")
+        if any(pattern.search(query) for pattern in ROUTER_TOOL_HINTS) or _mentions_tool(query, tool_names):
+            return RouteDecision(STRONG_ROUTE, "tool_likely")
+        if sum(message_tokens(m) for m in prompt) > ROUTER_CONTEXT_MAX_TOKENS:
+            return RouteDecision(STRONG_ROUTE, "long_context")
+        return RouteDecision(FAST_ROUTE, "simple")
+
+    def _may_escalate(self, decision: RouteDecision) -> bool:
+        return decision.route == FAST_ROUTE and ROUTER_ESCALATE_ON_TOOLS
+
+    def _needs_escalation(self, decision: RouteDecision, response: AIMessage) -> bool:
+        return self._may_escalate(decision) and bool(response.tool_calls)
+
+    def _record(self, route: str, reason: str, elapsed: float, prompt: Sequence[BaseMessage],
+                response: Optional[AIMessage]):
+        usage = getattr(response, "usage_metadata", None) or {}
+        if response is not None and not usage:
+            # Sin usage del proveedor (p. ej. streaming sin stream_usage) se estima
+            usage = {"input_tokens": sum(message_tokens(m) for m in prompt),
+                     "output_tokens": count_tokens(extract_text(response.content))}
+        with self._lock:
+            stats = self._routes[route]
+            stats.calls += 1
+            stats.latencies.append(elapsed)
+            if response is None:
+                stats.errors += 1
+            stats.input_tokens += usage.get("input_tokens", 0)
+            stats.output_tokens += usage.get("output_tokens", 0)
+            self._reasons[reason] = self._reasons.get(reason, 0) + 1
+
+    def invoke(self, selector, query: str, prompt: Sequence[BaseMessage], decision: RouteDecision) -> AIMessage:
+        """Invoca el modelo de la ruta con las herramientas seleccionadas; escala si hace falta.
+
+        Si la respuesta puede descartarse por escalado, se genera sin streaming y
+        su texto solo se reenvía al stream cuando se sabe que es la definitiva.
+        """
+        primary, secondary = self._bind(selector, query, decision.route)
+        key = ":".join(self._spec(decision.route))
+        buffered = self._may_escalate(decision)
+        started = time.perf_counter()
+        try:
+            response = hedger.invoke(primary, secondary, prompt, key, config=_UNSTREAMED if buffered else None)
+        except Exception:
+            self._record(decision.route, decision.reason, time.perf_counter() - started, prompt, None)
+            raise
+        self._record(decision.route, decision.reason, time.perf_counter() - started, prompt, response)
+        if self._needs_escalation(decision, response):
+            logger.info("El modelo rápido pidió herramientas; se repite el paso con el modelo completo")
+            return self.invoke(selector, query, prompt, RouteDecision(STRONG_ROUTE, "escalated"))
+        if buffered:
+            _release(response, prompt, key)
+        return response
+
+    async def ainvoke(self, selector, query: str, prompt: Sequence[BaseMessage], decision: RouteDecision) -> AIMessage:
+        """Variante asíncrona de invoke"""
+        primary, secondary = await asyncio.to_thread(self._bind, selector, query, decision.route)
+        key = ":".join(self._spec(decision.route))
+        buffered = self._may_escalate(decision)
+        started = time.perf_counter()
+        try:
+            response = await hedger.ainvoke(primary, secondary, prompt, key, config=_UNSTREAMED if buffered else None)
+        except Exception:
+            self._record(decision.route, decision.reason, time.perf_counter() - started, prompt, None)
+            raise
+        self._record(decision.route, decision.reason, time.perf_counter() - started, prompt, response)
+        if self._needs_escalation(decision, response):
+            logger.info("El modelo rápido pidió herramientas; se repite el paso con el modelo completo")
+            return await self.ainvoke(selector, query, prompt, RouteDecision(STRONG_ROUTE, "escalated"))
+        if buffered:
+            await _arelease(response, prompt, key)
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "fast_model": ":".join(self.fast_spec),
+                "strong_model": ":".join(self.strong_spec),
+                "routes": {route: stats.snapshot() for route, stats in self._routes.items()},
+                "reasons": dict(self._reasons),
+            }
+
+
+# Instancia global del router
+model_router = ModelRouter()
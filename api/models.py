@@ -0,0 +1,114 @@
+# api/models.py - Construcción y caché de modelos de chat con transporte HTTP compartido
+import os
+import logging
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import httpx
+from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+from langchain_google_genai import ChatGoogleGenerativeAI
+
+logger = logging.getLogger("models")
+
+LLM_MAX_CONNECTIONS = int(os.environ.get("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_KEEPALIVE = int(os.environ.get("LLM_MAX_KEEPALIVE", "20"))
+LLM_HTTP_TIMEOUT = float(os.environ.get("LLM_HTTP_TIMEOUT", "120"))
+
+EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "text-embedding-3-small")
+
+_MODEL_CACHE: Dict[Tuple[str, str, float, bool], Any] = {}
+_EMBEDDING_MODELS: Dict[str, OpenAIEmbeddings] = {}
+_MODEL_CACHE_STATS = {"hits": 0, "misses": 0}
+_MODEL_CACHE_LOCK = threading.Lock()
+_MODEL_CACHE_PID: Optional[int] = None
+_HTTP_CLIENT: Optional[httpx.Client] = None
+
+
+def _reset_after_fork():
+    """Descarta modelos y conexiones heredados de otro proceso (fork de gunicorn)"""
+    global _MODEL_CACHE_PID, _HTTP_CLIENT
+    if _MODEL_CACHE_PID != os.getpid():
+        _MODEL_CACHE.clear()
+        _EMBEDDING_MODELS.clear()
+        _HTTP_CLIENT = None
+        _MODEL_CACHE_PID = os.getpid()
+
+
+def _get_http_client() -> httpx.Client:
+    """Cliente HTTP síncrono compartido por todos los modelos OpenAI del proceso"""
+    global _HTTP_CLIENT
+    if _HTTP_CLIENT is None:
+        _HTTP_CLIENT = httpx.Client(
+            timeout=LLM_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE),
+        )
+    return _HTTP_CLIENT
+
+
+def _build_chat_model(provider: str, model_name: str, temperature: float, streaming: bool):
+    api_key_name = f"{provider.upper()}_API_KEY"
+    api_key = os.environ.get(api_key_name)
+    if not api_key:
+        raise ValueError(f"Variable de entorno {api_key_name} no encontrada.")
+
+    if provider == "openai":
+        # stream_usage: el uso de tokens llega también en modo streaming (métricas por ruta)
+        return ChatOpenAI(model=model_name, temperature=temperature, api_key=api_key, streaming=streaming,
+                          stream_usage=True, http_client=_get_http_client())
+    return ChatGoogleGenerativeAI(model=model_name, temperature=temperature, api_key=api_key,
+                                  convert_system_message_to_human=True, streaming=streaming)
+
+
+def get_chat_model(provider: str, model_name: str, temperature: float = 0.0, streaming: bool = True):
+    """Devuelve un modelo de chat compartido para (proveedor, modelo, temperatura, streaming).
+
+    Las instancias son seguras para uso concurrente y reutilizan el pool de conexiones.
+    """
+    provider = provider.lower()
+    if provider not in ("openai", "google"):
+        logger.warning(f"Proveedor '{provider}' no soportado. Usando OpenAI gpt-4o-mini como fallback.")
+        provider, model_name = "openai", "gpt-4o-mini"
+
+    key = (provider, model_name, float(temperature), bool(streaming))
+    with _MODEL_CACHE_LOCK:
+        _reset_after_fork()
+        model = _MODEL_CACHE.get(key)
+        if model is not None:
+            _MODEL_CACHE_STATS["hits"] += 1
+            return model
+        _MODEL_CACHE_STATS["misses"] += 1
+        model = _build_chat_model(provider, model_name, float(temperature), bool(streaming))
+        _MODEL_CACHE[key] = model
+        logger.info(f"Modelo {provider}/{model_name} (temperature={temperature}, streaming={streaming}) añadido a la caché")
+        return model
+
+
+def get_embedding_model(model_name: str = EMBEDDING_MODEL) -> OpenAIEmbeddings:
+    """Modelo de embeddings compartido, sobre el mismo cliente HTTP que los modelos de chat"""
+    with _MODEL_CACHE_LOCK:
+        _reset_after_fork()
+        model = _EMBEDDING_MODELS.get(model_name)
+        if model is None:
+            api_key = os.environ.get("OPENAI_API_KEY")
+            if not api_key:
+                raise ValueError("Variable de entorno OPENAI_API_KEY no encontrada.")
+            model = OpenAIEmbeddings(model=model_name, api_key=api_key, http_client=_get_http_client())
+            _EMBEDDING_MODELS[model_name] = model
+        return model
+
+
+def get_model_cache_stats() -> Dict[str, Any]:
+    """Estadísticas de la caché de modelos"""
+    with _MODEL_CACHE_LOCK:
+        return {
+            "size": len(_MODEL_CACHE),
+            "hits": _MODEL_CACHE_STATS["hits"],
+            "misses": _MODEL_CACHE_STATS["misses"],
+            "models": [f"{p}/{m}" for p, m, _, _ in _MODEL_CACHE.keys()],
+        }
+
+
+def clear_model_cache():
+    """Vacía la caché de modelos (p. ej. tras rotar claves de API)"""
+    with _MODEL_CACHE_LOCK:
+        _MODEL_CACHE.clear()
@@ -0,0 +1,253 @@
+# api/semantic_cache.py - Caché semántica de respuestas del orquestador
+import os
+import re
+import json
+import time
+import hashlib
+import fnmatch
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from api.models import get_embedding_model
+
+logger = logging.getLogger("semantic_cache")
+
+# Opt-in: desactivada salvo que se habilite por entorno
+SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", "5000"))
+SEMANTIC_CACHE_DEFAULT_TTL = float(os.environ.get("SEMANTIC_CACHE_DEFAULT_TTL", "86400"))
+# Índice LSH por proyecciones aleatorias: tablas x bits por firma
+SEMANTIC_CACHE_LSH_TABLES = int(os.environ.get("SEMANTIC_CACHE_LSH_TABLES", "6"))
+SEMANTIC_CACHE_LSH_BITS = int(os.environ.get("SEMANTIC_CACHE_LSH_BITS", "8"))
+
+# TTL (segundos) según las herramientas usadas en la respuesta; se aplica el menor.
+# Patrones fnmatch para cubrir también los nombres MCP con prefijo de servidor.
+_DEFAULT_TOOL_TTLS = {
+    "*internet*": 600,
+    "*analyze_url*": 600,
+    "*search_my_documents*": 3600,
+    "*search_documents*": 3600,
+    "*monte_carlo*": 7 * 86400,
+    "*regression*": 7 * 86400,
+    "*financial_projections*": 7 * 86400,
+    "*portfolio_optimization*": 7 * 86400,
+    "*statistical_analysis*": 7 * 86400,
+}
+SEMANTIC_CACHE_TOOL_TTLS = {**_DEFAULT_TOOL_TTLS, **json.loads(os.environ.get("SEMANTIC_CACHE_TOOL_TTLS", "{}"))}
+# Herramientas cuya salida depende solo de la pregunta: sus respuestas se comparten entre usuarios.
+# Cualquier otra (documentos, MCP de terceros, herramientas nuevas) deja la respuesta privada del usuario.
+_DEFAULT_PUBLIC_TOOLS = [
+    "internet_search",
+    "analyze_url_content",
+    "monte_carlo_simulation",
+    "regression_analysis",
+    "financial_projections",
+    "portfolio_optimization",
+    "statistical_analysis",
+]
+SEMANTIC_CACHE_PUBLIC_TOOLS = tuple(json.loads(os.environ.get("SEMANTIC_CACHE_PUBLIC_TOOLS", "null")) or _DEFAULT_PUBLIC_TOOLS)
+
+
+def normalize_query(text: str) -> str:
+    """Normaliza el mensaje del usuario para la clave exacta y el embedding"""
+    text = re.sub(r"\s+", " ", text.strip().lower())
+    return text.rstrip("?¿!¡.,;: ")
+
+
+def _matches(name: str, patterns: Iterable[str]) -> bool:
+    return any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+
+
+def ttl_for_tools(tools: Sequence[str]) -> float:
+    """TTL de una respuesta según las herramientas que se usaron para generarla"""
+    if not tools:
+        return SEMANTIC_CACHE_DEFAULT_TTL
+    ttls = []
+    for name in tools:
+        matched = [float(t) for pattern, t in SEMANTIC_CACHE_TOOL_TTLS.items() if fnmatch.fnmatch(name, pattern)]
+        ttls.append(min(matched) if matched else SEMANTIC_CACHE_DEFAULT_TTL)
+    return min(ttls)
+
+
+class LSHIndex:
+    """Índice ANN acotado en memoria: LSH de hiperplanos aleatorios con re-ranking por coseno"""
+
+    def __init__(self, tables: int = SEMANTIC_CACHE_LSH_TABLES, bits: int = SEMANTIC_CACHE_LSH_BITS, seed: int = 13):
+        self.tables = tables
+        self.bits = bits
+        self._seed = seed
+        self._planes: Optional[np.ndarray] = None
+        self._buckets: List[Dict[int, set]] = [{} for _ in range(tables)]
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._signatures: Dict[str, Tuple[int, ...]] = {}
+        self._weights = 1 << np.arange(bits)
+
+    def _signature(self, vector: np.ndarray) -> Tuple[int, ...]:
+        if self._planes is None:
+            rng = np.random.default_rng(self._seed)
+            self._planes = rng.standard_normal((self.tables, self.bits, vector.shape[0])).astype(np.float32)
+        projections = (self._planes @ vector) > 0
+        return tuple(int(code) for code in projections @ self._weights)
+
+    def add(self, key: str, vector: np.ndarray):
+        self.remove(key)
+        signature = self._signature(vector)
+        for table, code in zip(self._buckets, signature):
+            table.setdefault(code, set()).add(key)
+        self._vectors[key] = vector
+        self._signatures[key] = signature
+
+    def remove(self, key: str):
+        signature = self._signatures.pop(key, None)
+        if signature is None:
+            return
+        self._vectors.pop(key, None)
+        for table, code in zip(self._buckets, signature):
+            bucket = table.get(code)
+            if bucket is not None:
+                bucket.discard(key)
+                if not bucket:
+                    del table[code]
+
+    def search(self, vector: np.ndarray, k: int = 5) -> List[Tuple[str, float]]:
+        """Vecinos más cercanos entre los candidatos que comparten cubeta en alguna tabla"""
+        if not self._vectors:
+            return []
+        candidates = set()
+        for table, code in zip(self._buckets, self._signature(vector)):
+            candidates.update(table.get(code, ()))
+        if not candidates:
+            return []
+        keys = list(candidates)
+        scores = np.stack([self._vectors[key] for key in keys]) @ vector
+        order = np.argsort(-scores)[:k]
+        return [(keys[i], float(scores[i])) for i in order]
+
+    def __len__(self):
+        return len(self._vectors)
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    scope: str
+    user_id: Optional[str]
+    tools: List[str]
+    expires_at: float
+    created_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class CacheProbe:
+    """Resultado de preparar una consulta: se reutiliza para guardar la respuesta tras un fallo"""
+    normalized: str
+    scope: str
+    user_id: str
+    vector: Optional[np.ndarray] = None
+
+
+class SemanticResponseCache:
+    """Respuestas indexadas por (mensaje normalizado, ámbito de herramientas).
+
+    Primero busca coincidencia exacta y después por similitud de embeddings
+    (coseno >= SEMANTIC_CACHE_THRESHOLD) en un índice LSH acotado.
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_MAX_ENTRIES, threshold: float = SEMANTIC_CACHE_THRESHOLD):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._index = LSHIndex()
+        self._lock = threading.Lock()
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0, "stores": 0, "embedding_errors": 0}
+
+    @staticmethod
+    def _key(normalized: str, scope: str, user_id: Optional[str]) -> str:
+        return hashlib.sha256(f"{scope}\0{user_id or ''}\0{normalized}".encode("utf-8")).hexdigest()
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        try:
+            vector = np.asarray(get_embedding_model().embed_query(text), dtype=np.float32)
+        except Exception as e:
+            self.stats["embedding_errors"] += 1
+            logger.warning(f"No se pudo calcular el embedding para la caché semántica: {e}")
+            return None
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _get_valid(self, key: str, now: float) -> Optional[CachedAnswer]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            self._discard(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _discard(self, key: str):
+        self._entries.pop(key, None)
+        self._index.remove(key)
+
+    def lookup(self, query: str, scope: str, user_id: str) -> Tuple[Optional[CachedAnswer], CacheProbe]:
+        """Busca una respuesta reutilizable. Devuelve (entrada o None, probe)"""
+        probe = CacheProbe(normalized=normalize_query(query), scope=scope, user_id=user_id)
+        now = time.time()
+        with self._lock:
+            for owner in (None, user_id):
+                entry = self._get_valid(self._key(probe.normalized, scope, owner), now)
+                if entry is not None:
+                    self.stats["exact_hits"] += 1
+                    return entry, probe
+
+        probe.vector = self._embed(probe.normalized)
+        if probe.vector is None:
+            with self._lock:
+                self.stats["misses"] += 1
+            return None, probe
+
+        with self._lock:
+            for key, score in self._index.search(probe.vector):
+                if score < self.threshold:
+                    break
+                entry = self._get_valid(key, now)
+                if entry is not None and entry.scope == scope and entry.user_id in (None, user_id):
+                    self.stats["semantic_hits"] += 1
+                    logger.info(f"Respuesta servida desde caché semántica (similitud {score:.3f})")
+                    return entry, probe
+            self.stats["misses"] += 1
+        return None, probe
+
+    def store(self, probe: CacheProbe, answer: str, tools: Sequence[str]):
+        """Guarda la respuesta generada; solo se comparte si todas sus herramientas son públicas"""
+        tools = sorted(set(tools))
+        user_id = None if all(_matches(t, SEMANTIC_CACHE_PUBLIC_TOOLS) for t in tools) else probe.user_id
+        now = time.time()
+        entry = CachedAnswer(query=probe.normalized, answer=answer, scope=probe.scope, user_id=user_id,
+                             tools=tools, expires_at=now + ttl_for_tools(tools), created_at=now)
+        key = self._key(probe.normalized, probe.scope, user_id)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            if probe.vector is not None:
+                self._index.add(key, probe.vector)
+            while len(self._entries) > self.max_entries:
+                oldest, _ = self._entries.popitem(last=False)
+                self._index.remove(oldest)
+            self.stats["stores"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return {**self.stats, "entries": len(self._entries), "indexed": len(self._index),
+                    "enabled": SEMANTIC_CACHE_ENABLED}
+
+
+# Instancia global de la caché
+response_cache = SemanticResponseCache()
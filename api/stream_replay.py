@@ -0,0 +1,227 @@
+# api/stream_replay.py - Streams SSE reanudables: IDs de evento y búfer de reenvío por hilo
+import os
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import threading
+import itertools
+from collections import OrderedDict, deque
+from typing import AsyncIterable, AsyncIterator, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from api.streaming import SSE_HEARTBEAT_INTERVAL, sse_heartbeat
+
+logger = logging.getLogger("stream_replay")
+
+# Frames que se conservan por generación para reenviarlos a un cliente que se reconecta
+REPLAY_BUFFER_FRAMES = int(os.environ.get("REPLAY_BUFFER_FRAMES", "4000"))
+# Tiempo durante el que una generación terminada sigue disponible para reconexiones
+REPLAY_RETENTION = float(os.environ.get("REPLAY_RETENTION", "120"))
+REPLAY_MAX_RUNS = int(os.environ.get("REPLAY_MAX_RUNS", "256"))
+
+
+def request_key(user_id: str, thread_id: Optional[str], message: str) -> str:
+    """Identifica una petición de chat para reconocer reintentos sin Last-Event-ID"""
+    return hashlib.sha256(f"{user_id}\0{thread_id or ''}\0{message}".encode("utf-8")).hexdigest()
+
+
+def parse_event_id(event_id: str) -> Optional[Tuple[str, int]]:
+    """'<run_id>:<seq>' -> (run_id, seq); None si no tiene ese formato"""
+    run_id, _, seq = (event_id or "").strip().rpartition(":")
+    if not run_id or not seq.isdigit():
+        return None
+    return run_id, int(seq)
+
+
+class StreamRun:
+    """Una generación en curso o recién terminada, desacoplada de la conexión del cliente.
+
+    El productor (el grafo) añade frames con ID secuencial; cualquier número de
+    consumidores los leen desde la posición que indique su Last-Event-ID.
+    """
+
+    def __init__(self, key: str, user_id: str):
+        self.run_id = uuid.uuid4().hex[:16]
+        self.key = key
+        self.user_id = user_id
+        self.done = False
+        self.finished_at: Optional[float] = None
+        self._frames: "deque[Tuple[int, str]]" = deque(maxlen=REPLAY_BUFFER_FRAMES)
+        self._next_seq = 1
+        self._cond = threading.Condition()
+        self._listeners: List[Callable[[], None]] = []
+        self._on_finish: List[Callable[[], None]] = []
+
+    def append(self, frame: str):
+        with self._cond:
+            seq = self._next_seq
+            self._next_seq += 1
+            self._frames.append((seq, f"id: {self.run_id}:{seq}\n{frame}"))
+            self._notify()
+
+    def finish(self):
+        with self._cond:
+            self.done = True
+            self.finished_at = time.time()
+            self._notify()
+            callbacks, self._on_finish = self._on_finish, []
+        for callback in callbacks:
+            callback()
+
+    def on_finish(self, callback: Callable[[], None]):
+        """Ejecuta `callback` al terminar la generación (de inmediato si ya terminó)"""
+        with self._cond:
+            if not self.done:
+                self._on_finish.append(callback)
+                return
+        callback()
+
+    def _notify(self):
+        self._cond.notify_all()
+        for listener in list(self._listeners):
+            listener()
+
+    def frames_after(self, seq: int) -> Tuple[List[str], int, bool]:
+        """(frames posteriores a seq, última seq entregada, terminado)"""
+        with self._cond:
+            if not self._frames:
+                return [], seq, self.done and seq >= self._next_seq - 1
+            # Las seq del búfer son contiguas: la posición de la siguiente a `seq` se calcula directamente
+            first_seq = self._frames[0][0]
+            start = max(0, seq - first_seq + 1)
+            if first_seq > seq + 1:
+                logger.warning(f"Reconexión a {self.run_id}: se perdieron frames anteriores a {first_seq}")
+            frames = [f for _, f in itertools.islice(self._frames, start, None)]
+            last = first_seq + start + len(frames) - 1 if frames else seq
+            return frames, last, self.done and last >= self._next_seq - 1
+
+    def iter_frames(self, after: int = 0, heartbeat: float = SSE_HEARTBEAT_INTERVAL) -> Iterator[str]:
+        """Consumidor síncrono: reenvía desde `after` y sigue la generación hasta el final"""
+        while True:
+            frames, after, finished = self.frames_after(after)
+            yield from frames
+            if finished:
+                return
+            if not frames:
+                with self._cond:
+                    if self._next_seq - 1 <= after and not self.done and not self._cond.wait(heartbeat):
+                        # Comentario SSE: mantiene viva la conexión a través de proxies con timeout
+                        yield sse_heartbeat()
+
+    async def aiter_frames(self, after: int = 0, heartbeat: float = SSE_HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+        """Variante asíncrona de iter_frames"""
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Event()
+
+        def listener():
+            loop.call_soon_threadsafe(changed.set)
+
+        with self._cond:
+            self._listeners.append(listener)
+        try:
+            while True:
+                changed.clear()
+                frames, after, finished = self.frames_after(after)
+                for frame in frames:
+                    yield frame
+                if finished:
+                    return
+                if not frames:
+                    try:
+                        await asyncio.wait_for(changed.wait(), heartbeat)
+                    except asyncio.TimeoutError:
+                        yield sse_heartbeat()
+        finally:
+            with self._cond:
+                self._listeners.remove(listener)
+
+
+class StreamRegistry:
+    """Generaciones recientes por run_id, con búsqueda de generaciones activas por petición"""
+
+    def __init__(self, max_runs: int = REPLAY_MAX_RUNS, retention: float = REPLAY_RETENTION):
+        self.max_runs = max_runs
+        self.retention = retention
+        self._runs: "OrderedDict[str, StreamRun]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Referencias a las tareas productoras para que no las recoja el GC
+        self._tasks = set()
+        self.stats = {"started": 0, "resumed": 0, "deduplicated": 0, "expired_resumes": 0}
+
+    def _prune(self):
+        now = time.time()
+        for run_id in [r for r, run in self._runs.items() if run.done and now - run.finished_at > self.retention]:
+            del self._runs[run_id]
+        while len(self._runs) > self.max_runs:
+            # Nunca se descarta una generación en curso mientras haya terminadas
+            victim = next((r for r, run in self._runs.items() if run.done), None)
+            if victim is None:
+                break
+            del self._runs[victim]
+
+    def start(self, key: str, user_id: str) -> StreamRun:
+        run = StreamRun(key, user_id)
+        with self._lock:
+            self._prune()
+            self._runs[run.run_id] = run
+            self.stats["started"] += 1
+        return run
+
+    def find_active(self, key: str) -> Optional[StreamRun]:
+        """Generación en curso para la misma petición (reintento sin Last-Event-ID)"""
+        with self._lock:
+            for run in reversed(self._runs.values()):
+                if run.key == key and not run.done:
+                    self.stats["deduplicated"] += 1
+                    return run
+        return None
+
+    def resume(self, last_event_id: str, user_id: str) -> Tuple[Optional[StreamRun], int]:
+        """(generación, última seq recibida) para un Last-Event-ID; (None, 0) si ya no existe"""
+        parsed = parse_event_id(last_event_id)
+        with self._lock:
+            self._prune()
+            run = self._runs.get(parsed[0]) if parsed else None
+            # Un usuario solo puede reengancharse a sus propias generaciones
+            if run is None or run.user_id != user_id:
+                self.stats["expired_resumes"] += 1
+                return None, 0
+            self.stats["resumed"] += 1
+            return run, parsed[1]
+
+    def produce(self, run: StreamRun, frames: Iterable[str]):
+        """Ejecuta el productor en un hilo propio: sigue aunque el cliente se desconecte"""
+        def pump():
+            try:
+                for frame in frames:
+                    run.append(frame)
+            except Exception as e:
+                logger.error(f"Error en la generación {run.run_id}: {e}")
+            finally:
+                run.finish()
+        threading.Thread(target=pump, name=f"stream-{run.run_id}", daemon=True).start()
+
+    def aproduce(self, run: StreamRun, frames: AsyncIterable[str]) -> asyncio.Task:
+        """Variante asíncrona de produce: la generación corre en una tarea independiente"""
+        async def pump():
+            try:
+                async for frame in frames:
+                    run.append(frame)
+            except Exception as e:
+                logger.error(f"Error en la generación {run.run_id}: {e}")
+            finally:
+                run.finish()
+        task = asyncio.create_task(pump())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def get_stats(self):
+        with self._lock:
+            active = sum(1 for run in self._runs.values() if not run.done)
+            return {**self.stats, "runs": len(self._runs), "active": active}
+
+
+# Instancia global del registro
+stream_runs = StreamRegistry()
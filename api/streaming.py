@@ -0,0 +1,224 @@
+# api/streaming.py - Utilidades de streaming SSE para el endpoint de chat
+import os
+import time
+import json
+import logging
+from typing import Any, AsyncIterable, AsyncIterator, Callable, Dict, Iterable, Iterator, Optional, Tuple
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langgraph.config import get_stream_writer
+
+# Codificador JSON rápido (orjson) con fallback a la librería estándar
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logging.info("orjson no disponible - usando json estándar para SSE")
+
+# Modo de streaming: "tokens" reenvía tokens del LLM conforme llegan,
+# "updates" emite un frame por cada AIMessage completo (comportamiento anterior)
+STREAM_MODE = os.environ.get("CHAT_STREAM_MODE", "tokens").lower()
+SSE_FLUSH_INTERVAL = float(os.environ.get("SSE_FLUSH_INTERVAL_MS", "30")) / 1000.0
+# Sin frames durante este tiempo se envía un comentario para que los proxies no corten el stream
+SSE_HEARTBEAT_INTERVAL = float(os.environ.get("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# Nodo del grafo cuyos tokens se reenvían al cliente
+AGENT_NODE = "agent"
+
+# Eventos de progreso de herramientas (stream "custom" del grafo) reenviados como frames SSE
+TOOL_PROGRESS_EVENTS = os.environ.get("TOOL_PROGRESS_EVENTS", "true").lower() in ("1", "true", "yes")
+PROGRESS_STREAM_MODE = "custom"
+# En modo tokens también se pide "updates": marca el fin de cada nodo y permite vaciar el texto pendiente
+TOKEN_STREAM_MODES = ["messages", "updates"] + ([PROGRESS_STREAM_MODE] if TOOL_PROGRESS_EVENTS else [])
+UPDATE_STREAM_MODES = ["updates", PROGRESS_STREAM_MODE] if TOOL_PROGRESS_EVENTS else "updates"
+
+
+def dumps(payload: Any) -> str:
+    """Serializa un payload a JSON usando el codificador más rápido disponible"""
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(payload).decode("utf-8")
+    return json.dumps(payload, ensure_ascii=False)
+
+
+def encode_sse(payload: Dict[str, Any]) -> str:
+    """Codifica un payload como frame SSE"""
+    return f"data: {dumps(payload)}\n\n"
+
+
+def sse_done() -> str:
+    """Frame de cierre del stream"""
+    return "data: [DONE]\n\n"
+
+
+def sse_heartbeat() -> str:
+    """Comentario SSE de keep-alive (los clientes lo ignoran)"""
+    return ": ping\n\n"
+
+
+def extract_text(content: Any) -> str:
+    """Extrae el texto de un contenido de mensaje (str o lista de partes)"""
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts = []
+        for part in content:
+            if isinstance(part, str):
+                parts.append(part)
+            elif isinstance(part, dict) and part.get("type") == "text":
+                parts.append(part.get("text", ""))
+        return "".join(parts)
+    return ""
+
+
+class SSEFrameBatcher:
+    """Agrupa tokens en frames SSE según un intervalo de flush"""
+
+    def __init__(self, flush_interval: float = None):
+        self.flush_interval = SSE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self._buffer = []
+        self._last_flush = None
+
+    def add(self, text: str) -> Optional[str]:
+        """Añade texto al buffer y devuelve el lote si toca hacer flush"""
+        self._buffer.append(text)
+        now = time.monotonic()
+        # El primer token se emite de inmediato para minimizar el time-to-first-token
+        if self._last_flush is None or now - self._last_flush >= self.flush_interval:
+            return self._drain(now)
+        return None
+
+    def flush(self) -> Optional[str]:
+        """Vacía el buffer pendiente"""
+        if not self._buffer:
+            return None
+        return self._drain(time.monotonic())
+
+    def _drain(self, now: float) -> str:
+        text = "".join(self._buffer)
+        self._buffer.clear()
+        self._last_flush = now
+        return text
+
+
+def get_progress_writer() -> Optional[Callable[[Dict[str, Any]], None]]:
+    """Writer del stream "custom" del nodo en ejecución; None fuera del grafo o si está desactivado"""
+    if not TOOL_PROGRESS_EVENTS:
+        return None
+    try:
+        return get_stream_writer()
+    except Exception:
+        return None
+
+
+def _split_mode(item: Any, default_mode: str) -> Tuple[str, Any]:
+    """Con varios stream_mode LangGraph emite (modo, dato); con uno solo, el dato directamente"""
+    if isinstance(item, tuple) and len(item) == 2 and isinstance(item[0], str):
+        return item
+    return default_mode, item
+
+
+def _progress_frame(event: Any, thread_id: str) -> Optional[str]:
+    if not isinstance(event, dict):
+        return None
+    return encode_sse({**event, "thread_id": thread_id})
+
+
+def _agent_token(message: Any, metadata: Dict[str, Any]) -> str:
+    """Devuelve el texto de un chunk si pertenece a la respuesta del orquestador"""
+    if metadata.get("langgraph_node") != AGENT_NODE:
+        return ""
+    if not isinstance(message, (AIMessageChunk, AIMessage)):
+        return ""
+    return extract_text(message.content)
+
+
+def iter_token_frames(graph_stream: Iterable, thread_id: str,
+                      flush_interval: float = None) -> Iterator[str]:
+    """Convierte el stream de tokens del agente (y los eventos de progreso) en frames SSE"""
+    batcher = SSEFrameBatcher(flush_interval)
+    for item in graph_stream:
+        mode, payload = _split_mode(item, "messages")
+        if mode != "messages":
+            # Fin de un nodo (el agente terminó su mensaje) o evento de progreso: los tokens
+            # pendientes salen ya, sin esperar al siguiente token, y antes que el evento
+            pending = batcher.flush()
+            if pending:
+                yield encode_sse({"content": pending, "thread_id": thread_id})
+            frame = _progress_frame(payload, thread_id) if mode == PROGRESS_STREAM_MODE else None
+            if frame:
+                yield frame
+            continue
+        text = _agent_token(*payload)
+        if not text:
+            continue
+        batch = batcher.add(text)
+        if batch:
+            yield encode_sse({"content": batch, "thread_id": thread_id})
+    pending = batcher.flush()
+    if pending:
+        yield encode_sse({"content": pending, "thread_id": thread_id})
+
+
+def _final_agent_content(chunk: Dict[str, Any]) -> Any:
+    """Devuelve el contenido de la respuesta final del agente en un chunk 'updates'"""
+    if AGENT_NODE in chunk:
+        agent_messages = chunk[AGENT_NODE].get('messages', [])
+        if agent_messages:
+            ai_message = agent_messages[-1]
+            if ai_message.content and not ai_message.tool_calls:
+                return ai_message.content
+    return None
+
+
+def iter_update_frames(graph_stream: Iterable, thread_id: str) -> Iterator[str]:
+    """Emite un frame por cada respuesta final completa del agente (modo 'updates') y por cada evento de progreso"""
+    for item in graph_stream:
+        mode, chunk = _split_mode(item, "updates")
+        if mode == PROGRESS_STREAM_MODE:
+            frame = _progress_frame(chunk, thread_id)
+            if frame:
+                yield frame
+            continue
+        content = _final_agent_content(chunk)
+        if content:
+            yield encode_sse({'content': content, 'thread_id': thread_id})
+
+
+async def aiter_token_frames(graph_stream: AsyncIterable, thread_id: str,
+                             flush_interval: float = None) -> AsyncIterator[str]:
+    """Variante asíncrona de iter_token_frames (graph.astream)"""
+    batcher = SSEFrameBatcher(flush_interval)
+    async for item in graph_stream:
+        mode, payload = _split_mode(item, "messages")
+        if mode != "messages":
+            pending = batcher.flush()
+            if pending:
+                yield encode_sse({"content": pending, "thread_id": thread_id})
+            frame = _progress_frame(payload, thread_id) if mode == PROGRESS_STREAM_MODE else None
+            if frame:
+                yield frame
+            continue
+        text = _agent_token(*payload)
+        if not text:
+            continue
+        batch = batcher.add(text)
+        if batch:
+            yield encode_sse({"content": batch, "thread_id": thread_id})
+    pending = batcher.flush()
+    if pending:
+        yield encode_sse({"content": pending, "thread_id": thread_id})
+
+
+async def aiter_update_frames(graph_stream: AsyncIterable, thread_id: str) -> AsyncIterator[str]:
+    """Variante asíncrona de iter_update_frames (graph.astream)"""
+    async for item in graph_stream:
+        mode, chunk = _split_mode(item, "updates")
+        if mode == PROGRESS_STREAM_MODE:
+            frame = _progress_frame(chunk, thread_id)
+            if frame:
+                yield frame
+            continue
+        content = _final_agent_content(chunk)
+        if content:
+            yield encode_sse({'content': content, 'thread_id': thread_id})
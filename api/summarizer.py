@@ -0,0 +1,184 @@
+# api/summarizer.py - Resumen map-reduce por tokens de salidas largas de herramientas
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+
+from langchain_core.messages import HumanMessage
+
+from api.models import get_chat_model
+
+logger = logging.getLogger("summarizer")
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+    logger.warning("tiktoken no disponible - se estimarán tokens por caracteres")
+
+SUMMARY_MODEL = os.environ.get("SUMMARY_MODEL", "gpt-4o-mini")
+# Salidas por debajo de este umbral se devuelven tal cual
+SUMMARY_TOKEN_THRESHOLD = int(os.environ.get("SUMMARY_TOKEN_THRESHOLD", "8000"))
+SUMMARY_CHUNK_TOKENS = int(os.environ.get("SUMMARY_CHUNK_TOKENS", "6000"))
+# Presupuesto total de tokens de entrada que se procesan por salida
+SUMMARY_INPUT_TOKEN_BUDGET = int(os.environ.get("SUMMARY_INPUT_TOKEN_BUDGET", "96000"))
+SUMMARY_PARTIAL_MAX_TOKENS = int(os.environ.get("SUMMARY_PARTIAL_MAX_TOKENS", "700"))
+SUMMARY_FINAL_MAX_TOKENS = int(os.environ.get("SUMMARY_FINAL_MAX_TOKENS", "1500"))
+SUMMARY_MAX_CONCURRENCY = int(os.environ.get("SUMMARY_MAX_CONCURRENCY", "6"))
+SUMMARY_CACHE_SIZE = int(os.environ.get("SUMMARY_CACHE_SIZE", "256"))
+
+_ENCODING = None
+_ENCODING_FAILED = False
+_ENCODING_LOCK = threading.Lock()
+
+
+def _get_encoding():
+    """Codificación tiktoken del modelo de resumen (None si no está disponible)"""
+    global _ENCODING, _ENCODING_FAILED
+    if not TIKTOKEN_AVAILABLE or _ENCODING_FAILED:
+        return None
+    with _ENCODING_LOCK:
+        if _ENCODING is None and not _ENCODING_FAILED:
+            try:
+                try:
+                    _ENCODING = tiktoken.encoding_for_model(SUMMARY_MODEL)
+                except KeyError:
+                    _ENCODING = tiktoken.get_encoding("o200k_base")
+            except Exception as e:
+                # Sin acceso a los ficheros de codificación no se reintenta en cada llamada
+                logger.warning(f"No se pudo cargar la codificación de tiktoken: {e}")
+                _ENCODING_FAILED = True
+        return _ENCODING
+
+
+def count_tokens(text: str) -> int:
+    """Cuenta tokens con tiktoken; aproxima 4 caracteres por token si no está disponible"""
+    encoding = _get_encoding()
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_by_tokens(text: str, chunk_tokens: int, budget_tokens: int) -> List[str]:
+    """Divide un texto en fragmentos de `chunk_tokens` hasta agotar `budget_tokens`"""
+    encoding = _get_encoding()
+    if encoding is None:
+        chunk_chars, budget_chars = chunk_tokens * 4, budget_tokens * 4
+        return [text[i:i + chunk_chars] for i in range(0, min(len(text), budget_chars), chunk_chars)]
+
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) > budget_tokens:
+        logger.warning(f"Salida de {len(tokens)} tokens recortada al presupuesto de {budget_tokens}")
+        tokens = tokens[:budget_tokens]
+    return [encoding.decode(tokens[i:i + chunk_tokens]) for i in range(0, len(tokens), chunk_tokens)]
+
+
+class SummaryCache:
+    """Caché LRU de resúmenes indexada por hash de (pregunta, salida)"""
+
+    def __init__(self, max_size: int = SUMMARY_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(query: str, output: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(query.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(output.encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            summary = self._entries.get(key)
+            if summary is not None:
+                self._entries.move_to_end(key)
+            return summary
+
+    def put(self, key: str, summary: str):
+        with self._lock:
+            self._entries[key] = summary
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+summary_cache = SummaryCache()
+
+
+def _map_prompt(query: str, chunk: str, index: int, total: int) -> str:
+    return (f'Pregunta Original: "{query}"\n\n'
+            f'Fragmento {index} de {total} del resultado de una herramienta:\n---\n{chunk}\n---\n\n'
+            'Extrae de forma concisa los hechos, datos y citas de este fragmento que sean relevantes '
+            'para responder la pregunta. Si no hay nada relevante, responde "Sin información relevante".')
+
+
+def _reduce_prompt(query: str, partials: List[str]) -> str:
+    joined = "\n\n".join(f"[Parte {i}]\n{p}" for i, p in enumerate(partials, 1))
+    return (f'Pregunta Original: "{query}"\n\n'
+            f'Resúmenes parciales del resultado de una herramienta:\n---\n{joined}\n---\n\n'
+            'Combina los resúmenes en uno solo, conciso y sin repeticiones, con la información relevante para responder la pregunta:')
+
+
+def _single_prompt(query: str, output: str) -> str:
+    return (f'Pregunta Original: "{query}"\n\nResultado de Herramienta:\n---\n{output}\n---\n\n'
+            'Resume concisamente la información relevante para responder la pregunta:')
+
+
+def _reduce(model, query: str, partials: List[str]) -> str:
+    """Reduce resúmenes parciales; colapsa por grupos si no caben en un fragmento"""
+    while count_tokens("\n\n".join(partials)) > SUMMARY_CHUNK_TOKENS and len(partials) > 1:
+        groups, group, group_tokens = [], [], 0
+        for partial in partials:
+            tokens = count_tokens(partial)
+            if group and group_tokens + tokens > SUMMARY_CHUNK_TOKENS:
+                groups.append(group)
+                group, group_tokens = [], 0
+            group.append(partial)
+            group_tokens += tokens
+        groups.append(group)
+        if len(groups) == len(partials):
+            break
+        prompts = [[HumanMessage(content=_reduce_prompt(query, g))] for g in groups]
+        partials = [r.content for r in model.bind(max_tokens=SUMMARY_PARTIAL_MAX_TOKENS).batch(
+            prompts, config={"max_concurrency": SUMMARY_MAX_CONCURRENCY})]
+
+    final_model = model.bind(max_tokens=SUMMARY_FINAL_MAX_TOKENS)
+    return final_model.invoke([HumanMessage(content=_reduce_prompt(query, partials))]).content
+
+
+def summarize_tool_output(original_query: str, tool_output: str) -> str:
+    """Resume una salida de herramienta si supera el umbral de tokens.
+
+    Divide la salida en fragmentos, los resume en paralelo (map) y combina los
+    resúmenes parciales (reduce), todo dentro de SUMMARY_INPUT_TOKEN_BUDGET.
+    """
+    if count_tokens(tool_output) <= SUMMARY_TOKEN_THRESHOLD:
+        return tool_output
+
+    cache_key = SummaryCache.key(original_query, tool_output)
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        logger.info("Resumen de herramienta servido desde caché")
+        return cached
+
+    logger.warning("Salida de herramienta demasiado larga. Resumiendo...")
+    model = get_chat_model("openai", SUMMARY_MODEL, streaming=False)
+    chunks = split_by_tokens(tool_output, SUMMARY_CHUNK_TOKENS, SUMMARY_INPUT_TOKEN_BUDGET)
+
+    if len(chunks) == 1:
+        summary = model.bind(max_tokens=SUMMARY_FINAL_MAX_TOKENS).invoke(
+            [HumanMessage(content=_single_prompt(original_query, chunks[0]))]).content
+    else:
+        prompts = [[HumanMessage(content=_map_prompt(original_query, chunk, i, len(chunks)))]
+                   for i, chunk in enumerate(chunks, 1)]
+        partials = [r.content for r in model.bind(max_tokens=SUMMARY_PARTIAL_MAX_TOKENS).batch(
+            prompts, config={"max_concurrency": SUMMARY_MAX_CONCURRENCY})]
+        summary = _reduce(model, original_query, partials)
+
+    summary_cache.put(cache_key, summary)
+    return summary
@@ -0,0 +1,134 @@
+# api/supabase_pool.py - Clientes Supabase reutilizables con transporte HTTP compartido
+import os
+import logging
+import threading
+from typing import Dict, Optional
+
+import httpx
+from postgrest import SyncPostgrestClient
+from postgrest.utils import SyncClient
+from supabase.client import create_client, Client
+
+logger = logging.getLogger("supabase_pool")
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+SUPABASE_MAX_CONNECTIONS = int(os.environ.get("SUPABASE_MAX_CONNECTIONS", "50"))
+SUPABASE_MAX_KEEPALIVE = int(os.environ.get("SUPABASE_MAX_KEEPALIVE", "20"))
+SUPABASE_KEEPALIVE_EXPIRY = float(os.environ.get("SUPABASE_KEEPALIVE_EXPIRY", "60"))
+SUPABASE_USER_CLIENT_TIMEOUT = float(os.environ.get("SUPABASE_USER_CLIENT_TIMEOUT", "30"))
+
+
+def create_supabase_client(admin=False) -> Client:
+    """Crea un cliente de Supabase nuevo (sin reutilización)"""
+    url = os.environ.get("SUPABASE_URL")
+    anon_key = os.environ.get("SUPABASE_ANON_KEY")
+    service_key = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+
+    key = service_key if admin else anon_key
+    if not url or not key:
+        raise ValueError(f"Variables de Supabase no configuradas. URL: {url}, Key: {'***' if key else None}")
+    return create_client(url, key)
+
+
+class _PooledPostgrestClient(SyncPostgrestClient):
+    """Cliente PostgREST cuya sesión HTTP usa un transporte (pool de conexiones) compartido"""
+
+    def __init__(self, base_url: str, *, transport: httpx.BaseTransport, **kwargs):
+        self._transport = transport
+        super().__init__(base_url, **kwargs)
+
+    def create_session(self, base_url, headers, timeout, verify=True, proxy=None) -> SyncClient:
+        return SyncClient(
+            base_url=base_url,
+            headers=headers,
+            timeout=timeout,
+            transport=self._transport,
+            follow_redirects=True,
+        )
+
+
+class SupabaseClientPool:
+    """Reutiliza clientes de Supabase por tipo de clave (anon/admin) y crea clientes
+    por usuario sobre un pool de conexiones keep-alive (HTTP/2 si está disponible)."""
+
+    def __init__(self):
+        self._clients: Dict[str, Client] = {}
+        self._transport: Optional[httpx.HTTPTransport] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _reset_after_fork(self):
+        # Las conexiones abiertas no deben compartirse entre procesos tras un fork
+        if self._pid != os.getpid():
+            self._clients = {}
+            self._transport = None
+            self._pid = os.getpid()
+
+    def get_client(self, admin: bool = False) -> Client:
+        """Cliente compartido para la clave anon o service role"""
+        key_type = "admin" if admin else "anon"
+        client = self._clients.get(key_type)
+        if client is not None and self._pid == os.getpid():
+            return client
+
+        with self._lock:
+            self._reset_after_fork()
+            client = self._clients.get(key_type)
+            if client is None:
+                client = create_supabase_client(admin=admin)
+                self._clients[key_type] = client
+                logger.info(f"Cliente Supabase '{key_type}' creado y registrado en el pool")
+            return client
+
+    def _get_transport(self) -> httpx.HTTPTransport:
+        with self._lock:
+            self._reset_after_fork()
+            if self._transport is None:
+                self._transport = httpx.HTTPTransport(
+                    http2=HTTP2_AVAILABLE,
+                    limits=httpx.Limits(
+                        max_connections=SUPABASE_MAX_CONNECTIONS,
+                        max_keepalive_connections=SUPABASE_MAX_KEEPALIVE,
+                        keepalive_expiry=SUPABASE_KEEPALIVE_EXPIRY,
+                    ),
+                )
+            return self._transport
+
+    def user_client(self, access_token: str) -> SyncPostgrestClient:
+        """Cliente PostgREST con la sesión del usuario (RLS) sobre el transporte compartido"""
+        url = os.environ.get("SUPABASE_URL")
+        anon_key = os.environ.get("SUPABASE_ANON_KEY")
+        if not url or not anon_key:
+            raise ValueError("Variables de Supabase no configuradas")
+
+        access_token = access_token.replace('Bearer ', '')
+        return _PooledPostgrestClient(
+            f"{url.rstrip('/')}/rest/v1",
+            transport=self._get_transport(),
+            headers={
+                "Accept": "application/json",
+                "Content-Type": "application/json",
+                "apikey": anon_key,
+                "Authorization": f"Bearer {access_token}",
+            },
+            timeout=SUPABASE_USER_CLIENT_TIMEOUT,
+        )
+
+
+# Instancia global del pool
+supabase_pool = SupabaseClientPool()
+
+
+def get_supabase_client(admin: bool = False) -> Client:
+    """Cliente Supabase compartido del proceso"""
+    return supabase_pool.get_client(admin=admin)
+
+
+def get_user_supabase_client(access_token: str) -> SyncPostgrestClient:
+    """Cliente con la sesión del usuario sin reconstruir el transporte HTTP"""
+    return supabase_pool.user_client(access_token)
@@ -0,0 +1,167 @@
+# api/thread_hydration.py - Reconstrucción perezosa de hilos desde la tabla `messages`
+import os
+import logging
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from api.context_manager import CONTEXT_TARGET_RATIO, CONTEXT_TOKEN_BUDGET, message_tokens
+from api.supabase_pool import get_user_supabase_client
+
+logger = logging.getLogger("thread_hydration")
+
+HYDRATION_ENABLED = os.environ.get("HYDRATION_ENABLED", "true").lower() in ("1", "true", "yes")
+HYDRATION_PAGE_SIZE = int(os.environ.get("HYDRATION_PAGE_SIZE", "40"))
+# Por defecto se carga lo que cabe sin que el primer turno tenga que plegar historial
+HYDRATION_TOKEN_BUDGET = int(os.environ.get("HYDRATION_TOKEN_BUDGET",
+                                            str(int(CONTEXT_TOKEN_BUDGET * CONTEXT_TARGET_RATIO))))
+HYDRATION_MAX_PAGES = int(os.environ.get("HYDRATION_MAX_PAGES", "10"))
+
+# Las salidas de herramientas no se reconstruyen: sin la llamada que las originó no son válidas en el prompt
+_ROLE_MESSAGES = {"user": HumanMessage, "assistant": AIMessage}
+
+Cursor = Tuple[str, str]
+
+
+class MessagePages:
+    """Historial de un chat en páginas por keyset (created_at, id), de más reciente a más antiguo.
+
+    Cada página se pide solo cuando se consume la anterior, así que quien deja
+    de iterar no paga por el resto del historial.
+    """
+
+    def __init__(self, chat_id: str, authorization: str, page_size: int = HYDRATION_PAGE_SIZE,
+                 max_pages: int = HYDRATION_MAX_PAGES):
+        self.chat_id = chat_id
+        self.authorization = authorization
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self.pages_fetched = 0
+        # Quedan páginas más antiguas sin pedir
+        self.has_more = False
+
+    def fetch(self, before: Optional[Cursor] = None) -> List[Dict[str, Any]]:
+        """Una página anterior a `before` (o la más reciente), ordenada de nueva a antigua"""
+        query = (get_user_supabase_client(self.authorization).from_('messages')
+                 .select('id, role, content, created_at')
+                 .eq('chat_id', self.chat_id)
+                 .in_('role', list(_ROLE_MESSAGES)))
+        if before is not None:
+            created_at, message_id = before
+            # El id desempata mensajes con el mismo created_at
+            query = query.or_(f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{message_id})')
+        response = query.order('created_at', desc=True).order('id', desc=True).limit(self.page_size).execute()
+        self.pages_fetched += 1
+        return response.data or []
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        cursor = None
+        while True:
+            page = self.fetch(cursor)
+            yield from page
+            if len(page) < self.page_size:
+                return
+            if self.pages_fetched >= self.max_pages:
+                self.has_more = True
+                return
+            cursor = (page[-1]['created_at'], page[-1]['id'])
+
+
+def load_recent_history(pages: MessagePages, budget: int = HYDRATION_TOKEN_BUDGET) -> Tuple[List[BaseMessage], bool]:
+    """(mensajes más recientes que caben en `budget`, en orden cronológico; quedan más antiguos)
+
+    Solo se devuelven turnos completos: empiezan por un mensaje del usuario y
+    terminan con una respuesta del asistente.
+    """
+    newest_first: List[BaseMessage] = []
+    used = 0
+    truncated = False
+    for row in pages:
+        message = _ROLE_MESSAGES[row['role']](content=row.get('content') or '')
+        tokens = message_tokens(message)
+        if used + tokens > budget:
+            truncated = True
+            break
+        newest_first.append(message)
+        used += tokens
+
+    truncated = truncated or pages.has_more
+    history = newest_first[::-1]
+    # Sin el inicio de su turno, las respuestas del principio quedan huérfanas
+    while history and not isinstance(history[0], HumanMessage):
+        history.pop(0)
+        truncated = True
+    # Mensajes del usuario sin respuesta (p. ej. el turno actual ya volcado a la tabla)
+    while history and not isinstance(history[-1], AIMessage):
+        history.pop()
+    return history, truncated
+
+
+class ThreadHydrator:
+    """Repone en el checkpointer el historial de hilos que no tiene (reinicio o expulsión)"""
+
+    def __init__(self, enabled: bool = HYDRATION_ENABLED):
+        self.enabled = enabled
+        # Lock por hilo con el número de peticiones que lo usan, para poder descartarlo
+        self._locks: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+        self.stats = {"checks": 0, "hydrated": 0, "empty": 0, "failed": 0, "pages": 0, "messages": 0, "truncated": 0}
+
+    def _acquire_lock(self, thread_id: str) -> threading.Lock:
+        with self._lock:
+            entry = self._locks.setdefault(thread_id, [threading.Lock(), 0])
+            entry[1] += 1
+            return entry[0]
+
+    def _release_lock(self, thread_id: str):
+        with self._lock:
+            entry = self._locks[thread_id]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[thread_id]
+
+    def _count(self, **deltas: int):
+        with self._lock:
+            for key, delta in deltas.items():
+                self.stats[key] += delta
+
+    def hydrate(self, app_graph, checkpointer, config: dict, chat_id: str, authorization: str) -> int:
+        """Carga el historial reciente del chat si el checkpointer no conoce el hilo. Devuelve los mensajes cargados"""
+        if not self.enabled or checkpointer is None:
+            return 0
+        self._count(checks=1)
+        # Peticiones simultáneas sobre el mismo hilo hidratan una sola vez
+        lock = self._acquire_lock(chat_id)
+        try:
+            with lock:
+                if checkpointer.get_tuple(config) is not None:
+                    return 0
+                pages = MessagePages(chat_id, authorization)
+                try:
+                    history, truncated = load_recent_history(pages)
+                except Exception as e:
+                    # Sin historial el turno sigue adelante como antes: conversación nueva
+                    logger.error(f"No se pudo cargar el historial del chat {chat_id}: {e}")
+                    self._count(failed=1)
+                    return 0
+                self._count(pages=pages.pages_fetched)
+                if not history:
+                    self._count(empty=1)
+                    return 0
+                app_graph.update_state(config, {"messages": history}, as_node="agent")
+                self._count(hydrated=1, messages=len(history), truncated=int(truncated))
+                logger.info(f"Hilo {chat_id} hidratado con {len(history)} mensajes "
+                            f"({pages.pages_fetched} páginas{', historial anterior sin cargar' if truncated else ''})")
+                return len(history)
+        finally:
+            self._release_lock(chat_id)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "enabled": self.enabled, "page_size": HYDRATION_PAGE_SIZE,
+                    "token_budget": HYDRATION_TOKEN_BUDGET}
+
+
+# Instancia global del hidratador
+thread_hydrator = ThreadHydrator()
@@ -0,0 +1,156 @@
+# api/tool_catalog.py - Compilación del catálogo de herramientas: deduplicación y compactación
+import os
+import re
+import json
+import hashlib
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Sequence, Tuple
+
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+from api.summarizer import count_tokens
+
+logger = logging.getLogger("tool_catalog")
+
+CATALOG_MAX_DESCRIPTION_CHARS = int(os.environ.get("CATALOG_MAX_DESCRIPTION_CHARS", "240"))
+CATALOG_MAX_PARAM_DESCRIPTION_CHARS = int(os.environ.get("CATALOG_MAX_PARAM_DESCRIPTION_CHARS", "120"))
+
+# Metadatos de StructuredTool que identifican la implementación de ToolRegistry y el servidor MCP
+REGISTRY_TOOL_KEY = "registry_tool"
+MCP_SERVER_KEY = "mcp_server"
+
+# Descripciones de parámetros autogeneradas por el servidor MCP, sin información útil
+_PLACEHOLDER_DESCRIPTION = re.compile(r"^Parámetro \w+$")
+
+
+@dataclass
+class CompiledCatalog:
+    """Herramientas ejecutables y sus especificaciones compactas para enlazar al modelo"""
+    tools: List[Any]
+    specs: Dict[str, Dict[str, Any]]
+    report: Dict[str, Any] = field(default_factory=dict)
+
+
+def _compact_text(text: str, limit: int) -> str:
+    text = re.sub(r"\s+", " ", (text or "").strip())
+    if len(text) <= limit:
+        return text
+    # Se corta en el último final de frase que quepa; si no hay, por palabra
+    cut = text[:limit]
+    sentence_end = cut.rfind(". ")
+    if sentence_end > limit // 2:
+        return cut[:sentence_end + 1]
+    return cut.rsplit(" ", 1)[0] + "…"
+
+
+def _compact_schema(schema: Any) -> Any:
+    """Elimina de un JSON schema lo que no aporta al modelo (títulos, defaults nulos, placeholders)"""
+    if isinstance(schema, list):
+        return [_compact_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    compact = {}
+    for key, value in schema.items():
+        if key == "title" and isinstance(value, str):
+            continue
+        if key == "default" and value is None:
+            continue
+        if key == "description" and isinstance(value, str):
+            if _PLACEHOLDER_DESCRIPTION.match(value.strip()):
+                continue
+            value = _compact_text(value, CATALOG_MAX_PARAM_DESCRIPTION_CHARS)
+            if not value:
+                continue
+        if key == "properties" and isinstance(value, dict):
+            # Los nombres de propiedades no son palabras clave del schema: solo se compactan sus valores
+            compact[key] = {name: _compact_schema(prop) for name, prop in value.items()}
+            continue
+        compact[key] = _compact_schema(value)
+    return compact
+
+
+def compact_tool_spec(tool) -> Dict[str, Any]:
+    """Especificación OpenAI mínima de una herramienta"""
+    spec = convert_to_openai_tool(tool)
+    function = spec["function"]
+    function["description"] = _compact_text(function.get("description", ""), CATALOG_MAX_DESCRIPTION_CHARS)
+    if "parameters" in function:
+        function["parameters"] = _compact_schema(function["parameters"])
+    return spec
+
+
+def _spec_tokens(spec: Dict[str, Any]) -> int:
+    return count_tokens(json.dumps(spec, ensure_ascii=False, separators=(",", ":")))
+
+
+def _deduplicate(tools: Sequence[Any]) -> Tuple[List[Any], List[Dict[str, str]]]:
+    """Quita herramientas que resuelven a la misma implementación de ToolRegistry.
+
+    Se prefiere la versión en proceso (sin salto MCP); entre varias copias MCP
+    se conserva la primera.
+    """
+    chosen: Dict[str, Any] = {}
+    for tool in tools:
+        registry_name = (tool.metadata or {}).get(REGISTRY_TOOL_KEY)
+        if not registry_name:
+            continue
+        current = chosen.get(registry_name)
+        if current is None or ((current.metadata or {}).get(MCP_SERVER_KEY) and not (tool.metadata or {}).get(MCP_SERVER_KEY)):
+            chosen[registry_name] = tool
+
+    kept, removed, seen_names = [], [], set()
+    for tool in tools:
+        registry_name = (tool.metadata or {}).get(REGISTRY_TOOL_KEY)
+        if registry_name and chosen[registry_name] is not tool:
+            removed.append({"name": tool.name, "duplicate_of": chosen[registry_name].name})
+            continue
+        if tool.name in seen_names:
+            removed.append({"name": tool.name, "duplicate_of": tool.name})
+            continue
+        seen_names.add(tool.name)
+        kept.append(tool)
+    return kept, removed
+
+
+def catalog_fingerprint(tools: Sequence[Any]) -> str:
+    """Huella del catálogo: nombres, descripciones, schemas y metadatos (p. ej. configuración de agentes)"""
+    entries = []
+    for tool in tools:
+        try:
+            schema = tool.args
+        except Exception:
+            schema = None
+        entries.append([tool.name, tool.description, schema, tool.metadata or {}])
+    entries.sort(key=lambda entry: entry[0])
+    payload = json.dumps(entries, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+def compile_tool_catalog(tools: Sequence[Any]) -> CompiledCatalog:
+    """Deduplica y compacta el catálogo, e informa de su coste en tokens"""
+    kept, removed = _deduplicate(tools)
+
+    specs, tokens, original_tokens = {}, {}, 0
+    for tool in kept:
+        try:
+            original_tokens += _spec_tokens(convert_to_openai_tool(tool))
+            spec = compact_tool_spec(tool)
+        except Exception as e:
+            logger.warning(f"No se pudo compactar la herramienta {tool.name}: {e}")
+            spec = convert_to_openai_tool(tool)
+        specs[tool.name] = spec
+        tokens[tool.name] = _spec_tokens(spec)
+
+    report = {
+        "tools": len(kept),
+        "removed_duplicates": removed,
+        "tokens_total": sum(tokens.values()),
+        "tokens_before_compaction": original_tokens,
+        "tokens_per_tool": dict(sorted(tokens.items(), key=lambda item: -item[1])),
+    }
+    for entry in removed:
+        logger.info(f"Herramienta duplicada omitida: {entry['name']} (equivale a {entry['duplicate_of']})")
+    logger.info(f"Catálogo compilado: {len(kept)} herramientas, {report['tokens_total']} tokens "
+                f"(antes {original_tokens}, {len(removed)} duplicadas omitidas)")
+    return CompiledCatalog(tools=kept, specs=specs, report=report)
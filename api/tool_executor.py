@@ -0,0 +1,250 @@
+# api/tool_executor.py - Ejecución concurrente de llamadas a herramientas
+import os
+import time
+import asyncio
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import ToolMessage
+
+logger = logging.getLogger("tool_executor")
+
+# Límites configurables por entorno
+TOOL_CALL_TIMEOUT = float(os.environ.get("TOOL_CALL_TIMEOUT", "60"))
+MAX_PARALLEL_TOOL_CALLS = int(os.environ.get("MAX_PARALLEL_TOOL_CALLS", "4"))
+TOOL_EXECUTOR_WORKERS = int(os.environ.get("TOOL_EXECUTOR_WORKERS", "16"))
+# Hilos de reserva para llamadas abandonadas por timeout que siguen ejecutándose
+TOOL_MAX_ABANDONED = int(os.environ.get("TOOL_MAX_ABANDONED", "16"))
+
+
+class _ToolPool:
+    """Pool compartido por todo el proceso con cupos para llamadas vivas.
+
+    Un hilo no puede interrumpirse: la llamada que excede su timeout se abandona
+    pero sigue ocupando su hilo. Las abandonadas pasan a hilos de reserva
+    (hasta TOOL_MAX_ABANDONED) y, agotada la reserva, siguen ocupando su cupo
+    hasta terminar. Así toda llamada con cupo arranca de inmediato y el trabajo
+    abandonado no deja sin hilos a las demás peticiones.
+    """
+
+    def __init__(self, workers: int = TOOL_EXECUTOR_WORKERS, max_abandoned: int = TOOL_MAX_ABANDONED):
+        self._executor = ThreadPoolExecutor(max_workers=workers + max_abandoned, thread_name_prefix="tool-call")
+        # Cupos libres para llamadas vivas; la condición avisa cada vez que se libera uno
+        self._free = workers
+        self._lock = threading.Condition()
+        self.max_abandoned = max_abandoned
+        self.abandoned = 0
+
+    def try_submit(self, fn: Callable, *args) -> Optional[Future]:
+        """Envía la llamada si hay cupo libre; None si el pool está lleno"""
+        with self._lock:
+            if not self._free:
+                return None
+            self._free -= 1
+        try:
+            future = self._executor.submit(fn, *args)
+        except Exception:
+            self._give_back()
+            raise
+        future._slot_held = True
+        future.add_done_callback(self._release_slot)
+        return future
+
+    def wait_for_slot(self, timeout: Optional[float] = None):
+        """Bloquea hasta que se libere un cupo (o venza `timeout`) si el pool está lleno"""
+        with self._lock:
+            if not self._free:
+                self._lock.wait(timeout)
+
+    def _give_back(self):
+        with self._lock:
+            self._free += 1
+            self._lock.notify_all()
+
+    def _release_slot(self, future: Future):
+        with self._lock:
+            held, future._slot_held = future._slot_held, False
+            if held:
+                self._free += 1
+                self._lock.notify_all()
+
+    def abandon(self, future: Future):
+        """La llamada excedió su timeout: su cupo pasa a la reserva si queda sitio"""
+        with self._lock:
+            if not future._slot_held or self.abandoned >= self.max_abandoned:
+                return
+            future._slot_held = False
+            self.abandoned += 1
+            self._free += 1
+            self._lock.notify_all()
+        future.add_done_callback(self._abandoned_done)
+
+    def _abandoned_done(self, future: Future):
+        with self._lock:
+            self.abandoned -= 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"abandoned": self.abandoned, "max_abandoned": self.max_abandoned}
+
+
+_pool = _ToolPool()
+
+
+def _run_tool_call(tool, args: Dict[str, Any], postprocess: Optional[Callable[[str], str]],
+                   started: Optional[List[float]] = None) -> Tuple[str, bool]:
+    """Ejecuta una herramienta y aplica el post-procesado. Devuelve (salida, si el post-procesado la cambió)"""
+    if started is not None:
+        # El timeout cuenta desde que la llamada empieza de verdad, no desde que se encola
+        started.append(time.monotonic())
+    raw = str(tool.invoke(args))
+    output = postprocess(raw) if postprocess else raw
+    return output, output != raw
+
+
+class _ProgressReporter:
+    """Emite eventos de inicio y fin de cada llamada a herramienta (si hay destinatario)"""
+
+    def __init__(self, on_event: Optional[Callable[[Dict[str, Any]], None]]):
+        self.on_event = on_event
+        self._started: Dict[Any, float] = {}
+
+    def _emit(self, event: Dict[str, Any]):
+        try:
+            self.on_event(event)
+        except Exception as e:
+            logger.debug(f"No se pudo emitir el evento de progreso: {e}")
+
+    def started(self, call: Dict[str, Any]):
+        self._started[call.get("id")] = time.monotonic()
+        if self.on_event:
+            self._emit({"event": "tool_started", "tool": call.get("name"), "call_id": call.get("id")})
+
+    def finished(self, call: Dict[str, Any], status: str, summarized: bool = False):
+        started = self._started.pop(call.get("id"), None)
+        if self.on_event:
+            duration = round((time.monotonic() - started) * 1000) if started is not None else None
+            self._emit({"event": "tool_finished", "tool": call.get("name"), "call_id": call.get("id"),
+                        "status": status, "duration_ms": duration, "summarized": summarized})
+
+
+def execute_tool_calls(tool_calls: List[Dict[str, Any]], tool_map: Dict[str, Any],
+                       postprocess: Optional[Callable[[str], str]] = None,
+                       timeout: float = None, max_parallel: int = None,
+                       on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[ToolMessage]:
+    """Ejecuta las llamadas a herramientas de un paso del agente de forma concurrente.
+
+    Respeta un máximo de llamadas en vuelo por petición y un timeout por llamada.
+    Los ToolMessage se devuelven en el mismo orden que `tool_calls`. Si se pasa
+    `on_event`, recibe los eventos tool_started/tool_finished desde este mismo hilo.
+    """
+    progress = _ProgressReporter(on_event)
+    timeout = TOOL_CALL_TIMEOUT if timeout is None else timeout
+    max_parallel = max(1, MAX_PARALLEL_TOOL_CALLS if max_parallel is None else max_parallel)
+
+    results: List[Optional[ToolMessage]] = [None] * len(tool_calls)
+    pending = []
+    for index, call in enumerate(tool_calls):
+        tool_name = call.get("name")
+        if tool_name in tool_map:
+            pending.append(index)
+        else:
+            results[index] = ToolMessage(content=f"Error: Herramienta '{tool_name}' no encontrada.", tool_call_id=call.get("id"))
+
+    in_flight: Dict[Future, Tuple[int, List[float]]] = {}
+
+    def submit(index: int) -> bool:
+        call = tool_calls[index]
+        started: List[float] = []
+        # Cada llamada hereda el contexto (callbacks, trazas) de la petición
+        ctx = contextvars.copy_context()
+        future = _pool.try_submit(ctx.run, _run_tool_call, tool_map[call.get("name")], call.get("args"), postprocess, started)
+        if future is None:
+            return False
+        in_flight[future] = (index, started)
+        progress.started(call)
+        return True
+
+    def deadline(started: List[float]) -> float:
+        # Aún sin arrancar (el hilo está recogiendo la tarea): el plazo completo empieza ahora
+        return (started[0] if started else time.monotonic()) + timeout
+
+    pending.reverse()
+    while pending or in_flight:
+        while pending and len(in_flight) < max_parallel and submit(pending[-1]):
+            pending.pop()
+
+        wait_for = None
+        if in_flight:
+            wait_for = max(0.0, min(deadline(started) for _, started in in_flight.values()) - time.monotonic())
+        if pending and len(in_flight) < max_parallel:
+            # Pool lleno por otras peticiones: se espera a que se libere un cupo (también
+            # lo liberan las llamadas propias al terminar) o al próximo vencimiento
+            _pool.wait_for_slot(wait_for)
+            done = [future for future in in_flight if future.done()]
+        else:
+            done, _ = wait(in_flight, timeout=wait_for, return_when=FIRST_COMPLETED)
+
+        for future in done:
+            index, _ = in_flight.pop(future)
+            call = tool_calls[index]
+            try:
+                output, summarized = future.result()
+                results[index] = ToolMessage(content=output, tool_call_id=call.get("id"))
+                progress.finished(call, "ok", summarized)
+            except Exception as e:
+                results[index] = ToolMessage(content=f"Error al ejecutar '{call.get('name')}': {e}", tool_call_id=call.get("id"))
+                progress.finished(call, "error")
+
+        now = time.monotonic()
+        for future, (index, started) in list(in_flight.items()):
+            if started and started[0] + timeout <= now:
+                # El hilo no puede interrumpirse; se abandona su resultado y su cupo pasa a la reserva
+                _pool.abandon(future)
+                del in_flight[future]
+                call = tool_calls[index]
+                logger.warning(f"Timeout ejecutando herramienta '{call.get('name')}' tras {timeout:.0f}s")
+                results[index] = ToolMessage(content=f"Error: la herramienta '{call.get('name')}' excedió el tiempo límite de {timeout:.0f}s.", tool_call_id=call.get("id"))
+                progress.finished(call, "timeout")
+
+    return results
+
+
+async def _arun_tool_call(tool, args: Dict[str, Any], postprocess: Optional[Callable[[str], str]]) -> Tuple[str, bool]:
+    """Variante asíncrona de _run_tool_call"""
+    raw = str(await tool.ainvoke(args))
+    output = await asyncio.to_thread(postprocess, raw) if postprocess else raw
+    return output, output != raw
+
+
+async def aexecute_tool_calls(tool_calls: List[Dict[str, Any]], tool_map: Dict[str, Any],
+                              postprocess: Optional[Callable[[str], str]] = None,
+                              timeout: float = None, max_parallel: int = None,
+                              on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> List[ToolMessage]:
+    """Variante asíncrona de execute_tool_calls para el modo de servicio ASGI"""
+    progress = _ProgressReporter(on_event)
+    timeout = TOOL_CALL_TIMEOUT if timeout is None else timeout
+    semaphore = asyncio.Semaphore(max(1, MAX_PARALLEL_TOOL_CALLS if max_parallel is None else max_parallel))
+
+    async def run(call: Dict[str, Any]) -> ToolMessage:
+        tool_name = call.get("name")
+        if tool_name not in tool_map:
+            return ToolMessage(content=f"Error: Herramienta '{tool_name}' no encontrada.", tool_call_id=call.get("id"))
+        async with semaphore:
+            progress.started(call)
+            try:
+                output, summarized = await asyncio.wait_for(_arun_tool_call(tool_map[tool_name], call.get("args"), postprocess), timeout)
+                progress.finished(call, "ok", summarized)
+                return ToolMessage(content=output, tool_call_id=call.get("id"))
+            except asyncio.TimeoutError:
+                logger.warning(f"Timeout ejecutando herramienta '{tool_name}' tras {timeout:.0f}s")
+                progress.finished(call, "timeout")
+                return ToolMessage(content=f"Error: la herramienta '{tool_name}' excedió el tiempo límite de {timeout:.0f}s.", tool_call_id=call.get("id"))
+            except Exception as e:
+                progress.finished(call, "error")
+                return ToolMessage(content=f"Error al ejecutar '{tool_name}': {e}", tool_call_id=call.get("id"))
+
+    return list(await asyncio.gather(*(run(call) for call in tool_calls)))
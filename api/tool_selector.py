@@ -0,0 +1,154 @@
+# api/tool_selector.py - Preselección por consulta de las herramientas que se enlazan al modelo
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from api.models import get_embedding_model
+
+logger = logging.getLogger("tool_selector")
+
+TOOL_SELECTION_ENABLED = os.environ.get("TOOL_SELECTION_ENABLED", "true").lower() in ("1", "true", "yes")
+TOOL_SELECTION_TOP_K = int(os.environ.get("TOOL_SELECTION_TOP_K", "8"))
+# Herramientas que se enlazan siempre, sea cual sea la consulta
+TOOL_SELECTION_PINNED = [name.strip() for name in os.environ.get(
+    "TOOL_SELECTION_PINNED", "internet_search,analyze_url_content,search_my_documents").split(",") if name.strip()]
+TOOL_SELECTION_CACHE_SIZE = int(os.environ.get("TOOL_SELECTION_CACHE_SIZE", "512"))
+TOOL_BINDING_CACHE_SIZE = int(os.environ.get("TOOL_BINDING_CACHE_SIZE", "64"))
+TOOL_EMBEDDING_CACHE_SIZE = int(os.environ.get("TOOL_EMBEDDING_CACHE_SIZE", "4096"))
+
+# Embeddings de descripciones compartidos entre selectores (catálogo global y por usuario)
+_DESCRIPTION_VECTORS: "OrderedDict[str, np.ndarray]" = OrderedDict()
+_DESCRIPTION_LOCK = threading.Lock()
+
+
+def tool_set_fingerprint(names: Sequence[str]) -> str:
+    """Huella estable de un conjunto de herramientas"""
+    return hashlib.sha256("\n".join(sorted(names)).encode("utf-8")).hexdigest()[:16]
+
+
+def _tool_text(tool) -> str:
+    return f"{tool.name}: {tool.description or ''}"
+
+
+def _embed_descriptions(texts: List[str]) -> np.ndarray:
+    """Embeddings normalizados de las descripciones; solo se calculan los que no estén en caché"""
+    keys = [hashlib.sha256(text.encode("utf-8")).hexdigest() for text in texts]
+    with _DESCRIPTION_LOCK:
+        missing = [(key, text) for key, text in zip(keys, texts) if key not in _DESCRIPTION_VECTORS]
+    if missing:
+        vectors = np.asarray(get_embedding_model().embed_documents([text for _, text in missing]), dtype=np.float32)
+        vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+        with _DESCRIPTION_LOCK:
+            for (key, _), vector in zip(missing, vectors):
+                _DESCRIPTION_VECTORS[key] = vector
+            while len(_DESCRIPTION_VECTORS) > TOOL_EMBEDDING_CACHE_SIZE:
+                _DESCRIPTION_VECTORS.popitem(last=False)
+        fresh = {key: vector for (key, _), vector in zip(missing, vectors)}
+    else:
+        fresh = {}
+    with _DESCRIPTION_LOCK:
+        return np.stack([fresh[key] if key in fresh else _DESCRIPTION_VECTORS[key] for key in keys])
+
+
+class ToolSelector:
+    """Enlaza al modelo solo las top-k herramientas relevantes para cada mensaje.
+
+    Las descripciones se embeben una vez al construir el selector; cada consulta
+    se compara por coseno y se le añade el conjunto fijo de TOOL_SELECTION_PINNED.
+    Los modelos con herramientas enlazadas se cachean por huella del conjunto.
+    """
+
+    def __init__(self, llm, tools: Sequence[Any], top_k: int = TOOL_SELECTION_TOP_K,
+                 pinned: Sequence[str] = TOOL_SELECTION_PINNED, enabled: bool = TOOL_SELECTION_ENABLED,
+                 specs: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.llm = llm
+        self.tools = list(tools)
+        # Especificaciones compactas del catálogo compilado; si faltan se enlaza la herramienta tal cual
+        self.specs = specs or {}
+        self.top_k = top_k
+        self.pinned = [t.name for t in self.tools if t.name in set(pinned)]
+        self._lock = threading.Lock()
+        self._selections: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._bindings: "OrderedDict[str, Any]" = OrderedDict()
+        self._matrix: Optional[np.ndarray] = None
+        self.stats = {"selections": 0, "selection_hits": 0, "binding_hits": 0, "fallbacks": 0}
+
+        # Con un catálogo pequeño no compensa seleccionar: se enlaza todo
+        self.enabled = enabled and len(self.tools) > len(self.pinned) + top_k
+        if self.enabled:
+            try:
+                self._matrix = _embed_descriptions([_tool_text(t) for t in self.tools])
+                logger.info(f"Selector de herramientas activo: {len(self.tools)} herramientas, top_k={top_k}, "
+                            f"fijas={self.pinned}")
+            except Exception as e:
+                logger.warning(f"No se pudieron embeber las herramientas; se enlazarán todas: {e}")
+                self.enabled = False
+
+    def select(self, query: str) -> List[str]:
+        """Nombres de las herramientas a enlazar para la consulta"""
+        if not self.enabled or not query:
+            return [t.name for t in self.tools]
+
+        key = hashlib.sha256(query.encode("utf-8")).hexdigest()
+        with self._lock:
+            cached = self._selections.get(key)
+            if cached is not None:
+                self._selections.move_to_end(key)
+                self.stats["selection_hits"] += 1
+                return cached
+
+        try:
+            vector = np.asarray(get_embedding_model().embed_query(query), dtype=np.float32)
+            vector /= np.linalg.norm(vector)
+        except Exception as e:
+            logger.warning(f"Error embebiendo la consulta; se enlazan todas las herramientas: {e}")
+            with self._lock:
+                self.stats["fallbacks"] += 1
+            return [t.name for t in self.tools]
+
+        scores = self._matrix @ vector
+        selected = set(self.pinned)
+        for i in np.argsort(-scores):
+            if len(selected) >= len(self.pinned) + self.top_k:
+                break
+            selected.add(self.tools[i].name)
+        # Se conserva el orden del catálogo para que la huella y el prompt sean estables
+        names = [t.name for t in self.tools if t.name in selected]
+
+        with self._lock:
+            self.stats["selections"] += 1
+            self._selections[key] = names
+            while len(self._selections) > TOOL_SELECTION_CACHE_SIZE:
+                self._selections.popitem(last=False)
+        return names
+
+    def bind_for(self, query: str, llm=None):
+        """Modelo (`llm` o el del selector) con las herramientas seleccionadas enlazadas, cacheado por huella"""
+        llm = llm or self.llm
+        names = self.select(query)
+        model_name = getattr(llm, "model_name", None) or getattr(llm, "model", "")
+        fingerprint = f"{type(llm).__name__}:{model_name}:{tool_set_fingerprint(names)}"
+        with self._lock:
+            bound = self._bindings.get(fingerprint)
+            if bound is not None:
+                self._bindings.move_to_end(fingerprint)
+                self.stats["binding_hits"] += 1
+                return bound
+
+        selected = set(names)
+        bound = llm.bind_tools([self.specs.get(t.name, t) for t in self.tools if t.name in selected])
+        with self._lock:
+            self._bindings[fingerprint] = bound
+            while len(self._bindings) > TOOL_BINDING_CACHE_SIZE:
+                self._bindings.popitem(last=False)
+        return bound
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "enabled": self.enabled, "catalog_size": len(self.tools),
+                    "cached_bindings": len(self._bindings)}
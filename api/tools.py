@@ -3,11 +3,13 @@ import os
 import requests
 import logging
 import json
+import asyncio
 import numpy as np
 from abc import ABC, abstractmethod
 from typing import Dict, Any, Optional, List
 from supabase.client import Client
 from langchain_openai import OpenAIEmbeddings
+from api.async_runtime import run_sync
 
 # Importar herramientas matemáticas avanzadas
 try:
@@ -34,7 +36,22 @@ class BaseTool(ABC):
         """Valida las entradas de la herramienta"""
         return True
 
-class InternetSearchTool(BaseTool):
+class BlockingTool(BaseTool):
+    """Herramienta con trabajo bloqueante (E/S síncrona o cálculo intensivo).
+
+    Se ejecuta en un hilo del executor para no bloquear el bucle de eventos compartido.
+    """
+    
+    async def execute(self, **kwargs) -> str:
+        """Ejecuta la herramienta fuera del bucle de eventos"""
+        return await asyncio.to_thread(self.run_blocking, **kwargs)
+    
+    @abstractmethod
+    def run_blocking(self, **kwargs) -> str:
+        """Implementación síncrona de la herramienta"""
+        pass
+
+class InternetSearchTool(BlockingTool):
     """Herramienta de búsqueda en internet usando Jina AI"""
     
     def __init__(self):
@@ -43,7 +60,7 @@ class InternetSearchTool(BaseTool):
             description="Realiza búsquedas en internet para obtener información actualizada"
         )
     
-    async def execute(self, query: str) -> str:
+    def run_blocking(self, query: str) -> str:
         """Ejecuta búsqueda en internet"""
         self.logger.info(f"Ejecutando búsqueda para: '{query}'")
         
@@ -73,7 +90,7 @@ class InternetSearchTool(BaseTool):
             self.logger.error(f"Error inesperado: {e}")
             return "Error inesperado al buscar en internet."
 
-class URLAnalyzerTool(BaseTool):
+class URLAnalyzerTool(BlockingTool):
     """Herramienta para analizar contenido de URLs con OCR"""
     
     def __init__(self):
@@ -82,7 +99,7 @@ class URLAnalyzerTool(BaseTool):
             description="Analiza contenido de URLs usando OCR para extraer texto de imágenes"
         )
     
-    async def execute(self, url: str) -> str:
+    def run_blocking(self, url: str) -> str:
         """Analiza contenido de URL"""
         self.logger.info(f"Analizando URL: {url}")
         
@@ -118,7 +135,7 @@ class URLAnalyzerTool(BaseTool):
             self.logger.error(f"Error inesperado: {e}")
             return "Error inesperado al analizar la URL."
 
-class DocumentSearchTool(BaseTool):
+class DocumentSearchTool(BlockingTool):
     """Herramienta para buscar en documentos personales usando RAG"""
     
     def __init__(self):
@@ -127,7 +144,7 @@ class DocumentSearchTool(BaseTool):
             description="Busca información en documentos personales del usuario"
         )
     
-    async def execute(self, query: str, supabase_user_client: Client) -> str:
+    def run_blocking(self, query: str, supabase_user_client: Client) -> str:
         """Busca en documentos personales"""
         self.logger.info(f"Buscando en documentos: '{query}'")
         
@@ -166,7 +183,7 @@ class DocumentSearchTool(BaseTool):
 
 # ========== HERRAMIENTAS MATEMÁTICAS AVANZADAS ==========
 
-class MonteCarloTool(BaseTool):
+class MonteCarloTool(BlockingTool):
     """Herramienta para simulaciones Monte Carlo"""
     
     def __init__(self):
@@ -175,7 +192,7 @@ class MonteCarloTool(BaseTool):
             description="Simulaciones Monte Carlo para análisis financiero y de riesgo"
         )
     
-    async def execute(self, scenario: str, **kwargs) -> str:
+    def run_blocking(self, scenario: str, **kwargs) -> str:
         """Ejecuta simulación Monte Carlo"""
         if not MATH_TOOLS_AVAILABLE:
             return "Error: Herramientas matemáticas no disponibles. Instalar numpy, scipy, scikit-learn."
@@ -237,7 +254,7 @@ Resultados:
             self.logger.error(f"Error en simulación Monte Carlo: {e}")
             return f"Error en simulación Monte Carlo: {str(e)}"
 
-class RegressionTool(BaseTool):
+class RegressionTool(BlockingTool):
     """Herramienta para análisis de regresión"""
     
     def __init__(self):
@@ -246,7 +263,7 @@ class RegressionTool(BaseTool):
             description="Análisis de regresión lineal y polinómica con validación"
         )
     
-    async def execute(self, x_data: list, y_data: list, polynomial_degree: int = 1) -> str:
+    def run_blocking(self, x_data: list, y_data: list, polynomial_degree: int = 1) -> str:
         """Ejecuta análisis de regresión"""
         if not MATH_TOOLS_AVAILABLE:
             return "Error: Herramientas matemáticas no disponibles."
@@ -296,7 +313,7 @@ Coeficientes del modelo:
             self.logger.error(f"Error en análisis de regresión: {e}")
             return f"Error en análisis de regresión: {str(e)}"
 
-class ProjectionTool(BaseTool):
+class ProjectionTool(BlockingTool):
     """Herramienta para proyecciones financieras"""
     
     def __init__(self):
@@ -305,7 +322,7 @@ class ProjectionTool(BaseTool):
             description="Proyecciones financieras usando diferentes métodos estadísticos"
         )
     
-    async def execute(self, data: list, periods_ahead: int = 12, method: str = "linear") -> str:
+    def run_blocking(self, data: list, periods_ahead: int = 12, method: str = "linear") -> str:
         """Ejecuta proyecciones financieras"""
         if not MATH_TOOLS_AVAILABLE:
             return "Error: Herramientas matemáticas no disponibles."
@@ -358,7 +375,7 @@ Proyecciones con intervalos de confianza 95%:
             self.logger.error(f"Error en proyecciones: {e}")
             return f"Error en proyecciones financieras: {str(e)}"
 
-class PortfolioOptimizationTool(BaseTool):
+class PortfolioOptimizationTool(BlockingTool):
     """Herramienta para optimización de portafolios"""
     
     def __init__(self):
@@ -367,7 +384,7 @@ class PortfolioOptimizationTool(BaseTool):
             description="Optimización de portafolios de inversión usando teoría moderna"
         )
     
-    async def execute(self, expected_returns: list, cov_matrix: list, risk_tolerance: float = 1.0) -> str:
+    def run_blocking(self, expected_returns: list, cov_matrix: list, risk_tolerance: float = 1.0) -> str:
         """Ejecuta optimización de portafolio"""
         if not MATH_TOOLS_AVAILABLE:
             return "Error: Herramientas matemáticas no disponibles."
@@ -407,7 +424,7 @@ Pesos óptimos por activo:
             self.logger.error(f"Error en optimización de portafolio: {e}")
             return f"Error en optimización de portafolio: {str(e)}"
 
-class StatisticalAnalysisTool(BaseTool):
+class StatisticalAnalysisTool(BlockingTool):
     """Herramienta para análisis estadístico completo"""
     
     def __init__(self):
@@ -416,7 +433,7 @@ class StatisticalAnalysisTool(BaseTool):
             description="Análisis estadístico completo con pruebas de normalidad y detección de outliers"
         )
     
-    async def execute(self, data: list, confidence_level: float = 0.95) -> str:
+    def run_blocking(self, data: list, confidence_level: float = 0.95) -> str:
         """Ejecuta análisis estadístico completo"""
         if not MATH_TOOLS_AVAILABLE:
             return "Error: Herramientas matemáticas no disponibles."
@@ -547,12 +564,8 @@ class ToolRegistry:
             if not tool.validate_inputs(**kwargs):
                 return f"Entradas inválidas para herramienta '{name}'"
             
-            # Para compatibilidad con el sistema actual
-            if name == "search_my_documents":
-                return tool.execute(**kwargs)
-            else:
-                import asyncio
-                return asyncio.run(tool.execute(**kwargs))
+            # Todas las herramientas se ejecutan en el bucle de eventos compartido
+            return run_sync(tool.execute(**kwargs))
                 
         except Exception as e:
             logging.error(f"Error ejecutando herramienta {name}: {e}")
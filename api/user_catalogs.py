@@ -0,0 +1,138 @@
+# api/user_catalogs.py - Catálogos de herramientas por usuario con caché LRU + TTL
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+
+from api.supabase_pool import get_user_supabase_client
+
+logger = logging.getLogger("user_catalogs")
+
+USER_CATALOG_CACHE_SIZE = int(os.environ.get("USER_CATALOG_CACHE_SIZE", "1024"))
+USER_CATALOG_TTL = float(os.environ.get("USER_CATALOG_TTL", "300"))
+
+
+class UserSession:
+    """Credenciales vigentes de un usuario para las herramientas que acceden a sus datos.
+
+    Se actualiza en cada petición, de modo que un catálogo cacheado nunca usa un
+    token caducado mientras el usuario siga enviando uno válido.
+    """
+
+    def __init__(self, authorization: str):
+        self.authorization = authorization
+
+    def update(self, authorization: str):
+        if authorization:
+            self.authorization = authorization
+
+    def client(self):
+        return get_user_supabase_client(self.authorization)
+
+
+@dataclass
+class ToolCatalog:
+    """Herramientas ejecutables y selector enlazado para un usuario (o el catálogo por defecto)"""
+    tools: List[Any]
+    selector: Any
+    scope: str
+    report: Dict[str, Any] = field(default_factory=dict)
+    session: Optional[UserSession] = None
+    created_at: float = field(default_factory=time.time)
+
+    def __post_init__(self):
+        self.tool_map = {tool.name: tool for tool in self.tools}
+
+
+class UserCatalogCache:
+    """Caché LRU + TTL de catálogos por usuario; la construcción es única por usuario"""
+
+    def __init__(self, max_size: int = USER_CATALOG_CACHE_SIZE, ttl: float = USER_CATALOG_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, ToolCatalog]" = OrderedDict()
+        # Lock de construcción por usuario con el número de peticiones que lo usan, para poder descartarlo
+        self._build_locks: Dict[str, List[Any]] = {}
+        self._lock = threading.Lock()
+        self._generation = 0
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def _get_fresh(self, user_id: str) -> Optional[ToolCatalog]:
+        catalog = self._entries.get(user_id)
+        if catalog is None:
+            return None
+        if time.time() - catalog.created_at > self.ttl:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return catalog
+
+    def _acquire_build_lock(self, user_id: str) -> threading.Lock:
+        # Se llama con self._lock tomado
+        entry = self._build_locks.setdefault(user_id, [threading.Lock(), 0])
+        entry[1] += 1
+        return entry[0]
+
+    def _release_build_lock(self, user_id: str):
+        with self._lock:
+            entry = self._build_locks[user_id]
+            entry[1] -= 1
+            if not entry[1]:
+                del self._build_locks[user_id]
+
+    def get_or_build(self, user_id: str, authorization: str,
+                     builder: Callable[[UserSession], ToolCatalog]) -> ToolCatalog:
+        """Catálogo del usuario; lo construye con `builder` si no hay uno vigente"""
+        with self._lock:
+            catalog = self._get_fresh(user_id)
+            if catalog is not None:
+                self.stats["hits"] += 1
+                catalog.session.update(authorization)
+                return catalog
+            build_lock = self._acquire_build_lock(user_id)
+
+        try:
+            # Peticiones concurrentes del mismo usuario esperan a una única construcción
+            with build_lock:
+                with self._lock:
+                    catalog = self._get_fresh(user_id)
+                    if catalog is not None:
+                        self.stats["hits"] += 1
+                        catalog.session.update(authorization)
+                        return catalog
+                    self.stats["misses"] += 1
+                    generation = self._generation
+
+                catalog = builder(UserSession(authorization))
+
+                with self._lock:
+                    # Si se invalidó durante la construcción, el catálogo se usa pero no se guarda
+                    if generation == self._generation:
+                        self._entries[user_id] = catalog
+                        self._entries.move_to_end(user_id)
+                        while len(self._entries) > self.max_size:
+                            self._entries.popitem(last=False)
+                return catalog
+        finally:
+            self._release_build_lock(user_id)
+
+    def invalidate(self, user_id: Optional[str] = None):
+        """Descarta el catálogo de un usuario, o todos si no se indica"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(user_id, None)
+            self._generation += 1
+            self.stats["invalidations"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self.stats, "size": len(self._entries), "ttl": self.ttl}
+
+
+# Instancia global de la caché
+user_catalogs = UserCatalogCache()
@@ -74,6 +74,7 @@ export function ChatProvider({ children }: { children: ReactNode }) {
         .from('messages')
         .select('*')
         .eq('chat_id', chatId)
+        .in('role', ['user', 'assistant'])
         .order('created_at', { ascending: true });
 
       if (error) throw error;
@@ -159,13 +160,7 @@ export function ChatProvider({ children }: { children: ReactNode }) {
         setActiveThreadId(currentChatId);
       }
 
-      // 2. Guardar mensaje del usuario
-      await supabase.from('messages').insert({ 
-        chat_id: currentChatId, 
-        role: 'user', 
-        content 
-      });
-
+      // 2. Los mensajes (usuario, asistente y herramientas) los guarda el backend en segundo plano
       if (newChatCreated) {
         await loadUserChats();
       }
@@ -255,16 +250,7 @@ export function ChatProvider({ children }: { children: ReactNode }) {
         }
       }
 
-      // 5. Guardar respuesta final
-      if (assistantContent.trim()) {
-        await supabase.from('messages').insert({
-          chat_id: currentChatId,
-          role: 'assistant',
-          content: assistantContent,
-        });
-      }
-
-      // 6. Actualizar timestamp del chat
+      // 5. Actualizar timestamp del chat
       await supabase
         .from('chats')
         .update({ updated_at: new Date().toISOString() })
@@ -0,0 +1,140 @@
+# tests/test_admission.py - Cola de admisión de /api/chat y tickets con varios titulares
+import asyncio
+import threading
+import time
+
+from api.admission import AdmissionController
+
+
+def _controller(**kwargs):
+    options = {"max_in_flight": 1, "per_user": 2, "queue_size": 1, "queue_timeout": 0.1, "enabled": True}
+    return AdmissionController(**{**options, **kwargs})
+
+
+def test_admits_until_the_global_limit():
+    controller = _controller(max_in_flight=2)
+    first, rejection = controller.acquire("a")
+    assert first is not None and rejection is None
+    second, rejection = controller.acquire("b")
+    assert second is not None and rejection is None
+    assert controller.get_stats()["in_flight"] == 2
+
+
+def test_per_user_limit_rejects_immediately():
+    controller = _controller(max_in_flight=5, per_user=1)
+    controller.acquire("a")
+    ticket, rejection = controller.acquire("a")
+    assert ticket is None and rejection.reason == "user_limit"
+    assert rejection.retry_after >= 1
+
+
+def test_queue_timeout_rejects_and_leaves_no_trace():
+    controller = _controller()
+    holder, _ = controller.acquire("a")
+
+    started = time.monotonic()
+    ticket, rejection = controller.acquire("b")
+
+    assert ticket is None and rejection.reason == "queue_timeout"
+    assert 0.1 <= time.monotonic() - started < 1
+    stats = controller.get_stats()
+    assert stats["queue_depth"] == 0 and stats["active_users"] == 1 and stats["rejected_queue_timeout"] == 1
+    holder.release()
+    assert controller.get_stats()["in_flight"] == 0
+
+
+def test_full_queue_rejects_without_waiting():
+    controller = _controller(queue_timeout=5)
+    controller.acquire("a")
+    waiter = threading.Thread(target=controller.acquire, args=("b",))
+    waiter.start()
+    while not controller.get_stats()["queue_depth"]:
+        time.sleep(0.01)
+
+    started = time.monotonic()
+    ticket, rejection = controller.acquire("c")
+
+    assert ticket is None and rejection.reason == "queue_full"
+    assert time.monotonic() - started < 0.5
+    controller._queue[0].wake()
+    waiter.join(1)
+
+
+def test_release_hands_the_slot_to_the_first_waiter():
+    controller = _controller(queue_timeout=5)
+    holder, _ = controller.acquire("a")
+    result = {}
+    waiter = threading.Thread(target=lambda: result.update(zip(("ticket", "rejection"), controller.acquire("b"))))
+    waiter.start()
+    while not controller.get_stats()["queue_depth"]:
+        time.sleep(0.01)
+
+    holder.release()
+    waiter.join(1)
+
+    assert result["rejection"] is None and result["ticket"].user_id == "b"
+    assert controller.get_stats()["in_flight"] == 1
+    result["ticket"].release()
+    assert controller.get_stats()["in_flight"] == 0 and controller.get_stats()["active_users"] == 0
+
+
+def test_ticket_is_released_only_when_every_holder_lets_go():
+    controller = _controller()
+    ticket, _ = controller.acquire("a")
+    ticket.retain("generation")
+
+    ticket.release()
+    ticket.release()
+    assert controller.get_stats()["in_flight"] == 1
+
+    ticket.release("generation")
+    assert controller.get_stats()["in_flight"] == 0
+
+    # Tras liberarse no se puede volver a retener ni liberar dos veces
+    ticket.retain("generation")
+    ticket.release("generation")
+    assert controller.get_stats()["in_flight"] == 0
+
+
+def test_async_acquire_times_out_and_is_granted_on_release():
+    controller = _controller(queue_timeout=0.1)
+
+    async def scenario():
+        holder, _ = await controller.aacquire("a")
+        ticket, rejection = await controller.aacquire("b")
+        assert ticket is None and rejection.reason == "queue_timeout"
+
+        controller.queue_timeout = 5
+        pending = asyncio.create_task(controller.aacquire("b"))
+        while not controller.get_stats()["queue_depth"]:
+            await asyncio.sleep(0.01)
+        holder.release()
+        ticket, rejection = await asyncio.wait_for(pending, 1)
+        assert rejection is None and ticket.user_id == "b"
+        ticket.release()
+
+    asyncio.run(scenario())
+    assert controller.get_stats()["in_flight"] == 0
+
+
+def test_cancelled_async_waiter_leaves_the_queue():
+    controller = _controller(queue_timeout=5)
+
+    async def scenario():
+        await controller.aacquire("a")
+        pending = asyncio.create_task(controller.aacquire("b"))
+        while not controller.get_stats()["queue_depth"]:
+            await asyncio.sleep(0.01)
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+
+    asyncio.run(scenario())
+    stats = controller.get_stats()
+    assert stats["queue_depth"] == 0 and stats["active_users"] == 1
+
+
+def test_disabled_controller_always_admits():
+    controller = _controller(enabled=False, max_in_flight=0)
+    ticket, rejection = controller.acquire("a")
+    assert ticket is not None and rejection is None
+    ticket.release()
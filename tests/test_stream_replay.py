@@ -0,0 +1,147 @@
+# tests/test_stream_replay.py - Reanudación de streams SSE y búfer de reenvío
+import asyncio
+import threading
+from collections import deque
+
+import pytest
+
+from api.stream_replay import StreamRegistry, StreamRun, parse_event_id
+
+
+def _payloads(frames):
+    """Quita la línea `id:` de cada frame"""
+    return [frame.split("\n", 1)[1] for frame in frames]
+
+
+def _finished_run(registry, count, user_id="u1"):
+    run = registry.start("key", user_id)
+    for i in range(1, count + 1):
+        run.append(f"data: {i}\n\n")
+    run.finish()
+    return run
+
+
+def test_event_ids_are_sequential_and_parseable():
+    run = _finished_run(StreamRegistry(), 3)
+    frames, last, finished = run.frames_after(0)
+    assert last == 3 and finished
+    assert [parse_event_id(f.split("\n", 1)[0][len("id: "):]) for f in frames] == [(run.run_id, i) for i in (1, 2, 3)]
+
+
+def test_resume_after_event_id_replays_only_missing_frames():
+    registry = StreamRegistry()
+    run = _finished_run(registry, 5)
+
+    resumed, after = registry.resume(f"{run.run_id}:2", "u1")
+
+    assert resumed is run and after == 2
+    assert _payloads(resumed.iter_frames(after)) == ["data: 3\n\n", "data: 4\n\n", "data: 5\n\n"]
+    assert registry.get_stats()["resumed"] == 1
+
+
+def test_resume_past_the_last_frame_returns_nothing():
+    run = _finished_run(StreamRegistry(), 2)
+    assert run.frames_after(2) == ([], 2, True)
+    assert run.frames_after(7) == ([], 7, True)
+
+
+def test_frames_after_with_evicted_frames_returns_what_is_left():
+    run = StreamRun("key", "u1")
+    run._frames = deque(maxlen=3)
+    for i in range(1, 7):
+        run.append(f"data: {i}\n\n")
+
+    frames, last, finished = run.frames_after(1)
+
+    assert _payloads(frames) == ["data: 4\n\n", "data: 5\n\n", "data: 6\n\n"]
+    assert last == 6 and not finished
+    assert run.frames_after(5) == (frames[2:], 6, False)
+
+
+@pytest.mark.parametrize("event_id", ["", "basura", "desconocido:3", "abc:def"])
+def test_resume_unknown_event_id_is_rejected(event_id):
+    registry = StreamRegistry()
+    _finished_run(registry, 1)
+    assert registry.resume(event_id, "u1") == (None, 0)
+    assert registry.get_stats()["expired_resumes"] == 1
+
+
+def test_resume_of_an_expired_run_is_rejected():
+    registry = StreamRegistry(retention=0)
+    run = _finished_run(registry, 2)
+    run.finished_at -= 1
+    assert registry.resume(f"{run.run_id}:1", "u1") == (None, 0)
+
+
+def test_resume_of_another_users_run_is_rejected():
+    registry = StreamRegistry()
+    run = _finished_run(registry, 2, user_id="u1")
+    assert registry.resume(f"{run.run_id}:1", "u2") == (None, 0)
+
+
+def test_prune_never_evicts_active_runs():
+    registry = StreamRegistry(max_runs=2)
+    active = registry.start("a", "u1")
+    _finished_run(registry, 1)
+    _finished_run(registry, 1)
+    registry.start("b", "u1")
+    assert registry.resume(f"{active.run_id}:0", "u1")[0] is active
+
+
+def test_find_active_only_matches_running_generations():
+    registry = StreamRegistry()
+    done = _finished_run(registry, 1)
+    assert registry.find_active(done.key) is None
+    running = registry.start("otra", "u1")
+    assert registry.find_active("otra") is running
+
+
+def test_consumer_racing_the_producer_finish_gets_every_frame_once():
+    for _ in range(50):
+        run = StreamRun("key", "u1")
+        received = []
+        consumer = threading.Thread(target=lambda: received.extend(run.iter_frames(0, heartbeat=0.01)))
+        consumer.start()
+        for i in range(1, 51):
+            run.append(f"data: {i}\n\n")
+        run.finish()
+        consumer.join(timeout=5)
+
+        assert not consumer.is_alive()
+        assert _payloads(f for f in received if f.startswith("id:")) == [f"data: {i}\n\n" for i in range(1, 51)]
+
+
+def test_async_consumer_follows_a_producer_thread_until_finish():
+    run = StreamRun("key", "u1")
+
+    def produce():
+        for i in range(1, 21):
+            run.append(f"data: {i}\n\n")
+        run.finish()
+
+    async def consume():
+        producer = threading.Thread(target=produce)
+        producer.start()
+        frames = [frame async for frame in run.aiter_frames(0, heartbeat=0.01) if frame.startswith("id:")]
+        producer.join()
+        return frames
+
+    frames = asyncio.run(asyncio.wait_for(consume(), 5))
+    assert _payloads(frames) == [f"data: {i}\n\n" for i in range(1, 21)]
+    assert not run._listeners
+
+
+def test_chat_endpoint_answers_410_for_an_unknown_event_id(monkeypatch):
+    index = pytest.importorskip("api.index")
+    user = type("User", (), {"id": "u1"})()
+    monkeypatch.setattr(index, "get_or_create_agent_graph", lambda: object())
+    monkeypatch.setattr(index, "get_user_from_token", lambda request: (user, None))
+
+    client = index.app.test_client()
+    response = client.post("/api/chat", json={"messages": []}, headers={"Last-Event-ID": "desconocido:4"})
+    assert response.status_code == 410
+
+    run = _finished_run(index.stream_runs, 3)
+    response = client.post("/api/chat", json={"messages": []}, headers={"Last-Event-ID": f"{run.run_id}:1"})
+    assert response.status_code == 200
+    assert response.get_data(as_text=True) == f"id: {run.run_id}:2\ndata: 2\n\nid: {run.run_id}:3\ndata: 3\n\n"
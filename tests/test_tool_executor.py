@@ -0,0 +1,123 @@
+# tests/test_tool_executor.py - Timeouts por llamada y cupos del pool de herramientas
+import threading
+import time
+
+import pytest
+
+import api.tool_executor as tool_executor
+from api.tool_executor import _ToolPool, execute_tool_calls
+
+
+class _Tool:
+    """Herramienta que tarda `delay` segundos o hasta que se libere `gate`"""
+
+    def __init__(self, name, delay=0.0, gate=None):
+        self.name = name
+        self.delay = delay
+        self.gate = gate
+
+    def invoke(self, args):
+        if self.gate is not None:
+            self.gate.wait(10)
+        else:
+            time.sleep(self.delay)
+        return f"{self.name} ok"
+
+
+def _calls(*names):
+    return [{"name": name, "id": str(i), "args": {}} for i, name in enumerate(names)]
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    def install(workers=4, max_abandoned=4):
+        pool = _ToolPool(workers=workers, max_abandoned=max_abandoned)
+        monkeypatch.setattr(tool_executor, "_pool", pool)
+        return pool
+    return install
+
+
+@pytest.fixture
+def gate():
+    gate = threading.Event()
+    yield gate
+    # Deja terminar las llamadas abandonadas
+    gate.set()
+
+
+def test_results_keep_call_order_and_report_unknown_tools(pool):
+    pool()
+    tools = {"a": _Tool("a", 0.05), "b": _Tool("b")}
+    results = execute_tool_calls(_calls("a", "falta", "b"), tools)
+    assert [m.content for m in results] == ["a ok", "Error: Herramienta 'falta' no encontrada.", "b ok"]
+    assert [m.tool_call_id for m in results] == ["0", "1", "2"]
+
+
+def test_slow_call_times_out_without_delaying_the_others(pool, gate):
+    pool()
+    tools = {"lenta": _Tool("lenta", gate=gate), "rapida": _Tool("rapida", 0.01)}
+    events = []
+
+    started = time.monotonic()
+    results = execute_tool_calls(_calls("lenta", "rapida"), tools, timeout=0.2, on_event=events.append)
+
+    assert time.monotonic() - started < 1
+    assert "excedió el tiempo límite" in results[0].content
+    assert results[1].content == "rapida ok"
+    assert {(e["tool"], e["status"]) for e in events if e["event"] == "tool_finished"} == {
+        ("lenta", "timeout"), ("rapida", "ok")}
+
+
+def test_timeout_starts_when_the_call_runs_not_when_it_is_queued(pool):
+    pool()
+    tools = {"t": _Tool("t", 0.1)}
+    # Una sola en vuelo: la última espera ~0.3s, más que el timeout, pero cada una dura 0.1s
+    results = execute_tool_calls(_calls("t", "t", "t", "t"), tools, timeout=0.25, max_parallel=1)
+    assert [m.content for m in results] == ["t ok"] * 4
+
+
+def test_abandoned_call_moves_to_the_reserve_and_frees_its_slot(pool, gate):
+    tool_pool = pool(workers=1, max_abandoned=1)
+    tools = {"lenta": _Tool("lenta", gate=gate), "rapida": _Tool("rapida")}
+
+    execute_tool_calls(_calls("lenta"), tools, timeout=0.1)
+    assert tool_pool.get_stats()["abandoned"] == 1
+
+    # El único cupo vuelve a estar libre aunque la llamada abandonada siga en su hilo
+    started = time.monotonic()
+    assert execute_tool_calls(_calls("rapida"), tools, timeout=1)[0].content == "rapida ok"
+    assert time.monotonic() - started < 0.5
+
+    gate.set()
+    deadline = time.monotonic() + 2
+    while tool_pool.get_stats()["abandoned"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert tool_pool.get_stats()["abandoned"] == 0
+
+
+def test_abandoned_call_keeps_its_slot_once_the_reserve_is_full(pool, gate):
+    tool_pool = pool(workers=2, max_abandoned=1)
+    tools = {"lenta": _Tool("lenta", gate=gate)}
+
+    execute_tool_calls(_calls("lenta", "lenta"), tools, timeout=0.1)
+
+    assert tool_pool.get_stats()["abandoned"] == 1
+    assert tool_pool.try_submit(gate.wait, 10) is not None
+    assert tool_pool.try_submit(gate.wait, 10) is None
+
+
+def test_requests_wait_for_a_slot_held_by_another_request(pool):
+    pool(workers=1, max_abandoned=0)
+    tools = {"t": _Tool("t", 0.05)}
+    results = []
+
+    def request():
+        results.append([m.content for m in execute_tool_calls(_calls("t", "t"), tools, timeout=2)])
+
+    threads = [threading.Thread(target=request) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert results == [["t ok", "t ok"]] * 3